@@ -0,0 +1,274 @@
+# api_server.py
+#
+# Headless HTTP API around the evaluator, for service-to-service use.
+# Runs next to the Streamlit UI (see the Dockerfile) and shares its caches.
+#
+#   POST /prescore  {"prompt": "..."}                              -> instant local estimate, no model call
+#   POST /evaluate  {"prompt": "..."}                              -> evaluation JSON
+#   POST /answer    {"prompt": "...", "force": false}               -> {"answer": "..."}
+#   POST /compare   {"prompt": "...", "improved_prompt": "..."}     -> both answers
+#   GET  /health                                                    -> queue status
+#   GET  /metrics                                                   -> Prometheus metrics
+#
+# At most API_CONCURRENCY generations run at once (defaults to LLM_CONCURRENCY,
+# i.e. what the configured backend serves concurrently); up to API_MAX_QUEUE
+# more wait for a slot, and anything beyond that is rejected with 429 so
+# clients can back off. Model calls are then queued fairly per client
+# (X-Session-Id header or address); calls that can't start within
+# LLM_QUEUE_TIMEOUT get 503.
+
+import asyncio
+import contextvars
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from aiohttp import web
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+
+from evaluator import (
+    LLM_CONCURRENCY,
+    RequestShedError,
+    call_llm_answer,
+    call_prompt_evaluator,
+    evaluator_parse_stats,
+    current_session,
+    get_backend,
+    get_scheduler,
+    get_single_flight,
+    get_warm_manager,
+    get_warm_managers,
+)
+from heuristic_scorer import prescore_prompt, worth_model_call
+
+API_HOST = os.getenv("API_HOST", "0.0.0.0")
+API_PORT = int(os.getenv("API_PORT", "8000"))
+API_CONCURRENCY = int(os.getenv("API_CONCURRENCY", str(LLM_CONCURRENCY)))
+API_MAX_QUEUE = int(os.getenv("API_MAX_QUEUE", "256"))
+API_RETRY_AFTER = int(os.getenv("API_RETRY_AFTER", "5"))   # seconds suggested to rejected clients
+
+
+class AdmissionGate:
+    """
+    Bounded admission in front of Ollama: a slot pool for running jobs
+    plus a bounded waiting line. Jobs run in worker threads because the
+    evaluator helpers are blocking.
+    """
+
+    def __init__(self, concurrency: int, max_queue: int):
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+        self.pending = 0   # admitted jobs, running or waiting
+        self.running = 0
+        self.rejected = 0
+        self._slots = asyncio.Semaphore(concurrency)
+        self._executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="api")
+
+    def try_admit(self, jobs: int = 1) -> bool:
+        """
+        Reserve room for `jobs` jobs, or return False if the queue is full.
+        """
+        if self.pending + jobs > self.concurrency + self.max_queue:
+            self.rejected += 1
+            return False
+        self.pending += jobs
+        return True
+
+    async def run(self, func, *args, session: str = "api"):
+        """
+        Run an admitted job once a slot is free. Its model calls are queued
+        under `session` by the evaluator's fair scheduler.
+        """
+        context = contextvars.copy_context()
+        context.run(current_session.set, session)
+        try:
+            async with self._slots:
+                self.running += 1
+                try:
+                    loop = asyncio.get_running_loop()
+                    return await loop.run_in_executor(self._executor, context.run, func, *args)
+                finally:
+                    self.running -= 1
+        finally:
+            self.pending -= 1
+
+    def stats(self) -> dict:
+        return {
+            "running": self.running,
+            "queued": self.pending - self.running,
+            "concurrency": self.concurrency,
+            "max_queue": self.max_queue,
+            "rejected": self.rejected,
+        }
+
+
+# ---------------------------
+# Request helpers
+# ---------------------------
+
+def too_busy(gate: AdmissionGate) -> web.Response:
+    return web.json_response(
+        {"error": "Server is busy, retry later.", **gate.stats()},
+        status=429,
+        headers={"Retry-After": str(API_RETRY_AFTER)},
+    )
+
+
+async def read_body(request: web.Request) -> dict:
+    try:
+        body = await request.json()
+    except ValueError:
+        raise web.HTTPBadRequest(text="Request body must be JSON.")
+    if not isinstance(body, dict):
+        raise web.HTTPBadRequest(text="Request body must be a JSON object.")
+    return body
+
+
+def get_prompt(body: dict, field: str = "prompt", required: bool = True):
+    prompt = body.get(field)
+    if prompt is None and not required:
+        return None
+    if not isinstance(prompt, str) or not prompt.strip():
+        raise web.HTTPBadRequest(text=f"'{field}' must be a non-empty string.")
+    return prompt
+
+
+def client_session(request: web.Request) -> str:
+    """
+    The session requests are queued under: the X-Session-Id header, or the client address.
+    """
+    return request.headers.get("X-Session-Id") or request.remote or "api"
+
+
+def upstream_error(error: Exception) -> web.Response:
+    if isinstance(error, RequestShedError):
+        return web.json_response(
+            {"error": str(error)}, status=503, headers={"Retry-After": str(max(API_RETRY_AFTER, round(error.eta_s)))}
+        )
+    if isinstance(error, requests.exceptions.Timeout):
+        return web.json_response({"error": "The model took too long to respond."}, status=504)
+    return web.json_response({"error": f"Model call failed: {error}"}, status=502)
+
+
+# ---------------------------
+# Handlers
+# ---------------------------
+
+async def handle_prescore(request: web.Request) -> web.Response:
+    """
+    The heuristic estimate, plus whether a full evaluation is worth a model call.
+    """
+    prescore = prescore_prompt(get_prompt(await read_body(request)))
+    return web.json_response({**prescore, "worth_model_call": worth_model_call(prescore)})
+
+
+async def handle_evaluate(request: web.Request) -> web.Response:
+    gate = request.app["gate"]
+    prompt = get_prompt(await read_body(request))
+    if not gate.try_admit():
+        return too_busy(gate)
+
+    try:
+        evaluation = await gate.run(call_prompt_evaluator, prompt, session=client_session(request))
+    except Exception as e:
+        return upstream_error(e)
+    return web.json_response(evaluation)
+
+
+async def handle_answer(request: web.Request) -> web.Response:
+    gate = request.app["gate"]
+    body = await read_body(request)
+    prompt = get_prompt(body)
+    if not gate.try_admit():
+        return too_busy(gate)
+
+    try:
+        answer = await gate.run(
+            call_llm_answer, prompt, bool(body.get("force", False)), session=client_session(request)
+        )
+    except Exception as e:
+        return upstream_error(e)
+    return web.json_response({"answer": answer})
+
+
+async def handle_compare(request: web.Request) -> web.Response:
+    """
+    Answer the original and the optimized prompt side by side.
+    Without an "improved_prompt", the prompt is evaluated first to get one.
+    As in the UI, one failing side doesn't hide the other answer.
+    """
+    gate = request.app["gate"]
+    body = await read_body(request)
+    prompt = get_prompt(body)
+    improved_prompt = get_prompt(body, "improved_prompt", required=False)
+    force = bool(body.get("force", False))
+
+    if not gate.try_admit(2 if improved_prompt else 3):
+        return too_busy(gate)
+
+    if improved_prompt is None:
+        try:
+            evaluation = await gate.run(call_prompt_evaluator, prompt, session=client_session(request))
+        except Exception as e:
+            gate.pending -= 2   # release the reservation for the answers
+            return upstream_error(e)
+        improved_prompt = evaluation.get("improved_prompt") or prompt
+
+    session = client_session(request)
+    results = await asyncio.gather(
+        gate.run(call_llm_answer, prompt, force, session=session),
+        gate.run(call_llm_answer, improved_prompt, force, session=session),
+        return_exceptions=True,
+    )
+
+    response = {"improved_prompt": improved_prompt, "errors": {}}
+    for key, result in zip(("original_answer", "improved_answer"), results):
+        if isinstance(result, Exception):
+            response[key] = None
+            response["errors"][key] = str(result)
+        else:
+            response[key] = result
+
+    status = 502 if len(response["errors"]) == 2 else 200
+    return web.json_response(response, status=status)
+
+
+async def handle_health(request: web.Request) -> web.Response:
+    return web.json_response(
+        {
+            "status": "ok",
+            **request.app["gate"].stats(),
+            "model_queue": get_scheduler().stats(),
+            "evaluator_parsing": evaluator_parse_stats(),
+            "warm_model": {call: manager.stats() for call, manager in get_warm_managers().items()},
+            "llm_backend": get_backend().stats(),
+            "coalescing": get_single_flight().stats() if get_single_flight() is not None else None,
+        }
+    )
+
+
+async def handle_metrics(request: web.Request) -> web.Response:
+    return web.Response(body=generate_latest(), headers={"Content-Type": CONTENT_TYPE_LATEST})
+
+
+def create_app() -> web.Application:
+    app = web.Application()
+    app["gate"] = AdmissionGate(API_CONCURRENCY, API_MAX_QUEUE)
+    get_warm_manager()   # start preloading the models
+    app.add_routes(
+        [
+            web.post("/prescore", handle_prescore),
+            web.post("/evaluate", handle_evaluate),
+            web.post("/answer", handle_answer),
+            web.post("/compare", handle_compare),
+            web.get("/health", handle_health),
+            web.get("/metrics", handle_metrics),
+        ]
+    )
+    return app
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"), format="%(levelname)s %(name)s: %(message)s")
+    web.run_app(create_app(), host=API_HOST, port=API_PORT)
@@ -1,20 +1,67 @@
 # app_ollama.py
 
-import json
-import textwrap
+import csv
+import io
+import uuid
+
 import requests
 import streamlit as st
-import os
-
-# ---------------------------
-# Basic configuration
-# ---------------------------
-
-# Allow configuring the Ollama URL via environment variable (useful in Docker)
-OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
-OLLAMA_URL = OLLAMA_BASE_URL.rstrip("/") + "/api/chat"
-
-OLLAMA_MODEL = "llama3.3"   # Change if your model has a different name
+from streamlit.runtime import Runtime
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+from async_client import GenerationCancelledError
+from evaluator import (
+    EVALUATOR_MODE,
+    JOB_POLL_INTERVAL,
+    OLLAMA_STREAM,
+    OPTION_PROFILES,
+    SCORE_KEYS,
+    SCORE_MAX,
+    JsonObjectScanner,
+    RequestShedError,
+    call_prompt_evaluator_sections,
+    call_prompt_evaluator_stream,
+    call_prompt_evaluator_with_usage,
+    generate_answers_parallel,
+    get_answer_cache,
+    get_backend,
+    get_cached_evaluation,
+    get_eval_cache,
+    get_generations,
+    get_job_runner,
+    get_scheduler,
+    get_single_flight,
+    get_warm_managers,
+    evaluator_parse_stats,
+    http_pool_stats,
+    parse_evaluation_with_repair,
+    parse_partial_scores,
+    current_session,
+    store_evaluation,
+    stream_answers_parallel,
+)
+from heuristic_scorer import PRESCORE_LLM_MIN_SCORE, prescore_prompt, scores_for_model, worth_model_call
+from metrics import start_metrics_server
+from optimizer import (
+    OPTIMIZE_MAX_ROUNDS,
+    OPTIMIZE_MIN_GAIN,
+    OPTIMIZE_PATIENCE,
+    OPTIMIZE_TARGET,
+    OPTIMIZE_TIME_BUDGET,
+    OPTIMIZE_TOKEN_BUDGET,
+    STOP_REASONS,
+    OptimizeSettings,
+    optimization_job,
+)
+from workspace import (
+    WORKSPACE_CONCURRENCY,
+    WORKSPACE_MAX_PROMPTS,
+    pending_results,
+    read_uploaded_variants,
+    split_variants,
+    table_rows,
+    workspace_job,
+)
 
 st.set_page_config(
     page_title="PromptLab Academy – Ollama Edition",
@@ -61,127 +108,83 @@ st.markdown(
 )
 
 # ---------------------------
-# Helpers to talk to Ollama
+# UI helpers
 # ---------------------------
 
-def ollama_chat(messages, model: str = OLLAMA_MODEL, timeout: int = 180) -> str:
+def options_editor(call: str, label: str) -> dict:
     """
-    Call the Ollama chat API and return the assistant text.
+    Inputs for one call type's generation options, prefilled from its profile.
+    Returns the options as edited.
     """
-    payload = {
-        "model": model,
-        "messages": messages,
-        "stream": False,
+    profile = OPTION_PROFILES[call]
+    st.caption(label)
+    col_a, col_b = st.columns(2)
+    options = {
+        "num_predict": col_a.number_input(
+            "Max tokens", min_value=-1, value=profile.get("num_predict", -1), step=64,
+            key=f"{call}_num_predict", help="num_predict; -1 means no limit",
+        ),
+        "num_ctx": col_b.number_input(
+            "Context size", min_value=512, value=profile.get("num_ctx", 4096), step=512,
+            key=f"{call}_num_ctx", help="num_ctx; changing it makes Ollama reload the model",
+        ),
+        "temperature": col_a.number_input(
+            "Temperature", min_value=0.0, max_value=2.0, value=float(profile.get("temperature", 0.8)), step=0.1,
+            key=f"{call}_temperature",
+        ),
+        "seed": col_b.number_input("Seed", value=profile.get("seed", 0), step=1, key=f"{call}_seed"),
     }
-
-    resp = requests.post(OLLAMA_URL, json=payload, timeout=timeout)
-    resp.raise_for_status()
-    data = resp.json()
-    return data["message"]["content"]
+    return {key: int(value) if key != "temperature" else value for key, value in options.items()}
 
 
-def extract_json_from_text(text: str) -> dict:
+def describe_answer_error(error: Exception) -> str:
     """
-    Try to extract a valid JSON object from the model output.
-    Handles cases where JSON is wrapped in ```json ... ``` or other noise.
+    Turn an answer generation error into a user-facing message.
     """
-    if "```" in text:
-        parts = text.split("```")
-        for part in parts:
-            part = part.strip()
-            if part.startswith("{") and part.endswith("}"):
-                text = part
-                break
-
-    if not text.strip().startswith("{"):
-        start = text.find("{")
-        end = text.rfind("}")
-        if start != -1 and end != -1:
-            text = text[start : end + 1]
-
-    return json.loads(text)
+    if isinstance(error, requests.exceptions.Timeout):
+        return (
+            "⏱️ The model took too long to respond. "
+            "You can try again or use a shorter prompt."
+        )
+    if isinstance(error, RequestShedError):
+        return f"⏳ {error}"
+    if isinstance(error, GenerationCancelledError):
+        return "⏹️ The generation was stopped. Run it again to get the answer."
+    return f"An error occurred while generating the answer: {error}"
 
 
-def call_prompt_evaluator(user_prompt: str) -> dict:
+def clear_answers():
     """
-    Ask Llama 3.3 (via Ollama) to evaluate and improve the prompt.
-    Returns a dict with the defined structure.
+    Forget the comparison answers of the previous evaluation, and stop
+    generating them if they are still running.
     """
-    system_message = textwrap.dedent(
-        """
-        You are an expert in prompt engineering.
-        Your task is to evaluate the quality of a prompt that will be used with a ChatGPT-style model,
-        and then improve it.
-
-        You must:
-        1. Rate the prompt from 1 to 100 using this rubric:
-           - Persona / role defined: 0–25
-           - Task / objective clearly stated: 0–25
-           - Enough context: 0–20
-           - Constraints (format, length, language, tone, steps, etc.): 0–15
-           - Clarity and precision of the wording: 0–15
-
-        2. Explain in a didactic way what is missing or weak in each dimension.
-        3. Propose concrete suggestions to improve the prompt.
-        4. Generate an optimized version of the prompt that:
-           - Defines a clear role for the model.
-           - Has a specific objective.
-           - Includes the necessary context.
-           - Specifies format, language and other relevant constraints.
-
-        5. ALWAYS return your answer as a valid JSON object with this exact structure:
+    st.session_state.original_answer = None
+    st.session_state.improved_answer = None
+    st.session_state.answer_errors = {}
+    if st.session_state.compare_job is not None:
+        get_job_runner().cancel(st.session_state.compare_job)
+        st.session_state.compare_job = None
 
-        {
-          "total_score": int,
-          "scores": {
-            "persona": int,
-            "task": int,
-            "context": int,
-            "constraints": int,
-            "clarity": int
-          },
-          "diagnosis": {
-            "persona": "string",
-            "task": "string",
-            "context": "string",
-            "constraints": "string",
-            "clarity": "string"
-          },
-          "improvements": [
-            "string",
-            "string"
-          ],
-          "improved_prompt": "string",
-          "short_explanation": "string"
-        }
-
-        Do NOT include anything outside the JSON object.
-        The language of the explanation should match the language of the original prompt.
-        """
-    )
 
-    messages = [
-        {"role": "system", "content": system_message},
-        {"role": "user", "content": f"Prompt to evaluate:\n\n{user_prompt}"},
-    ]
+def render_queue_status(slot) -> bool:
+    """
+    Show this session's place in the model queue, if it is waiting.
+    Returns whether anything was shown.
+    """
+    status = get_scheduler().session_status(st.session_state.session_id)
+    if not status["position"]:
+        slot.empty()
+        return False
+    eta = f"about {status['eta_s']:.0f} s" if status["eta_s"] is not None else "no estimate yet"
+    slot.info(f"⏳ Waiting for the model: position {status['position']} in the queue, {eta}.")
+    return True
 
-    raw_text = ollama_chat(messages)
-    return extract_json_from_text(raw_text)
 
+# Load the models (once per process) so the first evaluation doesn't pay for it
+get_warm_managers()
 
-def call_llm_answer(prompt: str) -> str:
-    """
-    Ask Llama 3.3 for a normal answer to the prompt.
-    Used to compare 'original vs optimized' behavior.
-    """
-    messages = [
-        {
-            "role": "system",
-            "content": "Answer the following prompt in a clear, useful and concise way.",
-        },
-        {"role": "user", "content": prompt},
-    ]
-    return ollama_chat(messages, timeout=180)
+# Export Prometheus metrics for this process (once)
+start_metrics_server()
 
 # ---------------------------
 # Streamlit state
@@ -196,6 +199,280 @@ if "original_answer" not in st.session_state:
 if "improved_answer" not in st.session_state:
     st.session_state.improved_answer = None
 
+if "answer_errors" not in st.session_state:
+    st.session_state.answer_errors = {}
+
+# The prompt the shown evaluation is about (the text area may have changed since)
+if "evaluated_prompt" not in st.session_state:
+    st.session_state.evaluated_prompt = ""
+
+# Background jobs this session is waiting for, and the last evaluation error
+if "eval_job" not in st.session_state:
+    st.session_state.eval_job = None
+
+if "compare_job" not in st.session_state:
+    st.session_state.compare_job = None
+
+if "eval_error" not in st.session_state:
+    st.session_state.eval_error = None
+
+# The auto-optimization job of the shown evaluation, and its target score
+if "optimize_job" not in st.session_state:
+    st.session_state.optimize_job = None
+
+if "optimize_target" not in st.session_state:
+    st.session_state.optimize_target = OPTIMIZE_TARGET
+
+# The workspace's background job and the prompts it evaluates
+if "workspace_job" not in st.session_state:
+    st.session_state.workspace_job = None
+
+if "workspace_prompts" not in st.session_state:
+    st.session_state.workspace_prompts = []
+
+# Timings of this session's last model calls, for the performance panel
+if "perf" not in st.session_state:
+    st.session_state.perf = {}
+
+# Model calls are queued fairly per session. Streamlit's own session id lets
+# the runtime tell us when the session is gone.
+if "session_id" not in st.session_state:
+    ctx = get_script_run_ctx()
+    st.session_state.session_id = ctx.session_id if ctx is not None else uuid.uuid4().hex
+current_session.set(st.session_state.session_id)
+
+# Evaluations and comparisons run as background jobs, so reruns leave them
+# alone. Those of sessions that were closed (tab closed, disconnected) are
+# stopped, with their model calls.
+if Runtime.exists():
+    get_generations().start_reaper(
+        lambda session_id: Runtime.instance().is_active_session(session_id),
+        on_gone=get_job_runner().cancel_session,
+    )
+    get_generations().watch(st.session_state.session_id)
+
+# ---------------------------
+# Sidebar: settings & diagnostics
+# ---------------------------
+
+stream_enabled = st.sidebar.checkbox("Stream tokens as they arrive", value=OLLAMA_STREAM)
+
+with st.sidebar.expander("Generation options"):
+    evaluate_options = options_editor("evaluate", "Evaluation")
+    answer_options = options_editor("answer", "Comparison answers")
+
+with st.sidebar.expander("Model queue"):
+    st.json(get_scheduler().stats())
+
+with st.sidebar.expander("Background jobs"):
+    st.json(get_job_runner().stats())
+
+with st.sidebar.expander("HTTP connection pool"):
+    pool_stats = http_pool_stats()
+    if pool_stats:
+        st.json(pool_stats)
+    else:
+        st.caption("No connection to Ollama has been opened yet.")
+
+with st.sidebar.expander("LLM backend"):
+    st.json(get_backend().stats())
+
+eval_cache = get_eval_cache()
+if eval_cache is not None:
+    with st.sidebar.expander("Evaluation cache"):
+        st.json(eval_cache.stats())
+        if st.button("Clear evaluation cache"):
+            eval_cache.clear()
+
+single_flight = get_single_flight()
+if single_flight is not None:
+    with st.sidebar.expander("Request coalescing"):
+        st.json(single_flight.stats())
+
+with st.sidebar.expander("Warm model & prompt cache"):
+    st.json({call: manager.stats() for call, manager in get_warm_managers().items()})
+
+with st.sidebar.expander("Evaluator parse failures"):
+    st.json(evaluator_parse_stats())
+
+answer_cache = get_answer_cache()
+if answer_cache is not None:
+    with st.sidebar.expander("Answer cache"):
+        st.json(answer_cache.stats())
+        if st.button("Clear answer cache"):
+            answer_cache.clear()
+
+# ---------------------------
+# Workspace mode: many prompts at once
+# ---------------------------
+
+SCORE_LABELS = {
+    "persona": "Persona / Role",
+    "task": "Task / Objective",
+    "context": "Context",
+    "constraints": "Constraints",
+    "clarity": "Clarity",
+}
+
+WORKSPACE_SCORE_COLUMNS = {
+    "Total": st.column_config.ProgressColumn("Total", min_value=0, max_value=100, format="%d"),
+    **{
+        key.capitalize(): st.column_config.NumberColumn(SCORE_LABELS[key], format=f"%d / {SCORE_MAX[key]}")
+        for key in SCORE_KEYS
+    },
+    "Prompt": st.column_config.TextColumn("Prompt", width="large"),
+}
+
+
+def open_in_evaluator(result: dict):
+    """
+    Show a workspace result in the single-prompt view.
+    """
+    st.session_state.eval_job = None
+    st.session_state.evaluation = result["evaluation"]
+    st.session_state.evaluated_prompt = result["prompt"]
+    st.session_state.perf = {}
+    clear_answers()
+    st.session_state.mode = "Single prompt"
+
+
+def render_workspace_results(results: list, done: bool):
+    """
+    The workspace table; once the job is done, rows can be opened in the
+    single-prompt view and the results downloaded.
+    """
+    rows = table_rows(results)
+    if not done:
+        st.dataframe(rows, column_config=WORKSPACE_SCORE_COLUMNS, hide_index=True, width="stretch")
+        return
+    event = st.dataframe(
+        rows,
+        column_config=WORKSPACE_SCORE_COLUMNS,
+        hide_index=True,
+        width="stretch",
+        on_select="rerun",
+        selection_mode="single-row",
+        key="workspace_table",
+    )
+    col_a, col_b = st.columns(2)
+    selected = event.selection.rows
+    result = results[selected[0]] if selected else None
+    col_a.button(
+        "🔍 Open the selected prompt in the evaluator",
+        disabled=result is None or result["evaluation"] is None,
+        on_click=open_in_evaluator,
+        args=(result,),
+    )
+    export = io.StringIO()
+    writer = csv.DictWriter(export, fieldnames=[*rows[0], "Improved prompt"])
+    writer.writeheader()
+    for row, item in zip(rows, results):
+        writer.writerow({**row, "Improved prompt": (item["evaluation"] or {}).get("improved_prompt", "")})
+    col_b.download_button(
+        "⬇️ Download results (CSV)",
+        data=export.getvalue(),
+        file_name="prompt_workspace.csv",
+        mime="text/csv",
+    )
+
+
+@st.fragment(run_every=JOB_POLL_INTERVAL)
+def watch_workspace():
+    """
+    Fill in the workspace table while its job runs; rerun the whole page once it has finished.
+    """
+    runner = get_job_runner()
+    job = runner.get(st.session_state.workspace_job)
+    if job is None or job.done:
+        st.rerun(scope="app")
+    results = job.progress.get("results") or pending_results(st.session_state.workspace_prompts)
+    total = len(results)
+    finished = job.progress.get("finished", 0)
+    failed = job.progress.get("failed", 0)
+    errors = f" ({failed} failed)" if failed else ""
+    st.progress(finished / total, text=f"Finished {finished} of {total} prompts{errors} · {job.elapsed_s:.0f} s")
+    render_queue_status(st.empty())
+    if st.button("⏹️ Cancel", key="cancel_workspace"):
+        runner.cancel(job.id)
+        st.rerun(scope="app")
+    render_workspace_results(results, done=False)
+
+
+def render_workspace():
+    """
+    Workspace mode: paste or upload prompt variants, evaluate them all
+    concurrently and compare their scores in a sortable table.
+    """
+    st.markdown('<div class="prompt-card">', unsafe_allow_html=True)
+    st.markdown(
+        """
+        <p style="
+            font-size:1.1rem;
+            font-weight:700;
+            margin:0 0 0.5rem 0;
+        ">
+            Prompt variants
+        </p>
+        """,
+        unsafe_allow_html=True,
+    )
+    text = st.text_area(
+        "Paste your prompt variants, one per line, or separated by a line with --- when they span several lines:",
+        height=220,
+        key="workspace_text",
+    )
+    upload = st.file_uploader(
+        "…or upload them: a .txt file like the box above, or a .csv / .jsonl file with a \"prompt\" column",
+        type=["txt", "csv", "jsonl"],
+    )
+    st.markdown("</div>", unsafe_allow_html=True)
+
+    try:
+        variants = read_uploaded_variants(upload.name, upload.getvalue()) if upload else split_variants(text)
+    except (ValueError, KeyError) as e:
+        st.error(f"Could not read the uploaded file: {e}")
+        variants = []
+    if len(variants) > WORKSPACE_MAX_PROMPTS:
+        st.warning(f"Only the first {WORKSPACE_MAX_PROMPTS} of {len(variants)} prompts will be evaluated.")
+        variants = variants[:WORKSPACE_MAX_PROMPTS]
+    st.caption(f"{len(variants)} prompt(s), evaluated {WORKSPACE_CONCURRENCY} at a time.")
+
+    runner = get_job_runner()
+    if st.button("🚀 Evaluate all prompts", type="primary", disabled=not variants):
+        if st.session_state.workspace_job is not None:
+            runner.cancel(st.session_state.workspace_job)
+        job = runner.submit(
+            st.session_state.session_id,
+            "workspace",
+            f"{len(variants)} prompts",
+            workspace_job,
+            variants,
+            evaluate_options,
+        )
+        st.session_state.workspace_job = job.id
+        st.session_state.workspace_prompts = variants
+
+    job = runner.get(st.session_state.workspace_job)
+    if job is None:
+        return
+    if not job.done:
+        watch_workspace()
+    elif job.state == "done":
+        render_workspace_results(job.result, done=True)
+    else:
+        if job.state == "failed":
+            st.error(f"An error occurred while evaluating the prompts: {job.error}")
+        else:
+            st.info("The workspace evaluation was cancelled.")
+        if job.progress.get("results"):
+            render_workspace_results(job.progress["results"], done=True)
+
+
+mode = st.radio("Mode", ["Single prompt", "Workspace"], horizontal=True, key="mode", label_visibility="collapsed")
+if mode == "Workspace":
+    render_workspace()
+    st.stop()
+
 # ---------------------------
 # Main UI: Original prompt
 # ---------------------------
@@ -222,6 +499,15 @@ user_prompt = st.text_area(
 )
 st.markdown("</div>", unsafe_allow_html=True)
 
+# Instant local estimate, recomputed on every rerun without calling the model
+prescore = prescore_prompt(user_prompt) if user_prompt.strip() else None
+if prescore:
+    breakdown = " · ".join(f"{key.capitalize()} {prescore['scores'][key]}/{SCORE_MAX[key]}" for key in SCORE_KEYS)
+    if prescore["confident"]:
+        st.caption(f"Instant estimate: **{prescore['total_score']}/100** ({breakdown})")
+    else:
+        st.caption("No instant estimate: the local scorer only understands English prompts. The model will score this one.")
+
 # Evaluation button
 evaluate_btn = st.button("✅ Evaluate & Optimize Prompt", type="primary")
 
@@ -229,19 +515,432 @@ evaluate_btn = st.button("✅ Evaluate & Optimize Prompt", type="primary")
 # Evaluation logic
 # ---------------------------
 
-if evaluate_btn:
-    if not user_prompt.strip():
+def evaluation_perf(metrics_by_call: dict) -> dict:
+    """
+    Performance panel rows for the model calls of an evaluation: one, or one per stage.
+    """
+    return {
+        "Evaluation" if call == "evaluate" else f"Evaluation ({call})": metrics
+        for call, metrics in metrics_by_call.items()
+    }
+
+
+def render_live_scores(slot, partial: dict, received_chars: int):
+    """
+    Show the scores parsed so far while the evaluation is still streaming.
+    """
+    with slot.container():
+        st.caption(f"Evaluating prompt with Llama 3.3 (Ollama)... {received_chars} characters received")
+        cols = st.columns(len(SCORE_KEYS) + 1)
+        total = partial["total_score"]
+        cols[0].metric("Total", total if total is not None else "…")
+        for col, key in zip(cols[1:], SCORE_KEYS):
+            col.metric(SCORE_LABELS[key], partial["scores"].get(key, "…"))
+
+
+def render_live_sections(slot, fields: dict):
+    """
+    Show the sections of a parallel evaluation that have arrived so far.
+    """
+    waiting = "⏳ Waiting for the model…"
+    with slot.container():
+        st.caption("Evaluating prompt with Llama 3.3 (Ollama): scores, diagnosis and rewrite in parallel...")
+        cols = st.columns(len(SCORE_KEYS) + 1)
+        cols[0].metric("Total", fields.get("total_score", "…"))
+        for col, key in zip(cols[1:], SCORE_KEYS):
+            col.metric(SCORE_LABELS[key], fields.get("scores", {}).get(key, "…"))
+        if "short_explanation" in fields:
+            st.info(fields["short_explanation"])
+
+        st.markdown("**Didactic diagnosis**")
+        if "diagnosis" in fields:
+            for key in SCORE_KEYS:
+                st.write(f"**{SCORE_LABELS[key]}:** {fields['diagnosis'].get(key, '')}")
+            for i, idea in enumerate(fields["improvements"], start=1):
+                st.markdown(f"- **{i}.** {idea}")
+        else:
+            st.caption(waiting)
+
+        st.markdown("**Optimized prompt**")
+        if "improved_prompt" in fields:
+            st.code(fields["improved_prompt"], language=None)
+        else:
+            st.caption(waiting)
+
+
+def with_score_source(evaluation: dict, scored: dict | None) -> dict:
+    """
+    Mark an evaluation whose scores are the local estimate (the model only
+    wrote the diagnosis and the rewrite).
+    """
+    return evaluation if scored is None else {**evaluation, "source": "heuristic-scores"}
+
+
+def evaluation_job(job, prompt: str, options: dict, stream: bool, scored: dict | None = None) -> dict:
+    """
+    Background job: evaluate `prompt`, publishing the scores (or, in parallel
+    mode, the sections) as they stream in. With `scored`, the model keeps
+    those scores and only writes the rest. Returns the evaluation with the
+    prompt it is about and the performance rows (None when served from cache).
+    """
+    cached = get_cached_evaluation(prompt, options, scored)
+    if cached is not None:
+        return {"evaluation": with_score_source(cached, scored), "prompt": prompt, "perf": None}
+
+    if not stream:
+        evaluation, usage = call_prompt_evaluator_with_usage(prompt, options, scored)
+        perf = evaluation_perf(usage["stages"] or {"evaluate": usage["metrics"]})
+        return {"evaluation": with_score_source(evaluation, scored), "prompt": prompt, "perf": perf}
+
+    finished = []
+    if EVALUATOR_MODE == "parallel" and scored is None:
+        evaluation = None
+        events = call_prompt_evaluator_sections(prompt, options, on_done=finished.append)
+        try:
+            for section, value in events:
+                if section == "evaluation":
+                    evaluation = value
+                else:
+                    job.update(fields={**job.progress.get("fields", {}), **value})
+        finally:
+            events.close()
+        perf = evaluation_perf({result.call: result.metrics() for result in finished})
+        return {"evaluation": evaluation, "prompt": prompt, "perf": perf}
+
+    scanner = JsonObjectScanner()
+    shown = None
+    trailing = 0
+    chunks = call_prompt_evaluator_stream(prompt, options, on_done=finished.append, scored=scored)
+    try:
+        for chunk in chunks:
+            job.check_cancelled()
+            if scanner.result is not None:
+                # The object is complete: allow a little trailing text (usually just the
+                # final line with the timings), then stop waiting for the rest. The generation
+                # (maybe shared with other callers) still runs to its end in the background.
+                trailing += len(chunk)
+                if trailing > 256:
+                    break
+                continue
+            if scanner.feed(chunk) is not None:
+                continue
+            partial = parse_partial_scores(scanner.text)
+            if partial != shown:
+                shown = partial
+                job.update(partial=partial, received=len(scanner.text))
+    finally:
+        chunks.close()
+
+    evaluation, _ = parse_evaluation_with_repair(scanner=scanner)
+    store_evaluation(prompt, evaluation, options, scored)
+    # The stream is closed early once the JSON is complete, so there may be no final timings
+    if finished:
+        perf = evaluation_perf({result.call: result.metrics() for result in finished})
+    else:
+        perf = {"Evaluation": None}
+    return {"evaluation": with_score_source(evaluation, scored), "prompt": prompt, "perf": perf}
+
+
+def comparison_job(job, prompts: dict, force: bool, options: dict, stream: bool) -> dict:
+    """
+    Background job: answer the original and the optimized prompt, publishing
+    the streamed texts as they grow. Returns the answers (None for a failed
+    one), the error messages and the performance rows.
+    """
+    perf = {}
+    if stream:
+        texts = {key: "" for key in prompts}
+        errors = {}
+        events = stream_answers_parallel(prompts, force, options)
+        try:
+            for key, kind, value in events:
+                if kind == "chunk":
+                    texts[key] += value
+                    job.update(texts=dict(texts))
+                elif kind == "done":
+                    perf[f"Answer ({key})"] = value.metrics() if value else None
+                elif kind == "error":
+                    errors[key] = describe_answer_error(value)
+        finally:
+            events.close()
+        answers = {key: None if key in errors else text for key, text in texts.items()}
+    else:
+        results = generate_answers_parallel(prompts, force, options)
+        answers = {key: result.content if result else None for key, (result, _) in results.items()}
+        for key, (result, _) in results.items():
+            if result is not None:
+                perf[f"Answer ({key})"] = result.metrics()
+        errors = {key: describe_answer_error(error) for key, (_, error) in results.items() if error is not None}
+    return {"answers": answers, "errors": errors, "perf": perf}
+
+
+def describe_evaluation_error(error: Exception) -> str:
+    """
+    Turn an evaluation error into a user-facing message.
+    """
+    if isinstance(error, RequestShedError):
+        return f"⏳ {error}"
+    return f"An error occurred while evaluating the prompt: {error}"
+
+
+def adopt_evaluation(job):
+    """
+    Show the result of a finished evaluation job.
+    """
+    st.session_state.evaluation = job.result["evaluation"]
+    st.session_state.evaluated_prompt = job.result["prompt"]
+    if job.result["perf"] is not None:
+        st.session_state.perf = job.result["perf"]
+    clear_answers()
+
+
+def adopt_comparison(job):
+    """
+    Show the answers of a finished comparison job.
+    """
+    st.session_state.original_answer = job.result["answers"]["original"]
+    st.session_state.improved_answer = job.result["answers"]["improved"]
+    st.session_state.answer_errors = job.result["errors"]
+    st.session_state.perf.update(job.result["perf"])
+
+
+def collect_finished_jobs():
+    """
+    Take in the results of the evaluation and comparison this session is waiting for.
+    """
+    runner = get_job_runner()
+    job = runner.get(st.session_state.eval_job)
+    if job is not None and job.done:
+        st.session_state.eval_job = None
+        if job.state == "done":
+            adopt_evaluation(job)
+        elif job.state == "failed":
+            st.session_state.eval_error = describe_evaluation_error(job.error)
+    job = runner.get(st.session_state.compare_job)
+    if job is not None and job.done:
+        st.session_state.compare_job = None
+        if job.state == "done":
+            adopt_comparison(job)
+        elif job.state == "failed":
+            st.session_state.answer_errors = {key: describe_answer_error(job.error) for key in ("original", "improved")}
+
+
+JOB_STATE_LABELS = {
+    "queued": "⏳ queued",
+    "running": "⚙️ running",
+    "done": "✅ done",
+    "failed": "❌ failed",
+    "cancelled": "⏹️ cancelled",
+}
+
+
+def render_job_list(jobs: list):
+    """
+    The session's background jobs, newest first, with their controls.
+    """
+    runner = get_job_runner()
+    for job in reversed(jobs):
+        cols = st.columns([5, 2, 2, 1])
+        label = job.label if len(job.label) <= 80 else job.label[:77] + "..."
+        cols[0].markdown(f"**{job.kind.capitalize()}** · {label}")
+        if job.kind == "evaluate" and job.state == "done":
+            cols[1].write(f"{JOB_STATE_LABELS[job.state]} · {job.result['evaluation']['total_score']}/100")
+        else:
+            cols[1].write(JOB_STATE_LABELS[job.state])
+        cols[2].caption(f"{job.elapsed_s:.1f} s")
+        if not job.done:
+            if cols[3].button("⏹️", key=f"cancel_{job.id}", help="Cancel this job"):
+                runner.cancel(job.id)
+                st.rerun(scope="app")
+        elif job.kind == "evaluate" and job.state == "done":
+            if cols[3].button("👁️", key=f"show_{job.id}", help="Show this evaluation"):
+                st.session_state.eval_job = None
+                adopt_evaluation(job)
+                st.rerun(scope="app")
+        elif st.session_state.eval_job != job.id and st.session_state.compare_job != job.id:
+            if cols[3].button("🗑️", key=f"forget_{job.id}", help="Remove from the list"):
+                runner.forget(job.id)
+                st.rerun(scope="app")
+
+
+def render_evaluation_progress(job):
+    """
+    Live view of a running evaluation job.
+    """
+    if "fields" in job.progress:
+        render_live_sections(st.empty(), job.progress["fields"])
+    elif "partial" in job.progress:
+        render_live_scores(st.empty(), job.progress["partial"], job.progress["received"])
+    elif not render_queue_status(st.empty()):
+        st.caption(f"Evaluating prompt with Llama 3.3 (Ollama)... {job.elapsed_s:.0f} s")
+
+
+@st.fragment(run_every=JOB_POLL_INTERVAL)
+def watch_jobs():
+    """
+    Refresh the job list and the awaited evaluation's progress while jobs
+    run; rerun the whole page once the evaluation is ready (or nothing runs).
+    """
+    runner = get_job_runner()
+    awaited = runner.get(st.session_state.eval_job)
+    jobs = runner.jobs(st.session_state.session_id)
+    if (awaited is not None and awaited.done) or all(job.done for job in jobs):
+        st.rerun(scope="app")
+    if awaited is not None:
+        render_evaluation_progress(awaited)
+    with st.expander(f"🗂️ Background jobs ({sum(not job.done for job in jobs)} running)", expanded=True):
+        render_job_list(jobs)
+
+
+@st.fragment(run_every=JOB_POLL_INTERVAL)
+def watch_comparison():
+    """
+    Fill in the comparison answers while the comparison job runs; rerun the
+    whole page once it has finished.
+    """
+    job = get_job_runner().get(st.session_state.compare_job)
+    if job is None or job.done:
+        st.rerun(scope="app")
+    texts = job.progress.get("texts", {})
+    col_r1, col_r2 = st.columns(2)
+    for col, key, title in (
+        (col_r1, "original", "**Answer with the original prompt**"),
+        (col_r2, "improved", "**Answer with the optimized prompt**"),
+    ):
+        with col:
+            st.markdown(title)
+            if texts.get(key):
+                st.markdown(texts[key] + "▌")
+            else:
+                st.caption("⏳ Waiting for the model…")
+    render_queue_status(st.empty())
+
+
+def use_optimized_round(round_: dict):
+    """
+    Show one round of an optimization as the current evaluation.
+    """
+    st.session_state.eval_job = None
+    st.session_state.evaluation = round_["evaluation"]
+    st.session_state.evaluated_prompt = round_["prompt"]
+    clear_answers()
+
+
+def render_optimization(rounds: list, target: int, result: dict | None = None):
+    """
+    Convergence chart and round table of an optimization run; with its
+    `result` (once finished), the summary and the best prompt.
+    """
+    if not rounds:
+        return
+    st.line_chart(
+        {
+            "Round": [r["round"] for r in rounds],
+            "Total score": [r["total_score"] for r in rounds],
+            "Target": [target] * len(rounds),
+        },
+        x="Round",
+        y=["Total score", "Target"],
+        height=260,
+    )
+    st.dataframe(
+        [
+            {
+                "Round": r["round"],
+                "Total": r["total_score"],
+                "Change": r["total_score"] - rounds[i - 1]["total_score"] if i else None,
+                "Tokens": r["tokens"],
+                "Time": "cached" if r["cached"] else f"{r['wall_ms'] / 1000:.1f} s",
+                "Prompt": r["prompt"],
+            }
+            for i, r in enumerate(rounds)
+        ],
+        hide_index=True,
+        width="stretch",
+    )
+    if result is None:
+        return
+
+    best = rounds[result["best"]]
+    gain = best["total_score"] - rounds[0]["total_score"]
+    st.success(
+        f"Stopped after {len(rounds) - 1} round(s): {STOP_REASONS[result['stop_reason']]}. "
+        f"Best: round {best['round']} with {best['total_score']}/100 ({gain:+d} over the original), "
+        f"{result['tokens']} tokens, {result['elapsed_s']:.1f} s."
+    )
+    st.text_area("Best prompt:", value=best["prompt"], height=180, key="optimized_best_prompt")
+    st.button(
+        "✅ Show the best prompt's evaluation",
+        disabled=best["prompt"] == st.session_state.evaluated_prompt,
+        on_click=use_optimized_round,
+        args=(best,),
+    )
+
+
+@st.fragment(run_every=JOB_POLL_INTERVAL)
+def watch_optimization(target: int):
+    """
+    Grow the convergence chart while the optimization job runs; rerun the
+    whole page once it has finished.
+    """
+    runner = get_job_runner()
+    job = runner.get(st.session_state.optimize_job)
+    if job is None or job.done:
+        st.rerun(scope="app")
+    rounds = job.progress.get("rounds", [])
+    col_a, col_b = st.columns([4, 1])
+    col_a.caption(f"⚙️ Optimizing... round {len(rounds)} · {job.elapsed_s:.0f} s")
+    if col_b.button("⏹️ Stop", key="stop_optimization"):
+        runner.cancel(job.id)
+        st.rerun(scope="app")
+    render_queue_status(st.empty())
+    render_optimization(rounds, target)
+
+
+# Results of background jobs that finished since the last run
+collect_finished_jobs()
+
+# Shown next to a local estimate: run the full model evaluation anyway
+ask_model = st.session_state.get("ask_model", False)
+
+if evaluate_btn or ask_model:
+    # The estimate's button asks about the prompt it estimated, even if the text changed since
+    prompt = st.session_state.evaluated_prompt if ask_model else user_prompt
+    # A confident estimate already has the scores: the model only diagnoses and rewrites
+    scored = scores_for_model(prescore) if evaluate_btn and prescore else None
+    cached = get_cached_evaluation(prompt, evaluate_options, scored) if prompt.strip() else None
+    st.session_state.eval_error = None
+    if not prompt.strip():
         st.warning("Please write a prompt before evaluating it.")
+    elif cached is not None:
+        st.session_state.eval_job = None
+        st.session_state.evaluation = with_score_source(cached, scored)
+        st.session_state.evaluated_prompt = prompt
+        clear_answers()
+    elif evaluate_btn and not worth_model_call(prescore):
+        # Obviously weak prompt: the estimate and its tips say enough, skip the model call
+        st.session_state.eval_job = None
+        st.session_state.evaluation = prescore
+        st.session_state.evaluated_prompt = prompt
+        st.session_state.perf = {}
+        clear_answers()
     else:
-        with st.spinner("Evaluating prompt with Llama 3.3 (Ollama)..."):
-            try:
-                evaluation = call_prompt_evaluator(user_prompt)
-                st.session_state.evaluation = evaluation
-                # Clear previous comparison answers, if any
-                st.session_state.original_answer = None
-                st.session_state.improved_answer = None
-            except Exception as e:
-                st.error(f"An error occurred while evaluating the prompt: {e}")
+        # Evaluate in the background: the page stays usable, and more prompts can be queued
+        job = get_job_runner().submit(
+            st.session_state.session_id, "evaluate", prompt, evaluation_job, prompt, evaluate_options, stream_enabled,
+            scored=scored,
+        )
+        st.session_state.eval_job = job.id
+
+session_jobs = get_job_runner().jobs(st.session_state.session_id)
+if any(not job.done for job in session_jobs):
+    watch_jobs()
+elif session_jobs:
+    with st.expander("🗂️ Background jobs"):
+        render_job_list(session_jobs)
+
+if st.session_state.eval_error:
+    st.error(st.session_state.eval_error)
 
 evaluation = st.session_state.evaluation
 
@@ -258,6 +957,9 @@ if evaluation:
     improvements = evaluation.get("improvements", [])
     improved_prompt = evaluation.get("improved_prompt", "")
     short_explanation = evaluation.get("short_explanation", "")
+    # "heuristic": the local estimate alone; "heuristic-scores": its scores with the model's rewrite
+    estimated = evaluation.get("source") == "heuristic"
+    estimated_scores = evaluation.get("source") in ("heuristic", "heuristic-scores")
 
     # 1) Dimension breakdown
     st.markdown('<div class="prompt-card">', unsafe_allow_html=True)
@@ -274,12 +976,8 @@ if evaluation:
         unsafe_allow_html=True,
     )
 
-    c1, c2, c3, c4, c5 = st.columns(5)
-    c1.metric("Persona / Role", scores.get("persona", 0))
-    c2.metric("Task / Objective", scores.get("task", 0))
-    c3.metric("Context", scores.get("context", 0))
-    c4.metric("Constraints", scores.get("constraints", 0))
-    c5.metric("Clarity", scores.get("clarity", 0))
+    for col, key in zip(st.columns(len(SCORE_KEYS)), SCORE_KEYS):
+        col.metric(SCORE_LABELS[key], scores.get(key, 0))
 
     st.markdown("</div>", unsafe_allow_html=True)
 
@@ -298,7 +996,7 @@ if evaluation:
         unsafe_allow_html=True,
     )
 
-    st.metric("Total score (1–100)", total_score)
+    st.metric("Estimated score (1–100)" if estimated_scores else "Total score (1–100)", total_score)
 
     if short_explanation:
         st.info(short_explanation)
@@ -362,11 +1060,88 @@ if evaluation:
         unsafe_allow_html=True,
     )
 
-    st.text_area(
-        "You can copy and reuse this optimized prompt:",
-        value=improved_prompt or "The optimized prompt could not be generated.",
-        height=220,
+    if estimated:
+        st.caption(
+            f"Prompts estimated below {PRESCORE_LLM_MIN_SCORE}/100 are not sent to the model. "
+            "Ask for a full evaluation to get its diagnosis and a rewritten prompt."
+        )
+        st.button("🧠 Ask the model for a full evaluation", key="ask_model")
+    else:
+        st.text_area(
+            "You can copy and reuse this optimized prompt:",
+            value=improved_prompt or "The optimized prompt could not be generated.",
+            height=220,
+        )
+        if estimated_scores:
+            st.caption("The scores above are the instant local estimate; the model wrote the diagnosis and this prompt.")
+            st.button("🧠 Ask the model to score it too", key="ask_model")
+
+    st.markdown("</div>", unsafe_allow_html=True)
+
+    # ---------------------------
+    # 5b) Auto-optimization: rewrite and re-evaluate until the score stops rising
+    # ---------------------------
+    st.markdown('<div class="prompt-card">', unsafe_allow_html=True)
+    st.markdown(
+        """
+        <p style="
+            font-size:1.1rem;
+            font-weight:700;
+            margin:0 0 0.5rem 0;
+        ">
+            Auto-optimization
+        </p>
+        """,
+        unsafe_allow_html=True,
+    )
+    st.caption(
+        "Evaluate the optimized prompt, then its own optimized version, and so on, keeping the best one. "
+        "Every round is cached, and the evaluation above is reused as the first round."
     )
+    with st.expander("Stopping rules"):
+        col_a, col_b, col_c = st.columns(3)
+        optimize_settings = OptimizeSettings(
+            target=int(col_a.number_input("Target score", 1, 100, OPTIMIZE_TARGET)),
+            max_rounds=int(col_b.number_input("Max rounds", 1, 20, OPTIMIZE_MAX_ROUNDS)),
+            patience=int(col_c.number_input("Rounds without gain", 1, 10, OPTIMIZE_PATIENCE)),
+            min_gain=int(col_a.number_input("Minimum gain (points)", 0, 50, OPTIMIZE_MIN_GAIN)),
+            token_budget=int(col_b.number_input("Token budget (0 = none)", 0, 10_000_000, OPTIMIZE_TOKEN_BUDGET, step=1000)),
+            time_budget_s=float(col_c.number_input("Time budget, s (0 = none)", 0, 86_400, int(OPTIMIZE_TIME_BUDGET), step=60)),
+        )
+
+    runner = get_job_runner()
+    if st.button("🔁 Auto-optimize this prompt"):
+        if st.session_state.optimize_job is not None:
+            runner.cancel(st.session_state.optimize_job)
+        job = runner.submit(
+            st.session_state.session_id,
+            "optimize",
+            st.session_state.evaluated_prompt,
+            optimization_job,
+            st.session_state.evaluated_prompt,
+            evaluate_options,
+            optimize_settings,
+            # An estimate has no rewrite to continue from, nor scores comparable with the
+            # model's: round 0 asks the model
+            start_evaluation=None if estimated_scores else evaluation,
+        )
+        st.session_state.optimize_job = job.id
+        st.session_state.optimize_target = optimize_settings.target
+
+    optimize_job = runner.get(st.session_state.optimize_job)
+    if optimize_job is not None:
+        if not optimize_job.done:
+            watch_optimization(st.session_state.optimize_target)
+        else:
+            if optimize_job.state == "failed":
+                st.error(f"The optimization stopped with an error: {optimize_job.error}")
+            elif optimize_job.state == "cancelled":
+                st.info("The optimization was stopped.")
+            render_optimization(
+                optimize_job.progress.get("rounds", []) if optimize_job.result is None else optimize_job.result["rounds"],
+                st.session_state.optimize_target,
+                optimize_job.result,
+            )
 
     st.markdown("</div>", unsafe_allow_html=True)
 
@@ -394,7 +1169,7 @@ if evaluation:
             st.markdown("**Original prompt**")
             st.text_area(
                 "Original prompt",
-                value=user_prompt,
+                value=st.session_state.evaluated_prompt,
                 height=180,
                 key="original_prompt_display",
             )
@@ -412,24 +1187,35 @@ if evaluation:
 
         # Button to generate and compare answers
         compare_btn = st.button("🔄 Generate & compare answers")
+        force_regenerate = st.checkbox(
+            "Force regenerate (skip cached answers and sample fresh ones)",
+            value=False,
+            disabled=get_answer_cache() is None,
+        )
 
         if compare_btn:
-            with st.spinner("Generating answers for both prompts..."):
-                try:
-                    original_answer = call_llm_answer(user_prompt)
-                    improved_answer = call_llm_answer(improved_prompt)
-                    st.session_state.original_answer = original_answer
-                    st.session_state.improved_answer = improved_answer
-                except requests.exceptions.ReadTimeout:
-                    st.error(
-                        "⏱️ The model took too long to respond. "
-                        "You can try again or use a shorter prompt."
-                    )
-                except Exception as e:
-                    st.error(f"An error occurred while generating the answers: {e}")
-
-        # If we already have answers, show them side by side
-        if st.session_state.original_answer and st.session_state.improved_answer:
+            clear_answers()
+            prompts = {"original": st.session_state.evaluated_prompt, "improved": improved_prompt}
+            job = get_job_runner().submit(
+                st.session_state.session_id,
+                "compare",
+                st.session_state.evaluated_prompt,
+                comparison_job,
+                prompts,
+                force_regenerate,
+                answer_options,
+                stream_enabled,
+            )
+            st.session_state.compare_job = job.id
+
+        has_answers = (
+            st.session_state.original_answer
+            or st.session_state.improved_answer
+            or st.session_state.answer_errors
+        )
+
+        # Answers are shown side by side; while the job runs, they fill in live
+        if st.session_state.compare_job is not None or has_answers:
             st.markdown('<div class="prompt-card">', unsafe_allow_html=True)
             st.markdown(
                 """
@@ -444,14 +1230,60 @@ if evaluation:
                 unsafe_allow_html=True,
             )
 
-            col_r1, col_r2 = st.columns(2)
+            if st.session_state.compare_job is not None:
+                watch_comparison()
+            else:
+                col_r1, col_r2 = st.columns(2)
 
-            with col_r1:
-                st.markdown("**Answer with the original prompt**")
-                st.write(st.session_state.original_answer)
+                with col_r1:
+                    st.markdown("**Answer with the original prompt**")
+                    original_slot = st.empty()
 
-            with col_r2:
-                st.markdown("**Answer with the optimized prompt**")
-                st.write(st.session_state.improved_answer)
+                with col_r2:
+                    st.markdown("**Answer with the optimized prompt**")
+                    improved_slot = st.empty()
 
-            st.markdown("</div>", unsafe_allow_html=True)
\ No newline at end of file
+                slots = {"original": original_slot, "improved": improved_slot}
+                answers = {
+                    "original": st.session_state.original_answer,
+                    "improved": st.session_state.improved_answer,
+                }
+                for key, slot in slots.items():
+                    if answers[key]:
+                        slot.markdown(answers[key])
+                    elif key in st.session_state.answer_errors:
+                        slot.error(st.session_state.answer_errors[key])
+
+            st.markdown("</div>", unsafe_allow_html=True)
+
+# ---------------------------
+# 7) Performance panel
+# ---------------------------
+
+if st.session_state.perf:
+    with st.expander("⚡ Performance"):
+        st.caption(
+            "Where the time went in this session's last model calls: "
+            "model load, prompt ingestion or generation."
+        )
+        rows = []
+        for label, m in st.session_state.perf.items():
+            if m is None:
+                rows.append({"Call": label, "Note": "no timings (stream closed early)"})
+            elif m["cached"]:
+                rows.append({"Call": label, "Note": "served from cache"})
+            else:
+                rows.append(
+                    {
+                        "Call": label,
+                        "Wall (ms)": m["wall_ms"],
+                        "Time to first token (ms)": m["ttft_ms"],
+                        "Model load (ms)": m["load_ms"],
+                        "Prompt eval (ms)": m["prompt_eval_ms"],
+                        "Prompt tokens": m["prompt_eval_count"],
+                        "Generation (ms)": m["eval_ms"],
+                        "Generated tokens": m["eval_count"],
+                        "Tokens/s": m["tokens_per_s"],
+                    }
+                )
+        st.table(rows)
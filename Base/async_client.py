@@ -0,0 +1,244 @@
+# async_client.py
+#
+# asyncio plumbing for model calls that can really be cancelled: one event
+# loop on a background thread, a registry of in-flight generations and the
+# callers waiting on them, and line reading with the per-stage timeouts.
+#
+# Cancelling a generation cancels its task, which closes the HTTP connection;
+# Ollama notices the disconnect and stops generating, freeing its slot. The
+# app cancels a caller's generations when its job is cancelled or its session
+# goes away. A generation coalesced by single-flight serves several callers,
+# so it is only cancelled once every one of them has been.
+
+import asyncio
+import contextlib
+import contextvars
+import logging
+import threading
+import time
+from concurrent.futures import Future
+
+import requests
+
+from jobs import current_job
+from scheduler import current_session
+from timeouts import DeadlineExceededError, Timeouts, remaining
+
+logger = logging.getLogger(__name__)
+
+# The callers of the shared work running in this context (see Waiters)
+current_waiters = contextvars.ContextVar("llm_waiters", default=None)
+
+
+class GenerationCancelledError(RuntimeError):
+    """
+    The generation was cancelled: every caller waiting for it was (their
+    job was cancelled or their session went away).
+    """
+
+
+class Waiters:
+    """
+    The callers waiting on one piece of work: (session, job) pairs, or the
+    Waiters of an enclosing shared piece of work. Dropping a session or job
+    removes its callers; once that leaves nobody, the work is `abandoned` and
+    its generations get cancelled. Nobody can join abandoned work.
+    """
+
+    def __init__(self, *waiters):
+        self.abandoned = False
+        self._waiters = list(waiters)   # a list: the same caller may wait twice
+        self._lock = threading.Lock()
+
+    def join(self):
+        """
+        Add the current caller; returns its handle for leave(), or None if
+        the work was abandoned.
+        """
+        waiter = current_waiters.get() or (current_session.get(), current_job.get())
+        with self._lock:
+            if self.abandoned:
+                return None
+            self._waiters.append(waiter)
+        return waiter
+
+    def leave(self, waiter) -> None:
+        with self._lock:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+
+    def drop(self, owner: str) -> None:
+        """
+        Remove the callers of session or job `owner`, here and in enclosing work.
+        """
+        with self._lock:
+            parents = [w for w in self._waiters if isinstance(w, Waiters)]
+        for parent in parents:
+            parent.drop(owner)
+        with self._lock:
+            had_waiters = bool(self._waiters)
+            self._waiters = [
+                w for w in self._waiters
+                if (not w.abandoned if isinstance(w, Waiters) else owner not in w)
+            ]
+            if had_waiters and not self._waiters:
+                self.abandoned = True
+
+    def sessions(self) -> set:
+        with self._lock:
+            waiters = list(self._waiters)
+        sessions = set()
+        for waiter in waiters:
+            sessions |= waiter.sessions() if isinstance(waiter, Waiters) else {waiter[0]}
+        return sessions
+
+    @contextlib.contextmanager
+    def scope(self):
+        """
+        Run the block as this work: the generations it starts are waited on
+        by these callers.
+        """
+        token = current_waiters.set(self)
+        try:
+            yield
+        finally:
+            current_waiters.reset(token)
+
+
+class AsyncLoopThread:
+    """
+    An asyncio event loop running on a daemon thread, for callers that are
+    threads themselves (Streamlit scripts, worker pools).
+    """
+
+    def __init__(self, name: str = "llm-async"):
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever, name=name, daemon=True)
+        self._thread.start()
+
+    def submit(self, coro) -> Future:
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+
+class GenerationRegistry:
+    """
+    In-flight generations and who waits on them, so that a session's or a
+    job's generations can be cancelled at once.
+    """
+
+    def __init__(self):
+        self.cancelled = 0
+        self._waiters = {}   # future -> Waiters
+        self._watched = set()
+        self._lock = threading.Lock()
+        self._reaper = None
+
+    def track(self, future: Future) -> None:
+        """
+        Track a generation for the current caller, or for everyone waiting
+        on the shared work it is part of.
+        """
+        waiters = current_waiters.get() or Waiters((current_session.get(), current_job.get()))
+        with self._lock:
+            self._waiters[future] = waiters
+        future.add_done_callback(self._forget)
+
+    def _forget(self, future: Future) -> None:
+        with self._lock:
+            self._waiters.pop(future, None)
+
+    def cancel_session(self, owner: str) -> int:
+        """
+        Stop waiting on generations for session or job `owner`, cancelling
+        those nobody else waits on; returns how many were cancelled.
+        """
+        with self._lock:
+            tracked = list(self._waiters.items())
+        for waiters in {id(w): w for _, w in tracked}.values():
+            waiters.drop(owner)
+        cancelled = sum(future.cancel() for future, waiters in tracked if waiters.abandoned)
+        if cancelled:
+            with self._lock:
+                self.cancelled += cancelled
+            logger.info("Cancelled %d generation(s) of %s", cancelled, owner)
+        return cancelled
+
+    def watch(self, session: str) -> None:
+        """
+        Have the reaper check on `session` (see start_reaper).
+        """
+        with self._lock:
+            self._watched.add(session)
+
+    def start_reaper(self, is_alive, interval_s: float = 5.0, on_gone=None) -> None:
+        """
+        Every `interval_s`, cancel the generations of watched sessions for
+        which `is_alive(session)` is false, call `on_gone(session)` and stop
+        watching them. Only the first call starts the thread.
+        """
+        with self._lock:
+            if self._reaper is not None:
+                return
+
+            def reap():
+                while True:
+                    time.sleep(interval_s)
+                    with self._lock:
+                        sessions = list(self._watched)
+                    for session in sessions:
+                        try:
+                            alive = is_alive(session)
+                        except Exception:
+                            logger.exception("Could not check whether session %s is alive", session)
+                            continue
+                        if not alive:
+                            with self._lock:
+                                self._watched.discard(session)
+                            self.cancel_session(session)
+                            if on_gone is not None:
+                                try:
+                                    on_gone(session)
+                                except Exception:
+                                    logger.exception("Cleaning up after session %s failed", session)
+
+            self._reaper = threading.Thread(target=reap, name="llm-session-reaper", daemon=True)
+            self._reaper.start()
+
+    def stats(self) -> dict:
+        with self._lock:
+            groups = list({id(w): w for w in self._waiters.values()}.values())
+            in_flight = len(self._waiters)
+            watched = len(self._watched)
+            cancelled = self.cancelled
+        return {
+            "in_flight": in_flight,
+            "sessions": len(set().union(*(w.sessions() for w in groups))),
+            "watched_sessions": watched,
+            "cancelled": cancelled,
+        }
+
+
+async def readlines_within(content, timeouts: Timeouts, deadline: float | None):
+    """
+    Lines of a streaming aiohttp response body, with the semantics of
+    timeouts.iter_lines_within: the first within `timeouts.first_byte`, each
+    later one within `timeouts.inter_chunk`, all of them before `deadline`.
+    """
+    limit = timeouts.first_byte
+    while True:
+        left = remaining(deadline)
+        if left <= 0:
+            raise DeadlineExceededError(deadline=deadline)
+        wait = min(limit, left)
+        try:
+            line = await asyncio.wait_for(content.readline(), timeout=wait)
+        except asyncio.TimeoutError:
+            if wait < limit:
+                raise DeadlineExceededError(deadline=deadline) from None
+            raise requests.exceptions.ReadTimeout(f"No data from the model for {wait:.3g} s.") from None
+        if not line:
+            return
+        limit = timeouts.inter_chunk
+        line = line.strip()
+        if line:
+            yield line
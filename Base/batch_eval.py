@@ -0,0 +1,334 @@
+# batch_eval.py
+#
+# Headless batch evaluation: score a JSONL/CSV file of prompts with the same
+# evaluator as the Streamlit app, without opening the UI.
+#
+# Usage:
+#   python batch_eval.py prompts.jsonl --output results.jsonl --concurrency 4
+#   python batch_eval.py prompts.csv --output results.parquet --prompt-field text
+#
+# Interrupted runs can be restarted with the same command: prompts whose IDs
+# are in the checkpoint file are skipped. IDs must therefore be unique; a file
+# with repeated IDs is rejected up front.
+
+import argparse
+import csv
+import json
+import logging
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from evaluator import LLM_CONCURRENCY, SCORE_KEYS, call_prompt_evaluator_with_usage, get_warm_managers
+from scheduler import RequestShedError
+
+PARQUET_BATCH_SIZE = 500   # rows per Parquet row group
+SHED_RETRIES = 5           # attempts for a prompt the model queue turns away
+SHED_RETRY_MAX_DELAY = 30  # seconds between them at most
+
+
+# ---------------------------
+# Input
+# ---------------------------
+
+def read_prompts(path: str, id_field: str, prompt_field: str):
+    """
+    Yield (id, prompt) pairs from a JSONL or CSV file.
+    Rows without an ID (missing, null or empty) get their 1-based row number as ID.
+    """
+    with open(path, newline="", encoding="utf-8") as f:
+        yield from iter_prompt_rows(f, path.endswith(".csv"), id_field, prompt_field)
+
+
+def iter_prompt_rows(f, is_csv: bool, id_field: str, prompt_field: str):
+    """
+    read_prompts on an open text file (e.g. an upload wrapped in io.StringIO).
+    """
+    if is_csv:
+        for number, row in enumerate(csv.DictReader(f), start=1):
+            yield row_id(row, id_field, number), row[prompt_field]
+    else:
+        number = 0
+        for line in f:
+            if not line.strip():
+                continue
+            number += 1
+            row = json.loads(line)
+            yield row_id(row, id_field, number), row[prompt_field]
+
+
+def row_id(row: dict, id_field: str, number: int) -> str:
+    # 0 and False are IDs too; only a missing one falls back to the row number
+    value = row.get(id_field)
+    return str(number) if value is None or value == "" else str(value)
+
+
+def duplicate_ids(ids) -> list:
+    """
+    IDs that occur more than once, in order of their first repeat.
+    """
+    seen, duplicates = set(), {}
+    for prompt_id in ids:
+        if prompt_id in seen:
+            duplicates[prompt_id] = None
+        seen.add(prompt_id)
+    return list(duplicates)
+
+
+def read_checkpoint(path: str) -> set:
+    if not os.path.exists(path):
+        return set()
+    with open(path, encoding="utf-8") as f:
+        return {line.rstrip("\n") for line in f if line.strip()}
+
+
+# ---------------------------
+# Output
+# ---------------------------
+
+class JsonlWriter:
+    """
+    Append results to a JSONL file, one line per prompt, flushed as they arrive.
+    """
+
+    def __init__(self, path: str):
+        self.file = open(path, "a", encoding="utf-8")
+
+    def write(self, row: dict) -> None:
+        self.file.write(json.dumps(row, ensure_ascii=False) + "\n")
+        self.file.flush()
+
+    def close(self) -> None:
+        self.file.close()
+
+
+class ParquetWriter:
+    """
+    Write results to Parquet in row groups of PARQUET_BATCH_SIZE rows.
+    Parquet files can't be appended to, so a resumed run writes a new
+    part file next to the original one.
+    """
+
+    def __init__(self, path: str):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            sys.exit("Parquet output requires pyarrow: pip install pyarrow")
+
+        self.pa = pa
+        self.pq = pq
+        self.path = self._free_path(path)
+        self.writer = None
+        self.rows = []
+
+    @staticmethod
+    def _free_path(path: str) -> str:
+        stem, ext = os.path.splitext(path)
+        candidate, part = path, 1
+        while os.path.exists(candidate):
+            candidate = f"{stem}.part{part}{ext}"
+            part += 1
+        return candidate
+
+    def write(self, row: dict) -> None:
+        flat = {
+            "id": row["id"],
+            "prompt": row["prompt"],
+            "total_score": row["total_score"],
+            **{f"score_{key}": row["scores"].get(key) for key in SCORE_KEYS},
+            "diagnosis": json.dumps(row["diagnosis"], ensure_ascii=False),
+            "improvements": json.dumps(row["improvements"], ensure_ascii=False),
+            "improved_prompt": row["improved_prompt"],
+            "short_explanation": row["short_explanation"],
+            "prompt_tokens": row["prompt_tokens"],
+            "completion_tokens": row["completion_tokens"],
+            "latency_s": row["latency_s"],
+        }
+        self.rows.append(flat)
+        if len(self.rows) >= PARQUET_BATCH_SIZE:
+            self.flush()
+
+    def flush(self) -> None:
+        if not self.rows:
+            return
+        table = self.pa.Table.from_pylist(self.rows)
+        if self.writer is None:
+            self.writer = self.pq.ParquetWriter(self.path, table.schema)
+        self.writer.write_table(table)
+        self.rows = []
+
+    def close(self) -> None:
+        self.flush()
+        if self.writer is not None:
+            self.writer.close()
+
+
+def open_writer(path: str):
+    if path.endswith(".parquet"):
+        return ParquetWriter(path)
+    return JsonlWriter(path)
+
+
+# ---------------------------
+# Evaluation
+# ---------------------------
+
+def evaluate_admitted(prompt: str) -> tuple:
+    """
+    call_prompt_evaluator_with_usage, retried when the model queue sheds it:
+    unlike an interactive user, a batch can simply wait its turn.
+    """
+    for attempt in range(1, SHED_RETRIES + 1):
+        try:
+            return call_prompt_evaluator_with_usage(prompt)
+        except RequestShedError as e:
+            if attempt == SHED_RETRIES:
+                raise
+            time.sleep(min(e.eta_s, SHED_RETRY_MAX_DELAY))
+
+
+def evaluate_one(prompt_id: str, prompt: str) -> dict:
+    started = time.perf_counter()
+    evaluation, usage = evaluate_admitted(prompt)
+    scores = evaluation.get("scores", {})
+    return {
+        "id": prompt_id,
+        "prompt": prompt,
+        "total_score": evaluation.get("total_score", 0),
+        "scores": {key: scores.get(key, 0) for key in SCORE_KEYS},
+        "diagnosis": evaluation.get("diagnosis", {}),
+        "improvements": evaluation.get("improvements", []),
+        "improved_prompt": evaluation.get("improved_prompt", ""),
+        "short_explanation": evaluation.get("short_explanation", ""),
+        "prompt_tokens": usage["prompt_tokens"],
+        "completion_tokens": usage["completion_tokens"],
+        "prompt_eval_saved_ms": usage["prompt_eval_saved_ms"],
+        "cached": usage["cached"],
+        "latency_s": round(time.perf_counter() - started, 3),
+    }
+
+
+class Progress:
+    """
+    Live throughput report on stderr (prompts/s and generated tokens/s).
+    """
+
+    def __init__(self, total: int, interval: float = 1.0):
+        self.total = total
+        self.interval = interval
+        self.started = time.perf_counter()
+        self.last_report = 0.0
+        self.done = 0
+        self.failed = 0
+        self.tokens = 0
+
+    def update(self, result: dict | None = None, failed: bool = False) -> None:
+        if failed:
+            self.failed += 1
+        else:
+            self.done += 1
+            self.tokens += result["completion_tokens"]
+        now = time.perf_counter()
+        if now - self.last_report >= self.interval:
+            self.last_report = now
+            self.report(end="\r")
+
+    def report(self, end: str = "\n") -> None:
+        elapsed = max(time.perf_counter() - self.started, 1e-9)
+        sys.stderr.write(
+            f"{self.done}/{self.total} done, {self.failed} failed | "
+            f"{self.done / elapsed:.2f} prompts/s | {self.tokens / elapsed:.1f} tokens/s{end}"
+        )
+        sys.stderr.flush()
+
+
+def run(args) -> int:
+    checkpoint_path = args.checkpoint or args.output + ".checkpoint"
+    completed = read_checkpoint(checkpoint_path)
+
+    ids = [prompt_id for prompt_id, _ in read_prompts(args.input, args.id_field, args.prompt_field)]
+    # Results and the checkpoint are keyed by ID: a repeated one would be lost or ambiguous
+    duplicates = duplicate_ids(ids)
+    if duplicates:
+        shown = ", ".join(duplicates[:10]) + (", ..." if len(duplicates) > 10 else "")
+        sys.stderr.write(f"Duplicate IDs in {args.input} ({len(duplicates)}): {shown}. IDs must be unique.\n")
+        return 2
+    todo = sum(1 for prompt_id in ids if prompt_id not in completed)
+    if completed:
+        sys.stderr.write(f"Resuming: {len(completed)} prompts already done, {todo} left.\n")
+
+    # Load the models up front so the first requests don't all wait on them
+    for manager in get_warm_managers().values():
+        manager.preload()
+
+    # More in flight than the scheduler has slots would only queue (and be shed)
+    concurrency = max(1, min(args.concurrency, LLM_CONCURRENCY))
+    if concurrency < args.concurrency:
+        sys.stderr.write(f"Capping --concurrency at LLM_CONCURRENCY ({LLM_CONCURRENCY}).\n")
+
+    writer = open_writer(args.output)
+    errors = open(args.output + ".errors.jsonl", "a", encoding="utf-8")
+    checkpoint = open(checkpoint_path, "a", encoding="utf-8")
+    progress = Progress(todo)
+
+    def collect(futures: set, in_flight: dict) -> None:
+        for future in futures:
+            prompt_id = in_flight.pop(future)
+            try:
+                result = future.result()
+            except Exception as e:
+                errors.write(json.dumps({"id": prompt_id, "error": str(e)}, ensure_ascii=False) + "\n")
+                errors.flush()
+                progress.update(failed=True)
+                continue
+            writer.write(result)
+            # Only checkpoint once the result is written, so a crash never loses a prompt
+            checkpoint.write(prompt_id + "\n")
+            checkpoint.flush()
+            progress.update(result)
+
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            in_flight = {}
+            for prompt_id, prompt in read_prompts(args.input, args.id_field, args.prompt_field):
+                if prompt_id in completed:
+                    continue
+                if len(in_flight) >= concurrency:
+                    finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    collect(finished, in_flight)
+                in_flight[pool.submit(evaluate_one, prompt_id, prompt)] = prompt_id
+
+            while in_flight:
+                finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                collect(finished, in_flight)
+    finally:
+        writer.close()
+        errors.close()
+        checkpoint.close()
+        progress.report()
+
+    return 1 if progress.failed else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluate a file of prompts with the PromptLab evaluator.")
+    parser.add_argument("input", help="JSONL or CSV file with one prompt per row")
+    parser.add_argument("--output", required=True, help="results file (.jsonl or .parquet)")
+    parser.add_argument("--id-field", default="id", help="column/key holding the prompt ID (default: id)")
+    parser.add_argument("--prompt-field", default="prompt", help="column/key holding the prompt (default: prompt)")
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=LLM_CONCURRENCY,
+        help="requests kept in flight to the LLM backend (default and maximum: LLM_CONCURRENCY)",
+    )
+    parser.add_argument("--checkpoint", help="file of completed IDs (default: <output>.checkpoint)")
+    args = parser.parse_args()
+    logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"), format="%(levelname)s %(name)s: %(message)s")
+    sys.exit(run(args))
+
+
+if __name__ == "__main__":
+    main()
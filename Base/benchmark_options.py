@@ -0,0 +1,139 @@
+# benchmark_options.py
+#
+# Measure what the generation profiles (OPTION_PROFILES) save: run the same
+# prompts once with the model defaults and once with each call type's
+# profile, and compare latency and generated tokens.
+#
+# Usage:
+#   python benchmark_options.py                            # built-in sample prompts
+#   python benchmark_options.py prompts.jsonl --runs 3     # same input format as batch_eval.py
+#   python benchmark_options.py --calls answer --json results.json
+#
+# Caches are bypassed. Each variant runs as one block after a warm-up call:
+# switching num_ctx makes Ollama reload the model, which would otherwise
+# land in the measurements.
+
+import argparse
+import json
+import statistics
+import sys
+
+from batch_eval import read_prompts
+from evaluator import (
+    LLM_BACKEND,
+    LLM_MODEL,
+    build_answer_messages,
+    build_evaluator_messages,
+    call_timeouts,
+    evaluator_format,
+    generation_options,
+    ollama_chat_full,
+)
+
+SAMPLE_PROMPTS = [
+    "Explain what machine learning is.",
+    "Write a product description for a reusable water bottle.",
+    "Summarize the causes of the French Revolution.",
+    "You are a tutor. Explain recursion to a 12-year-old with one example.",
+    "Give me a plan to learn SQL in four weeks.",
+]
+
+CALLS = {
+    "evaluate": (build_evaluator_messages, evaluator_format),
+    "answer": (build_answer_messages, lambda: None),
+}
+
+
+def percentile(values: list, fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def run_variant(call: str, options: dict | None, prompts: list, runs: int) -> list:
+    """
+    Time every prompt `runs` times with `options`; returns one ChatResult per call.
+    """
+    build_messages, make_format = CALLS[call]
+    timeouts = call_timeouts(call)
+
+    def chat(prompt):
+        return ollama_chat_full(
+            build_messages(prompt), options=options, format=make_format(), timeouts=timeouts, call="benchmark"
+        )
+
+    chat(prompts[0])   # warm-up: load the model with these options
+    results = []
+    for _ in range(runs):
+        for prompt in prompts:
+            results.append(chat(prompt))
+            sys.stderr.write(".")
+            sys.stderr.flush()
+    sys.stderr.write("\n")
+    return results
+
+
+def summarize(results: list) -> dict:
+    walls = [r.wall_ms for r in results]
+    return {
+        "calls": len(results),
+        "mean_ms": round(statistics.mean(walls), 1),
+        "p50_ms": round(percentile(walls, 0.5), 1),
+        "p95_ms": round(percentile(walls, 0.95), 1),
+        "mean_ttft_ms": round(statistics.mean(r.ttft_ms for r in results), 1),
+        "mean_tokens": round(statistics.mean(r.eval_count for r in results), 1),
+        "max_tokens": max(r.eval_count for r in results),
+        "mean_load_ms": round(statistics.mean(r.load_ms for r in results), 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare model-default options with the generation profiles.")
+    parser.add_argument("input", nargs="?", help="JSONL or CSV file of prompts (default: built-in samples)")
+    parser.add_argument("--prompt-field", default="prompt", help="column/key holding the prompt (default: prompt)")
+    parser.add_argument("--limit", type=int, default=10, help="prompts to use from the input (default: 10)")
+    parser.add_argument("--runs", type=int, default=1, help="repetitions of each prompt (default: 1)")
+    parser.add_argument("--calls", nargs="+", choices=sorted(CALLS), default=sorted(CALLS), help="call types")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    if args.input:
+        prompts = [prompt for _, prompt in read_prompts(args.input, "id", args.prompt_field)][: args.limit]
+    else:
+        prompts = SAMPLE_PROMPTS[: args.limit]
+
+    print(f"Backend: {LLM_BACKEND}, model: {LLM_MODEL}, {len(prompts)} prompts x {args.runs} runs")
+    report = {}
+    for call in args.calls:
+        profile = generation_options(call)
+        sys.stderr.write(f"{call}: model defaults ")
+        defaults = summarize(run_variant(call, None, prompts, args.runs))
+        sys.stderr.write(f"{call}: profile {profile} ")
+        profiled = summarize(run_variant(call, profile, prompts, args.runs))
+        saved = defaults["mean_ms"] - profiled["mean_ms"]
+        report[call] = {
+            "profile": profile,
+            "model_defaults": defaults,
+            "with_profile": profiled,
+            "saved_ms": round(saved, 1),
+            "saved_pct": round(100 * saved / defaults["mean_ms"], 1) if defaults["mean_ms"] else 0.0,
+        }
+
+    header = f"{'call':<10} {'variant':<15} {'mean ms':>10} {'p50 ms':>10} {'p95 ms':>10} {'ttft ms':>9} {'tokens':>8}"
+    print(header)
+    print("-" * len(header))
+    for call, row in report.items():
+        for variant in ("model_defaults", "with_profile"):
+            m = row[variant]
+            print(
+                f"{call:<10} {variant:<15} {m['mean_ms']:>10} {m['p50_ms']:>10} {m['p95_ms']:>10} "
+                f"{m['mean_ttft_ms']:>9} {m['mean_tokens']:>8}"
+            )
+        print(f"{call:<10} {'saved':<15} {row['saved_ms']:>10} ({row['saved_pct']}%)")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+# benchmark_stages.py
+#
+# Compare the single-call evaluator with the two-stage one (a small model for
+# the scores, the big one for the diagnosis and the rewrite): latency, time
+# until the scores are known, throughput, and how far the small model's scores
+# drift from the big model's.
+#
+# Usage:
+#   python benchmark_stages.py --score-model llama3.2:3b
+#   python benchmark_stages.py prompts.jsonl --score-model llama3.1:8b --concurrency 4 --json stages.json
+#
+# Caches are bypassed; each mode starts with a warm-up evaluation so model
+# loads don't land in the measurements.
+
+import argparse
+import json
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from batch_eval import read_prompts
+from benchmark_options import SAMPLE_PROMPTS, percentile
+from evaluator import (
+    LLM_BACKEND,
+    LLM_CONCURRENCY,
+    LLM_MODEL,
+    LLM_MODEL_REWRITE,
+    LLM_MODEL_SCORE,
+    SCORE_KEYS,
+    evaluate_in_one_call,
+    evaluate_in_stages,
+    submit_in_context,
+)
+
+
+def timed(evaluate, prompt: str) -> dict:
+    started = time.perf_counter()
+    evaluation, results, _ = evaluate(prompt)
+    return {
+        "evaluation": evaluation,
+        "wall_ms": (time.perf_counter() - started) * 1000,
+        "scores_ready_ms": results[0].wall_ms,   # the single call, or the scoring stage
+        "tokens": sum(result.eval_count for result in results),
+    }
+
+
+def run_mode(evaluate, prompts: list, concurrency: int) -> tuple:
+    """
+    Evaluate every prompt, `concurrency` at a time. Returns (summary, evaluations),
+    with None for prompts that failed.
+    """
+    evaluate(prompts[0])   # warm-up: load the models
+    rows = [None] * len(prompts)
+    failures = 0
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        futures = {submit_in_context(pool, timed, evaluate, prompt): i for i, prompt in enumerate(prompts)}
+        for future in as_completed(futures):
+            try:
+                rows[futures[future]] = future.result()
+            except Exception as e:
+                failures += 1
+                sys.stderr.write(f"\nEvaluation failed: {e}\n")
+            sys.stderr.write(".")
+            sys.stderr.flush()
+    elapsed = time.perf_counter() - started
+    sys.stderr.write("\n")
+
+    done = [row for row in rows if row is not None]
+    walls = [row["wall_ms"] for row in done]
+    summary = {
+        "evaluations": len(done),
+        "failures": failures,
+        "mean_ms": round(statistics.mean(walls), 1) if walls else None,
+        "p95_ms": round(percentile(walls, 0.95), 1) if walls else None,
+        "scores_ready_ms": round(statistics.mean(row["scores_ready_ms"] for row in done), 1) if done else None,
+        "evaluations_per_s": round(len(done) / elapsed, 3),
+        "mean_tokens": round(statistics.mean(row["tokens"] for row in done), 1) if done else None,
+    }
+    return summary, [row["evaluation"] if row else None for row in rows]
+
+
+def ranks(values: list) -> list:
+    """
+    1-based ranks, ties sharing their average rank.
+    """
+    order = sorted(range(len(values)), key=values.__getitem__)
+    result = [0.0] * len(values)
+    i = 0
+    while i < len(order):
+        j = i
+        while j + 1 < len(order) and values[order[j + 1]] == values[order[i]]:
+            j += 1
+        for k in range(i, j + 1):
+            result[order[k]] = (i + j) / 2 + 1
+        i = j + 1
+    return result
+
+
+def score_drift(baseline: list, staged: list) -> dict:
+    """
+    How far the staged scores are from the single-call ones, over the prompts
+    both modes evaluated.
+    """
+    pairs = [(a, b) for a, b in zip(baseline, staged) if a and b]
+    if not pairs:
+        return {"prompts": 0}
+    totals = [(a["total_score"], b["total_score"]) for a, b in pairs]
+    gaps = [abs(a - b) for a, b in totals]
+    try:
+        rank_correlation = round(statistics.correlation(ranks([a for a, _ in totals]), ranks([b for _, b in totals])), 3)
+    except statistics.StatisticsError:   # fewer than two prompts, or all scores equal
+        rank_correlation = None
+    return {
+        "prompts": len(pairs),
+        "total_mean_abs_diff": round(statistics.mean(gaps), 1),
+        "total_max_abs_diff": max(gaps),
+        "total_within_10": round(sum(gap <= 10 for gap in gaps) / len(gaps), 3),
+        "total_mean_diff": round(statistics.mean(b - a for a, b in totals), 1),   # > 0: the small model scores higher
+        "total_rank_correlation": rank_correlation,
+        "dimension_mean_abs_diff": {
+            key: round(statistics.mean(abs(a["scores"][key] - b["scores"][key]) for a, b in pairs), 1)
+            for key in SCORE_KEYS
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the single-call evaluator with the two-stage one.")
+    parser.add_argument("input", nargs="?", help="JSONL or CSV file of prompts (default: built-in samples)")
+    parser.add_argument("--prompt-field", default="prompt", help="column/key holding the prompt (default: prompt)")
+    parser.add_argument("--limit", type=int, default=20, help="prompts to use from the input (default: 20)")
+    parser.add_argument("--model", default=LLM_MODEL, help=f"single-call model (default: {LLM_MODEL})")
+    parser.add_argument("--score-model", default=LLM_MODEL_SCORE, help="scoring model (default: LLM_MODEL_SCORE)")
+    parser.add_argument("--rewrite-model", default=LLM_MODEL_REWRITE, help=f"rewrite model (default: {LLM_MODEL_REWRITE})")
+    parser.add_argument("--concurrency", type=int, default=LLM_CONCURRENCY, help="evaluations in flight at once")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+    if not args.score_model:
+        parser.error("set --score-model or LLM_MODEL_SCORE")
+
+    if args.input:
+        prompts = [prompt for _, prompt in read_prompts(args.input, "id", args.prompt_field)][: args.limit]
+    else:
+        prompts = SAMPLE_PROMPTS[: args.limit]
+
+    print(
+        f"Backend: {LLM_BACKEND}, {len(prompts)} prompts, concurrency {args.concurrency}\n"
+        f"  single call: {args.model}\n"
+        f"  staged:      {args.score_model} (scores) + {args.rewrite_model} (diagnosis and rewrite)"
+    )
+    sys.stderr.write("single call ")
+    single, baseline = run_mode(lambda p: evaluate_in_one_call(p, model=args.model), prompts, args.concurrency)
+    sys.stderr.write("staged ")
+    staged, candidate = run_mode(
+        lambda p: evaluate_in_stages(p, score_model=args.score_model, rewrite_model=args.rewrite_model),
+        prompts, args.concurrency,
+    )
+    drift = score_drift(baseline, candidate)
+
+    header = f"{'mode':<12} {'mean ms':>10} {'p95 ms':>10} {'scores ready ms':>16} {'evals/s':>9} {'tokens':>8} {'failed':>7}"
+    print(header)
+    print("-" * len(header))
+    for name, m in (("single call", single), ("staged", staged)):
+        print(
+            f"{name:<12} {m['mean_ms']!s:>10} {m['p95_ms']!s:>10} {m['scores_ready_ms']!s:>16} "
+            f"{m['evaluations_per_s']:>9} {m['mean_tokens']!s:>8} {m['failures']:>7}"
+        )
+    print("\nScore drift (staged vs single call):")
+    for key, value in drift.items():
+        print(f"  {key}: {value}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"single_call": single, "staged": staged, "drift": drift}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,2774 @@
+# evaluator.py
+#
+# Everything that talks to Ollama: HTTP session, chat calls, caches and the
+# prompt evaluator itself. Shared by the Streamlit app and the headless tools.
+
+import abc
+import asyncio
+import atexit
+import functools
+import json
+import logging
+import os
+import queue
+import random
+import re
+import textwrap
+import contextvars
+import threading
+import time
+from concurrent.futures import CancelledError, ThreadPoolExecutor, as_completed
+from dataclasses import asdict, dataclass
+
+import aiohttp
+import requests
+from requests.adapters import HTTPAdapter
+
+from async_client import AsyncLoopThread, GenerationCancelledError, GenerationRegistry, Waiters, readlines_within
+from jobs import JobRunner
+from metrics import observe_chat
+from ollama_router import OllamaRouter
+from result_cache import ResultCache
+from scheduler import FairScheduler, RequestShedError, current_session
+from single_flight import SingleFlight
+from timeouts import (
+    DeadlineExceededError,
+    Timeouts,
+    check_deadline,
+    deadline_passed,
+    deadline_scope,
+    iter_lines_within,
+    parse_timeouts,
+    remaining,
+    stage_deadline,
+)
+from stub_ollama import stub_reply, tokenize
+
+logger = logging.getLogger(__name__)
+
+# ---------------------------
+# Basic configuration
+# ---------------------------
+
+# Allow configuring the Ollama URL via environment variable (useful in Docker)
+OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
+OLLAMA_URL = OLLAMA_BASE_URL.rstrip("/") + "/api/chat"
+
+# Several Ollama hosts can share the load: comma-separated list, defaults to OLLAMA_BASE_URL
+OLLAMA_BASE_URLS = [
+    url.strip().rstrip("/")
+    for url in os.getenv("OLLAMA_BASE_URLS", OLLAMA_BASE_URL).split(",")
+    if url.strip()
+]
+OLLAMA_HEALTH_INTERVAL = float(os.getenv("OLLAMA_HEALTH_INTERVAL", "10"))   # seconds between health checks
+OLLAMA_EJECT_AFTER = int(os.getenv("OLLAMA_EJECT_AFTER", "3"))               # consecutive failures before ejecting a host
+OLLAMA_EJECT_SECONDS = float(os.getenv("OLLAMA_EJECT_SECONDS", "30"))        # how long an ejected host is skipped
+
+OLLAMA_MODEL = "llama3.3"   # Change if your model has a different name
+
+# Which server runs the model: "ollama", "openai" (any OpenAI-compatible server,
+# e.g. vLLM or llama.cpp's llama-server) or "stub" (in-process, for benchmarks)
+LLM_BACKEND = os.getenv("LLM_BACKEND", "ollama").lower()
+LLM_MODEL = os.getenv("LLM_MODEL", "stub" if LLM_BACKEND == "stub" else OLLAMA_MODEL)
+
+# The evaluator can run as two stages on different models. Set LLM_MODEL_SCORE
+# to a small model (e.g. "llama3.2:3b") to have it produce the scores; then
+# LLM_MODEL_REWRITE (LLM_MODEL by default) only writes the diagnosis and the
+# improved prompt. Unset, a single LLM_MODEL call does everything.
+LLM_MODEL_SCORE = os.getenv("LLM_MODEL_SCORE", "")
+LLM_MODEL_REWRITE = os.getenv("LLM_MODEL_REWRITE", LLM_MODEL)
+
+# How an evaluation is generated: "single" (one call writes everything),
+# "staged" (scores, then diagnosis and rewrite; the default with LLM_MODEL_SCORE)
+# or "parallel" (scores, diagnosis and improved prompt as concurrent sub-calls,
+# the scores on LLM_MODEL_SCORE if set)
+EVALUATOR_MODE = os.getenv("EVALUATOR_MODE", "staged" if LLM_MODEL_SCORE else "single").lower()
+
+# OpenAI-compatible servers: comma-separated base URLs, without the /v1 suffix
+OPENAI_BASE_URLS = [
+    url.strip().rstrip("/")
+    for url in os.getenv("OPENAI_BASE_URLS", "http://localhost:8080").split(",")
+    if url.strip()
+]
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "")
+
+# Seconds per generated token of the stub backend (0 answers instantly)
+STUB_TOKEN_DELAY = float(os.getenv("STUB_TOKEN_DELAY", "0"))
+
+# HTTP connection pool shared by every caller in this process
+OLLAMA_POOL_CONNECTIONS = int(os.getenv("OLLAMA_POOL_CONNECTIONS", "4"))   # hosts kept in the pool
+OLLAMA_POOL_MAXSIZE = int(os.getenv("OLLAMA_POOL_MAXSIZE", "16"))          # keep-alive connections per host
+OLLAMA_POOL_BLOCK = os.getenv("OLLAMA_POOL_BLOCK", "false").lower() == "true"  # wait instead of exceeding the per-host limit
+
+# Keep the model loaded between requests, and load it when the process starts
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+OLLAMA_PRELOAD = os.getenv("OLLAMA_PRELOAD", "true").lower() == "true"
+
+# Number of generations Ollama serves concurrently (match the server's OLLAMA_NUM_PARALLEL)
+OLLAMA_NUM_PARALLEL = int(os.getenv("OLLAMA_NUM_PARALLEL", "2"))
+
+# Generations kept in flight against the backend: by default every Ollama
+# host's OLLAMA_NUM_PARALLEL. vLLM and llama.cpp batch concurrent requests on
+# the GPU, so they get more by default.
+LLM_CONCURRENCY = int(
+    os.getenv(
+        "LLM_CONCURRENCY",
+        str(16 if LLM_BACKEND == "openai" else OLLAMA_NUM_PARALLEL * len(OLLAMA_BASE_URLS)),
+    )
+)
+
+# Calls beyond LLM_CONCURRENCY wait in per-session fair queues; a call whose
+# expected wait exceeds this many seconds is rejected right away
+LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", "120"))
+
+# Threads that run streams and batched chats in the background. They don't
+# limit the generations (the scheduler does), so calls never queue FIFO in
+# front of it; threads are only started as needed.
+LLM_PUMP_WORKERS = int(os.getenv("LLM_PUMP_WORKERS", "256"))
+
+# Background jobs started from the app (evaluations, answer comparisons). They
+# mostly wait for scheduler slots, so there are more workers than slots.
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", str(4 * max(1, LLM_CONCURRENCY))))
+JOB_TTL = float(os.getenv("JOB_TTL", "3600"))                       # seconds a finished job is kept
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "0.5"))    # seconds between page refreshes while jobs run
+
+# Timeouts per call type, in seconds: connect, first byte (queueing on the
+# server, model load, prompt ingestion), gap between streamed chunks, and the
+# overall budget that queueing, retries and repairs all share.
+# Override with e.g. LLM_TIMEOUTS_EVALUATE="first_byte=60,total=120".
+DEFAULT_TIMEOUTS = {
+    "evaluate": Timeouts(connect=5, first_byte=90, inter_chunk=30, total=180),
+    "answer": Timeouts(connect=5, first_byte=60, inter_chunk=30, total=180),
+    "score": Timeouts(connect=5, first_byte=60, inter_chunk=30, total=60),
+    "rewrite": Timeouts(connect=5, first_byte=90, inter_chunk=30, total=180),
+    "scores": Timeouts(connect=5, first_byte=60, inter_chunk=30, total=90),
+    "diagnosis": Timeouts(connect=5, first_byte=90, inter_chunk=30, total=180),
+    "improve": Timeouts(connect=5, first_byte=90, inter_chunk=30, total=180),
+    "repair": Timeouts(connect=5, first_byte=60, inter_chunk=30, total=90),
+    "preload": Timeouts(connect=5, first_byte=300, inter_chunk=30, total=300),
+    "chat": Timeouts(),
+}
+CALL_TIMEOUTS = {
+    call: parse_timeouts(os.getenv(f"LLM_TIMEOUTS_{call.upper()}", ""), default)
+    for call, default in DEFAULT_TIMEOUTS.items()
+}
+
+# Render tokens as they arrive instead of waiting for the full completion
+OLLAMA_STREAM = os.getenv("OLLAMA_STREAM", "true").lower() == "true"
+
+# Talk to Ollama through an asyncio client whose generations can be cancelled:
+# closing the connection makes Ollama stop generating and frees its slot
+OLLAMA_ASYNC = os.getenv("OLLAMA_ASYNC", "true").lower() == "true"
+
+# Persistent evaluation cache (mount the cache directory as a volume to keep it across containers)
+EVAL_CACHE_ENABLED = os.getenv("EVAL_CACHE_ENABLED", "true").lower() == "true"
+EVAL_CACHE_PATH = os.getenv("EVAL_CACHE_PATH", "cache/evaluations.sqlite3")
+EVAL_CACHE_MAX_ENTRIES = int(os.getenv("EVAL_CACHE_MAX_ENTRIES", "5000"))
+EVAL_CACHE_TTL = int(os.getenv("EVAL_CACHE_TTL", str(7 * 24 * 3600)))   # seconds
+
+# Identical evaluations in flight at the same time share one generation.
+# With the evaluation cache on, lock files in EVAL_LOCK_DIR extend this across
+# processes (e.g. API server and Streamlit); an empty value disables them.
+EVAL_SINGLE_FLIGHT = os.getenv("EVAL_SINGLE_FLIGHT", "true").lower() == "true"
+EVAL_LOCK_DIR = os.getenv("EVAL_LOCK_DIR", "cache/locks")
+
+# Cross-session cache for comparison answers
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "true").lower() == "true"
+ANSWER_CACHE_PATH = os.getenv("ANSWER_CACHE_PATH", "cache/answers.sqlite3")
+ANSWER_CACHE_MAX_MB = int(os.getenv("ANSWER_CACHE_MAX_MB", "64"))
+ANSWER_CACHE_TTL = int(os.getenv("ANSWER_CACHE_TTL", str(24 * 3600)))   # seconds
+
+# Deterministic decoding for answers, so a cached answer is a valid answer
+ANSWER_SEED = int(os.getenv("ANSWER_SEED", "42"))
+ANSWER_TEMPERATURE = float(os.getenv("ANSWER_TEMPERATURE", "0"))
+
+
+def parse_options(spec: str) -> dict:
+    """
+    Parse "num_predict=256,temperature=0.7" into options; "none" unsets one.
+    """
+    options = {}
+    for part in filter(None, (p.strip() for p in spec.split(","))):
+        name, _, value = part.partition("=")
+        value = value.strip()
+        if value.lower() == "none":
+            options[name.strip()] = None
+        else:
+            options[name.strip()] = int(value) if value.lstrip("-").isdigit() else float(value)
+    return options
+
+
+# Generation options per call type, with Ollama's names. Answers are capped
+# so comparisons don't run on for pages; num_ctx is sized for the rubric plus
+# a long prompt and its evaluation. Keep num_ctx equal across call types:
+# Ollama reloads the model whenever it changes.
+# Override with e.g. LLM_OPTIONS_ANSWER="num_predict=256,temperature=0.7".
+DEFAULT_OPTION_PROFILES = {
+    "evaluate": {"num_ctx": 4096, "num_predict": 1024, "temperature": 0, "seed": 42},
+    "score": {"num_ctx": 4096, "num_predict": 128, "temperature": 0, "seed": 42},
+    "rewrite": {"num_ctx": 4096, "num_predict": 1024, "temperature": 0, "seed": 42},
+    "scores": {"num_ctx": 4096, "num_predict": 256, "temperature": 0, "seed": 42},
+    "diagnosis": {"num_ctx": 4096, "num_predict": 768, "temperature": 0, "seed": 42},
+    "improve": {"num_ctx": 4096, "num_predict": 512, "temperature": 0, "seed": 42},
+    "repair": {"num_ctx": 4096, "num_predict": 1024, "temperature": 0, "seed": 42},
+    "answer": {"num_ctx": 4096, "num_predict": 512, "temperature": ANSWER_TEMPERATURE, "seed": ANSWER_SEED},
+}
+OPTION_PROFILES = {
+    call: {**profile, **parse_options(os.getenv(f"LLM_OPTIONS_{call.upper()}", ""))}
+    for call, profile in DEFAULT_OPTION_PROFILES.items()
+}
+
+# Retries for transport errors (connection failures, 5xx, 429), with jittered exponential backoff
+OLLAMA_MAX_ATTEMPTS = int(os.getenv("OLLAMA_MAX_ATTEMPTS", "3"))
+OLLAMA_BACKOFF_BASE = float(os.getenv("OLLAMA_BACKOFF_BASE", "0.5"))   # seconds
+OLLAMA_BACKOFF_MAX = float(os.getenv("OLLAMA_BACKOFF_MAX", "8"))       # seconds
+
+# Cheap "fix this JSON" passes on evaluator outputs that can't be parsed
+EVALUATOR_MAX_REPAIRS = int(os.getenv("EVALUATOR_MAX_REPAIRS", "1"))
+
+# Rubric dimensions scored by the evaluator, with their maximum score
+SCORE_KEYS = ("persona", "task", "context", "constraints", "clarity")
+SCORE_MAX = {"persona": 25, "task": 25, "context": 20, "constraints": 15, "clarity": 15}
+
+# Constrain the evaluator's decoding to EVALUATION_SCHEMA through Ollama's `format` parameter
+EVALUATOR_STRUCTURED_OUTPUT = os.getenv("EVALUATOR_STRUCTURED_OUTPUT", "true").lower() == "true"
+
+EVALUATION_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "total_score": {"type": "integer", "minimum": 1, "maximum": 100},
+        "scores": {
+            "type": "object",
+            "properties": {
+                key: {"type": "integer", "minimum": 0, "maximum": SCORE_MAX[key]}
+                for key in SCORE_KEYS
+            },
+            "required": list(SCORE_KEYS),
+        },
+        "diagnosis": {
+            "type": "object",
+            "properties": {key: {"type": "string"} for key in SCORE_KEYS},
+            "required": list(SCORE_KEYS),
+        },
+        "improvements": {"type": "array", "items": {"type": "string"}},
+        "improved_prompt": {"type": "string"},
+        "short_explanation": {"type": "string"},
+    },
+    "required": [
+        "total_score",
+        "scores",
+        "diagnosis",
+        "improvements",
+        "improved_prompt",
+        "short_explanation",
+    ],
+}
+
+# What each evaluator stage produces when the evaluation is split:
+# "score" and "rewrite" run one after the other, the rest in parallel
+STAGE_FIELDS = {
+    "score": ("total_score", "scores"),
+    "rewrite": ("diagnosis", "improvements", "improved_prompt", "short_explanation"),
+    "scores": ("total_score", "scores", "short_explanation"),
+    "diagnosis": ("diagnosis", "improvements"),
+    "improve": ("improved_prompt",),
+}
+STAGE_SCHEMAS = {
+    stage: {
+        "type": "object",
+        "properties": {field: EVALUATION_SCHEMA["properties"][field] for field in fields},
+        "required": list(fields),
+    }
+    for stage, fields in STAGE_FIELDS.items()
+}
+
+# ---------------------------
+# Helpers to talk to Ollama
+# ---------------------------
+
+@functools.lru_cache(maxsize=None)
+def get_http_session() -> requests.Session:
+    """
+    Process-wide HTTP session with a keep-alive connection pool.
+    Created once per process, so every Streamlit rerun and session (and every
+    headless worker) reuses the same TCP connections to Ollama.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=OLLAMA_POOL_CONNECTIONS,
+        pool_maxsize=OLLAMA_POOL_MAXSIZE,
+        pool_block=OLLAMA_POOL_BLOCK,
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers.update({"Connection": "keep-alive"})
+    return session
+
+
+@functools.lru_cache(maxsize=None)
+def get_router() -> OllamaRouter:
+    """
+    Process-wide router over the hosts of the configured backend
+    (OPENAI_BASE_URLS for "openai", OLLAMA_BASE_URLS otherwise). With several
+    hosts, a background health check keeps their status and loaded models up to date.
+    A host is saturated once it runs as many generations as it serves at
+    once (OLLAMA_NUM_PARALLEL; an even share of LLM_CONCURRENCY for "openai").
+    """
+    openai = LLM_BACKEND == "openai"
+    urls = OPENAI_BASE_URLS if openai else OLLAMA_BASE_URLS
+    router = OllamaRouter(
+        urls,
+        session=get_http_session(),
+        saturation=max(1, LLM_CONCURRENCY // len(urls) if openai else OLLAMA_NUM_PARALLEL),
+        eject_after=OLLAMA_EJECT_AFTER,
+        eject_seconds=OLLAMA_EJECT_SECONDS,
+        health_interval=OLLAMA_HEALTH_INTERVAL,
+        health_path="/v1/models" if openai else "/api/ps",
+    )
+    if len(router.backends) > 1:
+        router.start_health_checks()
+    return router
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler() -> FairScheduler:
+    """
+    Process-wide admission control: LLM_CONCURRENCY slots shared fairly
+    between sessions. Created under a lock, like get_single_flight.
+    """
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = FairScheduler(LLM_CONCURRENCY)
+    return _scheduler
+
+
+_async_loop = None
+_generations = None
+_async_lock = threading.Lock()
+
+
+def get_async_loop() -> AsyncLoopThread:
+    """
+    Process-wide event loop for the async Ollama client. Created under a lock:
+    the client's connection pool belongs to the loop it was opened on.
+    """
+    global _async_loop
+    with _async_lock:
+        if _async_loop is None:
+            _async_loop = AsyncLoopThread()
+    return _async_loop
+
+
+def get_generations() -> GenerationRegistry:
+    """
+    Process-wide registry of cancellable generations, per session.
+    """
+    global _generations
+    with _async_lock:
+        if _generations is None:
+            _generations = GenerationRegistry()
+    return _generations
+
+
+@functools.lru_cache(maxsize=None)
+def get_job_runner() -> JobRunner:
+    """
+    Process-wide runner for the app's background jobs. Cancelling a job also
+    aborts the generations it has in flight.
+    """
+    return JobRunner(JOB_WORKERS, ttl_s=JOB_TTL, cancel_generations=cancel_session_generations)
+
+
+def cancel_session_generations(session: str) -> int:
+    """
+    Stop the generations that are still running for a session (or a job
+    id), aborting those no other caller waits on; returns how many were
+    aborted. Only the async Ollama client's generations can be aborted.
+    """
+    return get_generations().cancel_session(session)
+
+
+def queue_wait_limit(deadline: float | None) -> float:
+    """
+    How long a call may wait for a scheduler slot: LLM_QUEUE_TIMEOUT, or less
+    if its deadline is nearer.
+    """
+    return max(0.0, min(LLM_QUEUE_TIMEOUT, remaining(deadline)))
+
+
+def run_scheduled(deadline: float | None, fn, /, *args, **kwargs):
+    """
+    Run a model call once the current session gets a scheduler slot.
+    """
+    with get_scheduler().slot(current_session.get(), queue_wait_limit(deadline)):
+        return fn(*args, **kwargs)
+
+
+def submit_in_context(executor, fn, *args, **kwargs):
+    """
+    executor.submit that carries the caller's context (e.g. its session) into the worker.
+    """
+    return executor.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+
+@functools.lru_cache(maxsize=None)
+def get_pump_executor() -> ThreadPoolExecutor:
+    """
+    Process-wide pool for the threads that drive generations in the
+    background: stream producers and the chats of a batch. It is not what
+    caps the generations: each call waits for its turn in the scheduler
+    (get_scheduler), so its session's fair share, queue position, shedding
+    and deadline all apply.
+    """
+    return ThreadPoolExecutor(
+        max_workers=max(LLM_PUMP_WORKERS, 1),
+        thread_name_prefix="llm-pump",
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def get_section_executor() -> ThreadPoolExecutor:
+    """
+    Worker pool for the sub-calls of parallel evaluations. Kept apart from
+    get_pump_executor, whose workers may be the ones waiting on them.
+    """
+    return ThreadPoolExecutor(
+        max_workers=3 * max(1, LLM_CONCURRENCY),
+        thread_name_prefix="evaluator-section",
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def get_eval_cache():
+    """
+    Process-wide evaluation cache, or None when caching is disabled.
+    """
+    if not EVAL_CACHE_ENABLED:
+        return None
+    return ResultCache(EVAL_CACHE_PATH, max_entries=EVAL_CACHE_MAX_ENTRIES, ttl_seconds=EVAL_CACHE_TTL)
+
+
+_single_flight = None
+_single_flight_lock = threading.Lock()
+
+
+def get_single_flight():
+    """
+    Process-wide coalescer for evaluations, or None when EVAL_SINGLE_FLIGHT is off.
+    Created under a lock: two coalescers racing into existence would defeat it.
+    """
+    global _single_flight
+    if not EVAL_SINGLE_FLIGHT:
+        return None
+    with _single_flight_lock:
+        if _single_flight is None:
+            _single_flight = SingleFlight(
+                lock_dir=EVAL_LOCK_DIR if get_eval_cache() is not None else None,
+                waiters=Waiters,
+                pump_executor=get_pump_executor(),
+            )
+    return _single_flight
+
+
+@functools.lru_cache(maxsize=None)
+def get_answer_cache():
+    """
+    Process-wide answer cache, or None when caching is disabled.
+    """
+    if not ANSWER_CACHE_ENABLED:
+        return None
+    return ResultCache(
+        ANSWER_CACHE_PATH,
+        ttl_seconds=ANSWER_CACHE_TTL,
+        max_bytes=ANSWER_CACHE_MAX_MB * 1024 * 1024,
+    )
+
+
+def http_pool_stats() -> dict:
+    """
+    Return connection pool statistics per Ollama host, for the HTTP client of
+    the active backend (see AsyncOllamaBackend.pool_stats for the async one).
+    """
+    backend = get_backend()
+    if isinstance(backend, AsyncOllamaBackend):
+        return backend.pool_stats()
+    adapter = get_http_session().get_adapter(OLLAMA_URL)
+    pools = adapter.poolmanager.pools
+    stats = {}
+    for key in pools.keys():
+        pool = pools[key]
+        idle = [conn for conn in list(pool.pool.queue) if conn is not None] if pool.pool else []
+        stats[f"{key.key_scheme}://{key.key_host}:{key.key_port}"] = {
+            "connections_opened": pool.num_connections,
+            "requests_sent": pool.num_requests,
+            "idle_connections": len(idle),
+            "max_connections": OLLAMA_POOL_MAXSIZE,
+        }
+    return stats
+
+
+def is_retryable(error: Exception) -> bool:
+    """
+    Transport errors worth retrying: the request never reached the model or the
+    server was temporarily unavailable. Read timeouts are not retried, since the
+    model was already generating for the whole timeout.
+    """
+    if isinstance(error, requests.exceptions.ConnectionError):
+        return True
+    if isinstance(error, requests.exceptions.HTTPError) and error.response is not None:
+        return error.response.status_code == 429 or error.response.status_code >= 500
+    return False
+
+
+def is_host_failure(error: Exception) -> bool:
+    """
+    Errors that count against the host for ejection (unreachable, hanging or failing).
+    """
+    if isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+        return True
+    if isinstance(error, requests.exceptions.HTTPError) and error.response is not None:
+        return error.response.status_code >= 500
+    return False
+
+
+def post_with_retries(
+    payload: dict,
+    timeouts: Timeouts,
+    deadline: float | None,
+    stream: bool = False,
+    path: str = "/api/chat",
+    headers: dict | None = None,
+) -> tuple:
+    """
+    POST a chat payload to `path` on a host picked by the router, retrying
+    transport errors up to OLLAMA_MAX_ATTEMPTS times with full-jitter
+    exponential backoff (a retry may land on another host). No attempt or
+    backoff runs past `deadline`; a timeout that the deadline cut short
+    raises DeadlineExceededError.
+    A streaming response must start within `timeouts.first_byte`; a
+    non-streaming one only arrives complete, so it gets the whole remaining budget.
+    Returns (response, backend); the caller must release the backend
+    through get_router().release once the response is consumed.
+    """
+    router = get_router()
+    model = payload["model"]
+    for attempt in range(1, OLLAMA_MAX_ATTEMPTS + 1):
+        left = check_deadline(deadline)
+        read_timeout = min(timeouts.first_byte, left) if stream else left
+        timeout = (min(timeouts.connect, left), None if read_timeout == float("inf") else read_timeout)
+        backend = router.acquire(model)
+        try:
+            resp = get_http_session().post(
+                backend.url + path, json=payload, headers=headers, timeout=timeout, stream=stream
+            )
+            try:
+                resp.raise_for_status()
+            except requests.exceptions.HTTPError:
+                resp.close()
+                raise
+        except requests.exceptions.RequestException as e:
+            router.release(backend, model, ok=not is_host_failure(e))
+            if isinstance(e, requests.exceptions.Timeout) and deadline_passed(deadline):
+                raise DeadlineExceededError(deadline=deadline) from e
+            if attempt == OLLAMA_MAX_ATTEMPTS or not is_retryable(e):
+                if attempt > 1:
+                    logger.error("Ollama request failed after %d attempts: %s", attempt, e)
+                raise
+            delay = random.uniform(0, min(OLLAMA_BACKOFF_MAX, OLLAMA_BACKOFF_BASE * 2 ** (attempt - 1)))
+            if delay >= remaining(deadline):
+                logger.error("Ollama request failed and its deadline leaves no time to retry: %s", e)
+                raise
+            logger.warning(
+                "Ollama request failed (attempt %d/%d): %s; retrying in %.2fs",
+                attempt, OLLAMA_MAX_ATTEMPTS, e, delay,
+            )
+            time.sleep(delay)
+            continue
+
+        if attempt > 1:
+            logger.info("Ollama request succeeded after %d attempts", attempt)
+        return resp, backend
+
+
+@dataclass
+class ChatResult:
+    """
+    Assistant text of one Ollama chat call, with the timings and token counts
+    Ollama reports (durations converted to milliseconds).
+    """
+
+    content: str
+    model: str
+    call: str = "chat"
+    wall_ms: float = 0.0
+    total_ms: float = 0.0
+    load_ms: float = 0.0
+    prompt_eval_count: int = 0
+    prompt_eval_ms: float = 0.0
+    eval_count: int = 0
+    eval_ms: float = 0.0
+    ttft_ms: float = 0.0
+    cached: bool = False
+
+    @classmethod
+    def from_response(
+        cls,
+        data: dict,
+        call: str,
+        wall_ms: float,
+        ttft_ms: float | None = None,
+        content: str | None = None,
+    ) -> "ChatResult":
+        """
+        Build a result from Ollama's response body (or the final line of a stream).
+        Without a measured `ttft_ms`, time to first token is taken as model load
+        plus prompt ingestion, which is when generation starts on the server.
+        """
+        load_ms = data.get("load_duration", 0) / 1e6
+        prompt_eval_ms = data.get("prompt_eval_duration", 0) / 1e6
+        return cls(
+            content=content if content is not None else data.get("message", {}).get("content", ""),
+            model=data.get("model", ""),
+            call=call,
+            wall_ms=wall_ms,
+            total_ms=data.get("total_duration", 0) / 1e6,
+            load_ms=load_ms,
+            prompt_eval_count=data.get("prompt_eval_count", 0),
+            prompt_eval_ms=prompt_eval_ms,
+            eval_count=data.get("eval_count", 0),
+            eval_ms=data.get("eval_duration", 0) / 1e6,
+            ttft_ms=ttft_ms if ttft_ms is not None else load_ms + prompt_eval_ms,
+        )
+
+    @property
+    def tokens_per_s(self) -> float:
+        return self.eval_count / (self.eval_ms / 1000) if self.eval_ms else 0.0
+
+    @property
+    def prompt_tokens_per_s(self) -> float:
+        return self.prompt_eval_count / (self.prompt_eval_ms / 1000) if self.prompt_eval_ms else 0.0
+
+    def metrics(self) -> dict:
+        """
+        Timings and rates without the content, rounded for display.
+        """
+        data = {key: value for key, value in asdict(self).items() if key != "content"}
+        data["tokens_per_s"] = self.tokens_per_s
+        data["prompt_tokens_per_s"] = self.prompt_tokens_per_s
+        return {key: round(value, 1) if isinstance(value, float) else value for key, value in data.items()}
+
+
+# ---------------------------
+# LLM backends
+# ---------------------------
+
+class LLMBackend(abc.ABC):
+    """
+    A chat server the evaluator can run on. Subclasses implement `chat` and
+    `stream`; `batch` runs several chats concurrently unless the server has a
+    better way to take them.
+    """
+
+    name = "base"
+
+    @abc.abstractmethod
+    def chat(
+        self,
+        messages: list,
+        model: str,
+        timeouts: Timeouts,
+        deadline: float | None = None,
+        options: dict | None = None,
+        format: dict | str | None = None,
+        call: str = "chat",
+    ) -> ChatResult:
+        """
+        One chat completion, within `deadline` if given.
+        """
+
+    @abc.abstractmethod
+    def stream(
+        self,
+        messages: list,
+        model: str,
+        timeouts: Timeouts,
+        deadline: float | None = None,
+        options: dict | None = None,
+        format: dict | str | None = None,
+        on_done=None,
+        call: str = "chat",
+    ):
+        """
+        Yield the reply chunk by chunk; `on_done` gets the final ChatResult.
+        """
+
+    def batch(
+        self,
+        conversations: list,
+        model: str,
+        timeouts: Timeouts,
+        deadline: float | None = None,
+        options: dict | None = None,
+        format: dict | str | None = None,
+        call: str = "chat",
+    ) -> list:
+        """
+        Run one chat per message list on the pump pool (get_pump_executor),
+        each through the scheduler, so they wait their turn there and not
+        behind other sessions' work. Returns a ChatResult or the raised
+        exception for each, in order.
+        """
+        executor = get_pump_executor()
+        futures = [
+            submit_in_context(
+                executor, run_scheduled, deadline, self.chat, messages, model, timeouts,
+                deadline=deadline, options=options, format=format, call=call,
+            )
+            for messages in conversations
+        ]
+        results = []
+        for future in futures:
+            try:
+                results.append(future.result())
+            except Exception as e:
+                results.append(e)
+        return results
+
+    def stats(self) -> dict:
+        return {"backend": self.name}
+
+
+class OllamaBackend(LLMBackend):
+    """
+    Ollama's native /api/chat, routed across OLLAMA_BASE_URLS.
+    """
+
+    name = "ollama"
+
+    def _payload(self, messages, model, stream, options, format) -> dict:
+        payload = {
+            "model": model,
+            "messages": messages,
+            "stream": stream,
+            "keep_alive": OLLAMA_KEEP_ALIVE,
+        }
+        if options:
+            payload["options"] = options
+        if format:
+            payload["format"] = format
+        return payload
+
+    def chat(self, messages, model, timeouts, deadline=None, options=None, format=None, call="chat") -> ChatResult:
+        started = time.perf_counter()
+        resp, backend = post_with_retries(self._payload(messages, model, False, options, format), timeouts, deadline)
+        try:
+            data = resp.json()
+        except ValueError:
+            get_router().release(backend, model, ok=False)
+            raise
+        wall_ms = (time.perf_counter() - started) * 1000
+        get_router().release(backend, model, ok=True, elapsed_ms=wall_ms)
+        return ChatResult.from_response(data, call, wall_ms=wall_ms)
+
+    def stream(self, messages, model, timeouts, deadline=None, options=None, format=None, on_done=None, call="chat"):
+        started = time.perf_counter()
+        ttft_ms = None
+        content = []
+
+        # Only opening the stream is retried; once tokens flow, errors propagate
+        resp, backend = post_with_retries(
+            self._payload(messages, model, True, options, format), timeouts, deadline, stream=True
+        )
+        ok = False
+        try:
+            for line in iter_lines_within(resp, timeouts, deadline):
+                if not line:
+                    continue
+                data = json.loads(line)
+                if "error" in data:
+                    raise RuntimeError(data["error"])
+                chunk = data.get("message", {}).get("content", "")
+                if chunk:
+                    if ttft_ms is None:
+                        ttft_ms = (time.perf_counter() - started) * 1000
+                    content.append(chunk)
+                    yield chunk
+                if data.get("done"):
+                    if on_done is not None:
+                        on_done(
+                            ChatResult.from_response(
+                                data,
+                                call,
+                                wall_ms=(time.perf_counter() - started) * 1000,
+                                ttft_ms=ttft_ms,
+                                content="".join(content),
+                            )
+                        )
+                    break
+            # A complete stream, or the consumer stopping early, both leave the host healthy
+            ok = True
+        except GeneratorExit:
+            ok = True
+            raise
+        finally:
+            resp.close()
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            get_router().release(backend, model, ok=ok, elapsed_ms=elapsed_ms if ok else None)
+
+    def stats(self) -> dict:
+        return {"backend": self.name, "hosts": get_router().stats()}
+
+
+def as_requests_error(error: BaseException) -> Exception:
+    """
+    The requests exception matching an aiohttp/asyncio one, so the async
+    client's errors go through is_retryable, is_host_failure and the callers'
+    error handling like the sync client's.
+    """
+    if isinstance(error, (requests.exceptions.RequestException, DeadlineExceededError)):
+        return error
+    if isinstance(error, aiohttp.ConnectionTimeoutError):
+        return requests.exceptions.ConnectTimeout(str(error) or "Timed out connecting to the model server.")
+    if isinstance(error, asyncio.TimeoutError):
+        return requests.exceptions.ReadTimeout(str(error) or "Timed out waiting for the model.")
+    if isinstance(error, aiohttp.ClientConnectionError):
+        return requests.exceptions.ConnectionError(str(error))
+    return requests.exceptions.RequestException(str(error))
+
+
+def http_error(status: int, body: str, url: str) -> requests.exceptions.HTTPError:
+    """
+    requests' HTTPError for an error status the async client received.
+    """
+    response = requests.Response()
+    response.status_code = status
+    response.url = url
+    response._content = body.encode("utf-8")
+    return requests.exceptions.HTTPError(f"{status} Error for url: {url}: {body[:200]}", response=response)
+
+
+class AsyncOllamaBackend(OllamaBackend):
+    """
+    OllamaBackend on an aiohttp client running on the shared event loop
+    (get_async_loop). Callers still block, but each generation is a task
+    tracked with the callers waiting on it, so cancel_session_generations can
+    abort it once none is left: its connection is closed and Ollama stops
+    generating.
+    """
+
+    name = "ollama-async"
+
+    def __init__(self):
+        self._client = None   # aiohttp.ClientSession, opened on the loop
+        self._pool = {}       # host -> connection counters, kept by the client's trace hooks
+        self._pool_lock = threading.Lock()
+        atexit.register(self.close)
+
+    def close(self) -> None:
+        """
+        Close the client's connections (registered to run at exit).
+        """
+        if self._client is not None and not self._client.closed:
+            get_async_loop().submit(self._client.close()).result(timeout=5)
+
+    def _client_session(self) -> aiohttp.ClientSession:
+        if self._client is None:
+            connector = aiohttp.TCPConnector(limit=0, limit_per_host=OLLAMA_POOL_MAXSIZE)
+            trace = aiohttp.TraceConfig()
+            trace.on_request_start.append(self._on_request_start)
+            trace.on_connection_create_end.append(self._on_connection_opened)
+            trace.on_connection_reuseconn.append(self._on_connection_reused)
+            self._client = aiohttp.ClientSession(connector=connector, trace_configs=[trace])
+        return self._client
+
+    def _count(self, host: str, counter: str) -> None:
+        with self._pool_lock:
+            counts = self._pool.setdefault(
+                host,
+                {"connections_opened": 0, "connections_reused": 0, "requests_sent": 0, "max_connections": OLLAMA_POOL_MAXSIZE},
+            )
+            counts[counter] += 1
+
+    # The trace context is per request, so the connection hooks know its host
+    async def _on_request_start(self, session, context, params) -> None:
+        context.host = f"{params.url.scheme}://{params.url.host}:{params.url.port}"
+        self._count(context.host, "requests_sent")
+
+    async def _on_connection_opened(self, session, context, params) -> None:
+        self._count(context.host, "connections_opened")
+
+    async def _on_connection_reused(self, session, context, params) -> None:
+        self._count(context.host, "connections_reused")
+
+    def pool_stats(self) -> dict:
+        """
+        http_pool_stats for the aiohttp client: connections opened and
+        reused, and requests sent, per Ollama host.
+        """
+        with self._pool_lock:
+            return {host: dict(counts) for host, counts in self._pool.items()}
+
+    async def _post(self, payload: dict, timeouts: Timeouts, deadline: float | None, stream: bool) -> tuple:
+        """
+        post_with_retries on the async client. Returns (response, backend);
+        the caller releases both.
+        """
+        router = get_router()
+        model = payload["model"]
+        for attempt in range(1, OLLAMA_MAX_ATTEMPTS + 1):
+            left = check_deadline(deadline)
+            read_timeout = min(timeouts.first_byte, left) if stream else left
+            timeout = aiohttp.ClientTimeout(
+                sock_connect=min(timeouts.connect, left),
+                sock_read=None if read_timeout == float("inf") else read_timeout,
+            )
+            backend = router.acquire(model)
+            url = backend.url + "/api/chat"
+            try:
+                resp = await self._client_session().post(url, json=payload, timeout=timeout)
+                if resp.status >= 400:
+                    body = await resp.text()
+                    resp.release()
+                    raise http_error(resp.status, body, url)
+            except asyncio.CancelledError:
+                router.release(backend, model, ok=True)
+                raise
+            except (aiohttp.ClientError, asyncio.TimeoutError, requests.exceptions.RequestException) as e:
+                error = as_requests_error(e)
+                router.release(backend, model, ok=not is_host_failure(error))
+                if isinstance(error, requests.exceptions.Timeout) and deadline_passed(deadline):
+                    raise DeadlineExceededError(deadline=deadline) from e
+                if attempt == OLLAMA_MAX_ATTEMPTS or not is_retryable(error):
+                    if attempt > 1:
+                        logger.error("Ollama request failed after %d attempts: %s", attempt, error)
+                    raise error from e
+                delay = random.uniform(0, min(OLLAMA_BACKOFF_MAX, OLLAMA_BACKOFF_BASE * 2 ** (attempt - 1)))
+                if delay >= remaining(deadline):
+                    logger.error("Ollama request failed and its deadline leaves no time to retry: %s", error)
+                    raise error from e
+                logger.warning(
+                    "Ollama request failed (attempt %d/%d): %s; retrying in %.2fs",
+                    attempt, OLLAMA_MAX_ATTEMPTS, error, delay,
+                )
+                await asyncio.sleep(delay)
+                continue
+
+            if attempt > 1:
+                logger.info("Ollama request succeeded after %d attempts", attempt)
+            return resp, backend
+
+    async def _chat(self, payload, timeouts, deadline, call) -> ChatResult:
+        started = time.perf_counter()
+        model = payload["model"]
+        resp, backend = await self._post(payload, timeouts, deadline, stream=False)
+        ok = False
+        try:
+            try:
+                data = await resp.json(content_type=None)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                error = as_requests_error(e)
+                if isinstance(error, requests.exceptions.Timeout) and deadline_passed(deadline):
+                    raise DeadlineExceededError(deadline=deadline) from e
+                raise error from e
+            ok = True
+        except asyncio.CancelledError:
+            ok = True
+            raise
+        finally:
+            if ok:
+                resp.release()
+            else:
+                resp.close()
+            wall_ms = (time.perf_counter() - started) * 1000
+            get_router().release(backend, model, ok=ok, elapsed_ms=wall_ms if ok else None)
+        return ChatResult.from_response(data, call, wall_ms=wall_ms)
+
+    async def _stream(self, payload, timeouts, deadline, call, emit) -> ChatResult | None:
+        """
+        Pass each chunk to `emit`; returns the final ChatResult (None if the
+        stream ended without one).
+        """
+        started = time.perf_counter()
+        model = payload["model"]
+        ttft_ms = None
+        content = []
+        resp, backend = await self._post(payload, timeouts, deadline, stream=True)
+        ok = finished = False
+        try:
+            try:
+                async for line in readlines_within(resp.content, timeouts, deadline):
+                    data = json.loads(line)
+                    if "error" in data:
+                        raise RuntimeError(data["error"])
+                    chunk = data.get("message", {}).get("content", "")
+                    if chunk:
+                        if ttft_ms is None:
+                            ttft_ms = (time.perf_counter() - started) * 1000
+                        content.append(chunk)
+                        emit(chunk)
+                    if data.get("done"):
+                        finished = ok = True
+                        return ChatResult.from_response(
+                            data,
+                            call,
+                            wall_ms=(time.perf_counter() - started) * 1000,
+                            ttft_ms=ttft_ms,
+                            content="".join(content),
+                        )
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                raise as_requests_error(e) from e
+            finished = ok = True
+            return None
+        except asyncio.CancelledError:
+            # Aborted by its session, not the host's fault
+            ok = True
+            raise
+        finally:
+            # A finished response goes back to the pool; closing an unfinished
+            # one drops the connection, which is what stops the generation
+            if finished:
+                resp.release()
+            else:
+                resp.close()
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            get_router().release(backend, model, ok=ok, elapsed_ms=elapsed_ms if finished else None)
+
+    def _submit(self, coro):
+        future = get_async_loop().submit(coro)
+        get_generations().track(future)
+        return future
+
+    def chat(self, messages, model, timeouts, deadline=None, options=None, format=None, call="chat") -> ChatResult:
+        future = self._submit(self._chat(self._payload(messages, model, False, options, format), timeouts, deadline, call))
+        try:
+            return future.result()
+        except CancelledError:
+            raise GenerationCancelledError("The generation was cancelled.") from None
+
+    def stream(self, messages, model, timeouts, deadline=None, options=None, format=None, on_done=None, call="chat"):
+        items = queue.Queue()
+
+        async def pump():
+            try:
+                result = await self._stream(
+                    self._payload(messages, model, True, options, format), timeouts, deadline, call,
+                    emit=lambda chunk: items.put(("chunk", chunk)),
+                )
+            except Exception as e:
+                items.put(("error", e))
+            else:
+                items.put(("done", result))
+
+        def on_cancelled(done):
+            # A task cancelled before it started never ran pump's handlers
+            if done.cancelled():
+                items.put(("cancelled", None))
+
+        future = self._submit(pump())
+        future.add_done_callback(on_cancelled)
+        try:
+            while True:
+                kind, value = items.get()
+                if kind == "chunk":
+                    yield value
+                elif kind == "done":
+                    if value is not None and on_done is not None:
+                        on_done(value)
+                    return
+                elif kind == "error":
+                    raise value
+                else:
+                    raise GenerationCancelledError("The generation was cancelled.")
+        finally:
+            # Stops the generation if the consumer gave up early; a no-op otherwise
+            future.cancel()
+
+    def stats(self) -> dict:
+        return {"backend": self.name, "hosts": get_router().stats(), "generations": get_generations().stats()}
+
+
+class OpenAICompatibleBackend(LLMBackend):
+    """
+    Any server speaking OpenAI's /v1/chat/completions (vLLM, llama.cpp's
+    llama-server, ...), routed across OPENAI_BASE_URLS. These servers batch
+    concurrent requests on the GPU, so `batch` simply keeps LLM_CONCURRENCY
+    requests in flight.
+
+    They don't report Ollama's server-side timings: llama.cpp's `timings` are
+    used when present, otherwise prompt/generation time is estimated from the
+    client-side time to first token.
+    """
+
+    name = "openai"
+
+    # Ollama option -> OpenAI request field; other options are dropped
+    OPTION_FIELDS = {
+        "temperature": "temperature",
+        "top_p": "top_p",
+        "top_k": "top_k",
+        "seed": "seed",
+        "num_predict": "max_tokens",
+        "stop": "stop",
+    }
+
+    def __init__(self, api_key: str = ""):
+        self.headers = {"Authorization": f"Bearer {api_key}"} if api_key else None
+
+    def _payload(self, messages, model, stream, options, format) -> dict:
+        payload = {"model": model, "messages": messages, "stream": stream}
+        for key, value in (options or {}).items():
+            field = self.OPTION_FIELDS.get(key)
+            if field is not None and not (key == "num_predict" and value < 0):
+                payload[field] = value
+        if isinstance(format, dict):
+            payload["response_format"] = {
+                "type": "json_schema",
+                "json_schema": {"name": "response", "schema": format, "strict": True},
+            }
+        elif format == "json":
+            payload["response_format"] = {"type": "json_object"}
+        if stream:
+            payload["stream_options"] = {"include_usage": True}
+        return payload
+
+    @staticmethod
+    def _result(content, model, call, wall_ms, ttft_ms, usage, timings) -> ChatResult:
+        usage = usage or {}
+        if timings:
+            prompt_eval_ms = timings.get("prompt_ms", 0.0)
+            eval_ms = timings.get("predicted_ms", 0.0)
+        else:
+            prompt_eval_ms = ttft_ms or 0.0
+            eval_ms = max(wall_ms - prompt_eval_ms, 0.0) if ttft_ms is not None else 0.0
+        return ChatResult(
+            content=content,
+            model=model,
+            call=call,
+            wall_ms=wall_ms,
+            total_ms=wall_ms,
+            prompt_eval_count=usage.get("prompt_tokens", 0),
+            prompt_eval_ms=prompt_eval_ms,
+            eval_count=usage.get("completion_tokens", 0),
+            eval_ms=eval_ms,
+            ttft_ms=ttft_ms if ttft_ms is not None else prompt_eval_ms,
+        )
+
+    def chat(self, messages, model, timeouts, deadline=None, options=None, format=None, call="chat") -> ChatResult:
+        started = time.perf_counter()
+        resp, backend = post_with_retries(
+            self._payload(messages, model, False, options, format),
+            timeouts,
+            deadline,
+            path="/v1/chat/completions",
+            headers=self.headers,
+        )
+        try:
+            data = resp.json()
+            content = data["choices"][0]["message"].get("content") or ""
+        except (ValueError, KeyError, IndexError):
+            get_router().release(backend, model, ok=False)
+            raise
+        wall_ms = (time.perf_counter() - started) * 1000
+        get_router().release(backend, model, ok=True, elapsed_ms=wall_ms)
+        return self._result(content, model, call, wall_ms, None, data.get("usage"), data.get("timings"))
+
+    def stream(self, messages, model, timeouts, deadline=None, options=None, format=None, on_done=None, call="chat"):
+        started = time.perf_counter()
+        ttft_ms = None
+        content = []
+        usage = timings = None
+
+        resp, backend = post_with_retries(
+            self._payload(messages, model, True, options, format),
+            timeouts,
+            deadline,
+            stream=True,
+            path="/v1/chat/completions",
+            headers=self.headers,
+        )
+        ok = False
+        try:
+            # Server-sent events: "data: {...}" lines, terminated by "data: [DONE]"
+            for line in iter_lines_within(resp, timeouts, deadline):
+                if not line.startswith(b"data:"):
+                    continue
+                body = line[5:].strip()
+                if body == b"[DONE]":
+                    break
+                data = json.loads(body)
+                if "error" in data:
+                    raise RuntimeError(data["error"])
+                usage = data.get("usage") or usage
+                timings = data.get("timings") or timings
+                for choice in data.get("choices", []):
+                    chunk = choice.get("delta", {}).get("content") or ""
+                    if chunk:
+                        if ttft_ms is None:
+                            ttft_ms = (time.perf_counter() - started) * 1000
+                        content.append(chunk)
+                        yield chunk
+            if on_done is not None:
+                wall_ms = (time.perf_counter() - started) * 1000
+                on_done(self._result("".join(content), model, call, wall_ms, ttft_ms, usage, timings))
+            ok = True
+        except GeneratorExit:
+            ok = True
+            raise
+        finally:
+            resp.close()
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            get_router().release(backend, model, ok=ok, elapsed_ms=elapsed_ms if ok else None)
+
+    def stats(self) -> dict:
+        return {"backend": self.name, "hosts": get_router().stats()}
+
+
+class StubBackend(LLMBackend):
+    """
+    Deterministic in-process backend for benchmarks and tests: answers like
+    stub_ollama.py without any network, taking STUB_TOKEN_DELAY seconds per token.
+    """
+
+    name = "stub"
+
+    def __init__(self, token_delay: float = 0.0):
+        self.token_delay = token_delay
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def _tokens(self, messages, options, format) -> list:
+        with self._lock:
+            self.calls += 1
+        tokens = tokenize(stub_reply({"messages": messages, "format": format}))
+        limit = (options or {}).get("num_predict")
+        return tokens[:limit] if limit and limit > 0 else tokens
+
+    @staticmethod
+    def _result(content, model, call, messages, tokens, wall_ms, ttft_ms) -> ChatResult:
+        return ChatResult(
+            content=content,
+            model=model,
+            call=call,
+            wall_ms=wall_ms,
+            total_ms=wall_ms,
+            prompt_eval_count=sum(len(m.get("content", "")) for m in messages) // 4,
+            eval_count=len(tokens),
+            eval_ms=wall_ms - ttft_ms,
+            ttft_ms=ttft_ms,
+        )
+
+    def chat(self, messages, model, timeouts, deadline=None, options=None, format=None, call="chat") -> ChatResult:
+        started = time.perf_counter()
+        tokens = self._tokens(messages, options, format)
+        time.sleep(len(tokens) * self.token_delay)
+        check_deadline(deadline)
+        wall_ms = (time.perf_counter() - started) * 1000
+        return self._result("".join(tokens), model, call, messages, tokens, wall_ms, 0.0)
+
+    def stream(self, messages, model, timeouts, deadline=None, options=None, format=None, on_done=None, call="chat"):
+        started = time.perf_counter()
+        tokens = self._tokens(messages, options, format)
+        ttft_ms = None
+        for token in tokens:
+            time.sleep(self.token_delay)
+            check_deadline(deadline)
+            if ttft_ms is None:
+                ttft_ms = (time.perf_counter() - started) * 1000
+            yield token
+        if on_done is not None:
+            wall_ms = (time.perf_counter() - started) * 1000
+            on_done(self._result("".join(tokens), model, call, messages, tokens, wall_ms, ttft_ms or 0.0))
+
+    def stats(self) -> dict:
+        return {"backend": self.name, "calls": self.calls, "token_delay_s": self.token_delay}
+
+
+LLM_BACKENDS = {
+    "ollama": AsyncOllamaBackend if OLLAMA_ASYNC else OllamaBackend,
+    "openai": lambda: OpenAICompatibleBackend(api_key=OPENAI_API_KEY),
+    "stub": lambda: StubBackend(token_delay=STUB_TOKEN_DELAY),
+}
+
+
+@functools.lru_cache(maxsize=None)
+def get_backend() -> LLMBackend:
+    """
+    Process-wide backend selected by LLM_BACKEND.
+    """
+    if LLM_BACKEND not in LLM_BACKENDS:
+        raise ValueError(f"Unknown LLM_BACKEND {LLM_BACKEND!r}; expected one of {', '.join(LLM_BACKENDS)}")
+    return LLM_BACKENDS[LLM_BACKEND]()
+
+
+def generation_options(call: str, overrides: dict | None = None) -> dict:
+    """
+    The options profile of a call type with `overrides` applied; an override
+    of None removes the option (back to the model default).
+    """
+    options = {**OPTION_PROFILES.get(call, {}), **(overrides or {})}
+    return {key: value for key, value in options.items() if value is not None}
+
+
+def call_timeouts(call: str) -> Timeouts:
+    """
+    Timeouts configured for a call type (the "chat" defaults for unknown ones).
+    """
+    return CALL_TIMEOUTS.get(call, CALL_TIMEOUTS["chat"])
+
+
+def ollama_chat(
+    messages,
+    model: str = LLM_MODEL,
+    timeouts: Timeouts | None = None,
+    options: dict | None = None,
+    format: dict | str | None = None,
+    call: str = "chat",
+) -> str:
+    """
+    Call the configured backend and return the assistant text.
+    """
+    return ollama_chat_full(messages, model=model, timeouts=timeouts, options=options, format=format, call=call).content
+
+
+def ollama_chat_full(
+    messages,
+    model: str = LLM_MODEL,
+    timeouts: Timeouts | None = None,
+    options: dict | None = None,
+    format: dict | str | None = None,
+    call: str = "chat",
+) -> ChatResult:
+    """
+    Call the configured backend, once the scheduler grants a slot, and return
+    a ChatResult with the text, token counts and timings. `options` use
+    Ollama's names (num_predict, seed, ...); `format` is "json" or a JSON
+    schema that constrains the output; `call` labels the call type in the
+    exported metrics and picks its timeouts unless `timeouts` is given.
+    The whole call, queueing and retries included, ends by the deadline of
+    its budget (or of the enclosing deadline_scope, if sooner).
+    """
+    timeouts = timeouts or call_timeouts(call)
+    deadline = stage_deadline(timeouts.total)
+    result = run_scheduled(
+        deadline, get_backend().chat, messages, model, timeouts,
+        deadline=deadline, options=options, format=format, call=call,
+    )
+    observe_chat(result)
+    return result
+
+
+def ollama_chat_stream(
+    messages,
+    model: str = LLM_MODEL,
+    timeouts: Timeouts | None = None,
+    options: dict | None = None,
+    format: dict | str | None = None,
+    on_done=None,
+    call: str = "chat",
+):
+    """
+    Call the configured backend in streaming mode and yield the assistant
+    text chunk by chunk. The first chunk must arrive within the first-byte
+    timeout, later ones within the inter-chunk timeout, all by the deadline.
+    `on_done`, if given, is called with the ChatResult of the finished stream,
+    whose time to first token is measured on the client.
+    """
+    timeouts = timeouts or call_timeouts(call)
+    deadline = stage_deadline(timeouts.total)
+
+    def finished(result: ChatResult):
+        observe_chat(result)
+        if on_done is not None:
+            on_done(result)
+
+    # The slot is held until the stream ends or the consumer stops reading
+    with get_scheduler().slot(current_session.get(), queue_wait_limit(deadline)):
+        yield from get_backend().stream(
+            messages, model, timeouts,
+            deadline=deadline, options=options, format=format, on_done=finished, call=call,
+        )
+
+
+def ollama_chat_batch(
+    conversations: list,
+    model: str = LLM_MODEL,
+    timeouts: Timeouts | None = None,
+    options: dict | None = None,
+    format: dict | str | None = None,
+    call: str = "chat",
+) -> list:
+    """
+    Run several chats through the configured backend at once, under one
+    shared deadline. Returns a ChatResult or the raised exception for each
+    message list, in order.
+    """
+    timeouts = timeouts or call_timeouts(call)
+    deadline = stage_deadline(timeouts.total)
+    results = get_backend().batch(
+        conversations, model, timeouts, deadline=deadline, options=options, format=format, call=call
+    )
+    for result in results:
+        if isinstance(result, ChatResult):
+            observe_chat(result)
+    return results
+
+
+CLOSERS = {"{": "}", "[": "]"}
+OBJECT_START = re.compile(r'\{\s*["}]')   # where a JSON object can start: "{" before a key or "}"
+JSON_REPAIR_MAX_STARTS = 32                 # candidate starts tried on unparseable output before giving up
+
+
+def strip_trailing_commas(text: str) -> str:
+    """
+    Remove commas that directly precede a closing bracket, outside of strings.
+    """
+    out = []
+    in_string = escape = False
+    for ch in text:
+        if in_string:
+            if escape:
+                escape = False
+            elif ch == "\\":
+                escape = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch in "}]":
+            while out and out[-1].isspace():
+                out.pop()
+            if out and out[-1] == ",":
+                out.pop()
+        out.append(ch)
+    return "".join(out)
+
+
+class JsonObjectScanner:
+    """
+    Single-pass, string-aware scanner that recovers the first complete
+    top-level JSON object from model output, ignoring fences and prose
+    around it. Feed it streamed chunks as they arrive; `feed` returns the
+    parsed object as soon as it is complete.
+
+    With `repair=True`, trailing commas are dropped and a truncated object
+    (unterminated final string, unclosed brackets) is closed at end of stream,
+    so a cut-off generation still yields its complete fields.
+    """
+
+    def __init__(self, repair: bool = True):
+        self.repair = repair
+        self.text = ""
+        self.result = None
+        self._pos = 0
+        self._reset()
+
+    def _reset(self):
+        self._start = None
+        self._stack = []
+        self._in_string = False
+        self._escape = False
+        self._safe_point = None   # (end position, open brackets) of the last complete member
+
+    def feed(self, chunk: str):
+        """
+        Consume a chunk of output. Returns the parsed object once complete, else None.
+        """
+        if self.result is not None:
+            return self.result
+
+        self.text += chunk
+        text = self.text
+        while self._pos < len(text):
+            ch = text[self._pos]
+            self._pos += 1
+
+            if self._start is None:
+                if ch == "{":
+                    self._start = self._pos - 1
+                    self._stack = ["{"]
+                continue
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                continue
+
+            if ch == '"':
+                self._in_string = True
+            elif ch in "{[":
+                self._stack.append(ch)
+            elif ch == ",":
+                self._safe_point = (self._pos - 1, tuple(self._stack))
+            elif ch in "}]":
+                self._stack.pop()
+                if self._stack:
+                    self._safe_point = (self._pos, tuple(self._stack))
+                    continue
+
+                parsed = self._loads(text[self._start : self._pos])
+                if parsed is not None:
+                    self.result = parsed
+                    return parsed
+                # Balanced but not JSON (e.g. "{braces}" in prose): rescan after that brace
+                self._pos = self._start + 1
+                self._reset()
+
+        return None
+
+    def finish(self) -> dict:
+        """
+        Signal end of output and return the object, repairing a truncated one if allowed.
+        Raises json.JSONDecodeError when no object can be recovered.
+        """
+        if self.result is not None:
+            return self.result
+
+        # A loop over candidate starts, each a rescan: output like "{{{{..." has
+        # as many braces as characters, so only plausible starts are tried, and only so many
+        scanner, offset = self, 0
+        for _ in range(JSON_REPAIR_MAX_STARTS):
+            if scanner._start is None or not self.repair:
+                break
+            for candidate in scanner._truncation_repairs():
+                parsed = self._loads(candidate)
+                if parsed is not None:
+                    self.result = parsed
+                    return parsed
+
+            # The opening brace may belong to prose; try again from the next one
+            match = OBJECT_START.search(self.text, offset + scanner._start + 1)
+            if match is None:
+                break
+            offset = match.start()
+            scanner = JsonObjectScanner(repair=self.repair)
+            parsed = scanner.feed(self.text[offset:])
+            if parsed is not None:
+                self.result = parsed
+                return parsed
+
+        raise json.JSONDecodeError("No valid JSON object found in the model output", self.text, 0)
+
+    def _truncation_repairs(self):
+        body = self.text[self._start :]
+        if self._in_string:
+            body += '"'
+        yield body + "".join(CLOSERS[b] for b in reversed(self._stack))
+
+        if self._safe_point is not None:
+            end, stack = self._safe_point
+            yield self.text[self._start : end] + "".join(CLOSERS[b] for b in reversed(stack))
+
+    def _loads(self, candidate: str):
+        for text in (candidate, strip_trailing_commas(candidate)) if self.repair else (candidate,):
+            try:
+                parsed = json.loads(text)
+            except (json.JSONDecodeError, RecursionError):   # nested deeper than the parser goes
+                continue
+            if isinstance(parsed, dict):
+                return parsed
+        return None
+
+
+def extract_json_from_text(text: str, repair: bool = True) -> dict:
+    """
+    Try to extract a valid JSON object from the model output.
+    Handles cases where JSON is wrapped in ```json ... ``` or other noise,
+    braces inside strings, trailing prose and (with `repair`) truncated output.
+    """
+    scanner = JsonObjectScanner(repair=repair)
+    scanner.feed(text)
+    return scanner.finish()
+
+
+class EvaluationValidationError(ValueError):
+    """
+    Raised when the evaluator output doesn't match the evaluation structure.
+    """
+
+
+def _as_int(value, field: str) -> int:
+    if isinstance(value, bool):
+        raise EvaluationValidationError(f"'{field}' must be an integer")
+    if isinstance(value, int):
+        return value
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    if isinstance(value, str) and value.strip().isdigit():
+        return int(value)
+    raise EvaluationValidationError(f"'{field}' must be an integer")
+
+
+def _as_str(value, field: str) -> str:
+    if not isinstance(value, str):
+        raise EvaluationValidationError(f"'{field}' must be a string")
+    return value
+
+
+@dataclass
+class Evaluation:
+    """
+    Typed evaluator result. `from_dict` validates a parsed model output;
+    scores are clamped to the rubric ranges.
+    """
+
+    total_score: int
+    scores: dict
+    diagnosis: dict
+    improvements: list
+    improved_prompt: str
+    short_explanation: str
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Evaluation":
+        missing = [field for field in EVALUATION_SCHEMA["required"] if field not in data]
+        if missing:
+            raise EvaluationValidationError(f"missing fields: {', '.join(missing)}")
+
+        raw_scores = data["scores"]
+        raw_diagnosis = data["diagnosis"]
+        if not isinstance(raw_scores, dict) or not isinstance(raw_diagnosis, dict):
+            raise EvaluationValidationError("'scores' and 'diagnosis' must be objects")
+        if not isinstance(data["improvements"], list):
+            raise EvaluationValidationError("'improvements' must be a list")
+
+        scores = {}
+        for key in SCORE_KEYS:
+            if key not in raw_scores:
+                raise EvaluationValidationError(f"missing score: {key}")
+            scores[key] = min(max(_as_int(raw_scores[key], f"scores.{key}"), 0), SCORE_MAX[key])
+
+        return cls(
+            total_score=min(max(_as_int(data["total_score"], "total_score"), 1), 100),
+            scores=scores,
+            diagnosis={key: _as_str(raw_diagnosis.get(key, ""), f"diagnosis.{key}") for key in SCORE_KEYS},
+            improvements=[_as_str(item, "improvements[]") for item in data["improvements"]],
+            improved_prompt=_as_str(data["improved_prompt"], "improved_prompt"),
+            short_explanation=_as_str(data["short_explanation"], "short_explanation"),
+        )
+
+
+_parse_stats_lock = threading.Lock()
+_parse_stats = {
+    mode: {"attempts": 0, "failures": 0}
+    for mode in ("structured", "freeform")
+}
+
+
+def evaluator_format(stage: str = "evaluate"):
+    """
+    The `format` sent with evaluator requests: the JSON schema of the stage's
+    output, or None for free-form output.
+    """
+    if not EVALUATOR_STRUCTURED_OUTPUT:
+        return None
+    return STAGE_SCHEMAS.get(stage, EVALUATION_SCHEMA)
+
+
+def parse_evaluation(raw_text: str = "", scanner: "JsonObjectScanner | None" = None) -> dict:
+    """
+    Extract and validate an evaluation from the model output (or from a scanner
+    that was fed the streamed output). Counts attempts and failures per output
+    mode for evaluator_parse_stats().
+    """
+    mode = "structured" if EVALUATOR_STRUCTURED_OUTPUT else "freeform"
+    try:
+        data = scanner.finish() if scanner is not None else extract_json_from_text(raw_text)
+        evaluation = asdict(Evaluation.from_dict(data))
+    except ValueError:
+        with _parse_stats_lock:
+            _parse_stats[mode]["attempts"] += 1
+            _parse_stats[mode]["failures"] += 1
+        raise
+
+    with _parse_stats_lock:
+        _parse_stats[mode]["attempts"] += 1
+    return evaluation
+
+
+JSON_REPAIR_INSTRUCTION = (
+    "The text below was meant to be a single JSON object but it is not valid JSON "
+    "({error}). Fix it: keep every field and value, correct only the syntax. "
+    "Return only the corrected JSON object."
+)
+
+
+def repair_evaluation_json(broken_text: str, error: Exception, stage: str = "evaluate") -> ChatResult:
+    """
+    Ask the model to fix a broken evaluator output. Only the broken text and a
+    short instruction are sent, which is far cheaper than a full re-evaluation.
+    """
+    messages = [
+        {"role": "system", "content": JSON_REPAIR_INSTRUCTION.format(error=error)},
+        {"role": "user", "content": broken_text},
+    ]
+    return ollama_chat_full(
+        messages, options=generation_options("repair"), format=evaluator_format(stage), call="repair"
+    )
+
+
+def parse_evaluation_with_repair(raw_text: str = "", scanner: "JsonObjectScanner | None" = None) -> tuple:
+    """
+    parse_evaluation with up to EVALUATOR_MAX_REPAIRS repair passes on failure.
+    Returns (evaluation, repair_usage) where repair_usage counts the tokens spent on repairs.
+    """
+    usage = {"prompt_tokens": 0, "completion_tokens": 0, "repairs": 0}
+    try:
+        return parse_evaluation(raw_text, scanner), usage
+    except ValueError as e:
+        error = e
+
+    text = scanner.text if scanner is not None else raw_text
+    for attempt in range(1, EVALUATOR_MAX_REPAIRS + 1):
+        logger.warning(
+            "Evaluator output could not be parsed (%s); repair pass %d/%d",
+            error, attempt, EVALUATOR_MAX_REPAIRS,
+        )
+        result = repair_evaluation_json(text, error)
+        usage["repairs"] += 1
+        usage["prompt_tokens"] += result.prompt_eval_count
+        usage["completion_tokens"] += result.eval_count
+        text = result.content
+        try:
+            evaluation = parse_evaluation(text)
+        except ValueError as e:
+            error = e
+            continue
+        logger.info("Evaluator output repaired after %d pass(es)", attempt)
+        return evaluation, usage
+
+    raise error
+
+
+def parse_stage_output(raw_text: str, stage: str) -> tuple:
+    """
+    Extract the fields of one evaluator stage ("score" or "rewrite") from its
+    output, with up to EVALUATOR_MAX_REPAIRS repair passes on failure.
+    Returns (fields, repair_usage); the caller validates the merged evaluation.
+    """
+    usage = {"prompt_tokens": 0, "completion_tokens": 0, "repairs": 0}
+    text = raw_text
+    for attempt in range(EVALUATOR_MAX_REPAIRS + 1):
+        if attempt:
+            logger.warning(
+                "Evaluator %s output could not be parsed (%s); repair pass %d/%d",
+                stage, error, attempt, EVALUATOR_MAX_REPAIRS,
+            )
+            result = repair_evaluation_json(text, error, stage)
+            usage["repairs"] += 1
+            usage["prompt_tokens"] += result.prompt_eval_count
+            usage["completion_tokens"] += result.eval_count
+            text = result.content
+        try:
+            data = extract_json_from_text(text)
+            missing = [field for field in STAGE_FIELDS[stage] if field not in data]
+            if missing:
+                raise EvaluationValidationError(f"missing fields: {', '.join(missing)}")
+        except ValueError as e:
+            error = e
+            continue
+        return {field: data[field] for field in STAGE_FIELDS[stage]}, usage
+
+    raise error
+
+
+def evaluator_parse_stats() -> dict:
+    """
+    Parse attempts, failures and failure rate of evaluator outputs, per output mode.
+    """
+    with _parse_stats_lock:
+        return {
+            mode: {
+                **counts,
+                "failure_rate": round(counts["failures"] / counts["attempts"], 3) if counts["attempts"] else 0.0,
+            }
+            for mode, counts in _parse_stats.items()
+        }
+
+
+def parse_partial_scores(text: str) -> dict:
+    """
+    Read the scores that are already complete in a partial evaluator output.
+    Returns {"total_score": int | None, "scores": {dimension: int}}.
+    """
+    partial = {"total_score": None, "scores": {}}
+
+    # A number is only complete once a delimiter follows it ("2" could become "25")
+    match = re.search(r'"total_score"\s*:\s*(\d+)\s*[,}\n]', text)
+    if match:
+        partial["total_score"] = int(match.group(1))
+
+    start = text.find('"scores"')
+    if start != -1:
+        block = text[start:]
+        end = block.find("}")
+        if end != -1:
+            block = block[: end + 1]
+        for key in SCORE_KEYS:
+            match = re.search(rf'"{key}"\s*:\s*(\d+)\s*[,}}\n]', block)
+            if match:
+                partial["scores"][key] = int(match.group(1))
+
+    return partial
+
+
+# Built once so every evaluator request starts with a byte-identical prefix,
+# which lets Ollama reuse the KV cache of the rubric instead of re-processing it.
+EVALUATOR_SYSTEM_MESSAGE = textwrap.dedent(
+    """
+    You are an expert in prompt engineering.
+    Your task is to evaluate the quality of a prompt that will be used with a ChatGPT-style model,
+    and then improve it.
+
+    You must:
+    1. Rate the prompt from 1 to 100 using this rubric:
+       - Persona / role defined: 0–25
+       - Task / objective clearly stated: 0–25
+       - Enough context: 0–20
+       - Constraints (format, length, language, tone, steps, etc.): 0–15
+       - Clarity and precision of the wording: 0–15
+
+    2. Explain in a didactic way what is missing or weak in each dimension.
+    3. Propose concrete suggestions to improve the prompt.
+    4. Generate an optimized version of the prompt that:
+       - Defines a clear role for the model.
+       - Has a specific objective.
+       - Includes the necessary context.
+       - Specifies format, language and other relevant constraints.
+
+    5. ALWAYS return your answer as a valid JSON object with this exact structure:
+
+    {
+      "total_score": int,
+      "scores": {
+        "persona": int,
+        "task": int,
+        "context": int,
+        "constraints": int,
+        "clarity": int
+      },
+      "diagnosis": {
+        "persona": "string",
+        "task": "string",
+        "context": "string",
+        "constraints": "string",
+        "clarity": "string"
+      },
+      "improvements": [
+        "string",
+        "string"
+      ],
+      "improved_prompt": "string",
+      "short_explanation": "string"
+    }
+
+    Do NOT include anything outside the JSON object.
+    The language of the explanation should match the language of the original prompt.
+    """
+)
+
+EVALUATOR_USER_PREFIX = "Prompt to evaluate:\n\n"
+
+
+def build_evaluator_messages(user_prompt: str) -> list:
+    """
+    Build the chat messages that ask the model to evaluate and improve the prompt.
+    """
+    return [
+        {"role": "system", "content": EVALUATOR_SYSTEM_MESSAGE},
+        {"role": "user", "content": EVALUATOR_USER_PREFIX + user_prompt},
+    ]
+
+
+# The evaluator split in two for EVALUATOR_MODE=staged: a small model rates the
+# prompt, then the rewrite model explains those scores and improves the prompt.
+SCORE_SYSTEM_MESSAGE = textwrap.dedent(
+    """
+    You are an expert in prompt engineering.
+    Your task is to rate the quality of a prompt that will be used with a ChatGPT-style model.
+
+    Rate the prompt from 1 to 100 using this rubric:
+       - Persona / role defined: 0–25
+       - Task / objective clearly stated: 0–25
+       - Enough context: 0–20
+       - Constraints (format, length, language, tone, steps, etc.): 0–15
+       - Clarity and precision of the wording: 0–15
+
+    The total score is the sum of the five scores.
+    ALWAYS return your answer as a valid JSON object with this exact structure:
+
+    {
+      "total_score": int,
+      "scores": {
+        "persona": int,
+        "task": int,
+        "context": int,
+        "constraints": int,
+        "clarity": int
+      }
+    }
+
+    Do NOT include anything outside the JSON object.
+    """
+)
+
+REWRITE_SYSTEM_MESSAGE = textwrap.dedent(
+    """
+    You are an expert in prompt engineering.
+    You receive a prompt that will be used with a ChatGPT-style model, and the scores
+    it got with this rubric:
+       - Persona / role defined: 0–25
+       - Task / objective clearly stated: 0–25
+       - Enough context: 0–20
+       - Constraints (format, length, language, tone, steps, etc.): 0–15
+       - Clarity and precision of the wording: 0–15
+
+    You must:
+    1. Explain in a didactic way what is missing or weak in each dimension, consistently with the scores.
+    2. Propose concrete suggestions to improve the prompt.
+    3. Generate an optimized version of the prompt that:
+       - Defines a clear role for the model.
+       - Has a specific objective.
+       - Includes the necessary context.
+       - Specifies format, language and other relevant constraints.
+
+    4. ALWAYS return your answer as a valid JSON object with this exact structure:
+
+    {
+      "diagnosis": {
+        "persona": "string",
+        "task": "string",
+        "context": "string",
+        "constraints": "string",
+        "clarity": "string"
+      },
+      "improvements": [
+        "string",
+        "string"
+      ],
+      "improved_prompt": "string",
+      "short_explanation": "string"
+    }
+
+    Do NOT include anything outside the JSON object.
+    The language of the explanation should match the language of the original prompt.
+    """
+)
+
+REWRITE_SCORES_PREFIX = "\n\nScores: "
+
+# The evaluator fanned out for EVALUATOR_MODE=parallel: each sub-call writes
+# one section of the evaluation, independently of the others.
+SECTION_SYSTEM_MESSAGES = {
+    "scores": textwrap.dedent(
+        """
+        You are an expert in prompt engineering.
+        Your task is to rate the quality of a prompt that will be used with a ChatGPT-style model.
+
+        Rate the prompt from 1 to 100 using this rubric:
+           - Persona / role defined: 0–25
+           - Task / objective clearly stated: 0–25
+           - Enough context: 0–20
+           - Constraints (format, length, language, tone, steps, etc.): 0–15
+           - Clarity and precision of the wording: 0–15
+
+        The total score is the sum of the five scores. Also summarize your assessment in one or two sentences.
+        ALWAYS return your answer as a valid JSON object with this exact structure:
+
+        {
+          "total_score": int,
+          "scores": {
+            "persona": int,
+            "task": int,
+            "context": int,
+            "constraints": int,
+            "clarity": int
+          },
+          "short_explanation": "string"
+        }
+
+        Do NOT include anything outside the JSON object.
+        The language of the explanation should match the language of the original prompt.
+        """
+    ),
+    "diagnosis": textwrap.dedent(
+        """
+        You are an expert in prompt engineering.
+        Your task is to review a prompt that will be used with a ChatGPT-style model, along these dimensions:
+           - Persona / role defined
+           - Task / objective clearly stated
+           - Enough context
+           - Constraints (format, length, language, tone, steps, etc.)
+           - Clarity and precision of the wording
+
+        You must:
+        1. Explain in a didactic way what is missing or weak in each dimension.
+        2. Propose concrete suggestions to improve the prompt.
+
+        ALWAYS return your answer as a valid JSON object with this exact structure:
+
+        {
+          "diagnosis": {
+            "persona": "string",
+            "task": "string",
+            "context": "string",
+            "constraints": "string",
+            "clarity": "string"
+          },
+          "improvements": [
+            "string",
+            "string"
+          ]
+        }
+
+        Do NOT include anything outside the JSON object.
+        The language of the explanation should match the language of the original prompt.
+        """
+    ),
+    "improve": textwrap.dedent(
+        """
+        You are an expert in prompt engineering.
+        Your task is to rewrite a prompt that will be used with a ChatGPT-style model into an
+        optimized version that:
+           - Defines a clear role for the model.
+           - Has a specific objective.
+           - Includes the necessary context.
+           - Specifies format, language and other relevant constraints.
+
+        ALWAYS return your answer as a valid JSON object with this exact structure:
+
+        {
+          "improved_prompt": "string"
+        }
+
+        Do NOT include anything outside the JSON object.
+        The optimized prompt should be in the language of the original prompt.
+        """
+    ),
+}
+
+
+def build_score_messages(user_prompt: str) -> list:
+    """
+    Build the chat messages that ask the scoring model to rate the prompt.
+    """
+    return [
+        {"role": "system", "content": SCORE_SYSTEM_MESSAGE},
+        {"role": "user", "content": EVALUATOR_USER_PREFIX + user_prompt},
+    ]
+
+
+def build_rewrite_messages(user_prompt: str, scored: dict) -> list:
+    """
+    Build the chat messages that ask the rewrite model to explain the scores
+    and improve the prompt.
+    """
+    return [
+        {"role": "system", "content": REWRITE_SYSTEM_MESSAGE},
+        {"role": "user", "content": EVALUATOR_USER_PREFIX + user_prompt + REWRITE_SCORES_PREFIX + json.dumps(scored)},
+    ]
+
+
+def build_section_messages(call: str, user_prompt: str) -> list:
+    """
+    Build the chat messages of one parallel sub-call ("scores", "diagnosis" or "improve").
+    """
+    return [
+        {"role": "system", "content": SECTION_SYSTEM_MESSAGES[call]},
+        {"role": "user", "content": EVALUATOR_USER_PREFIX + user_prompt},
+    ]
+
+
+EVALUATOR_MODES = ("single", "staged", "parallel")
+
+
+def evaluator_stages() -> dict:
+    """
+    The model calls of an evaluation for EVALUATOR_MODE, as call type ->
+    (model, system message): a single "evaluate" call, "score" then "rewrite",
+    or "scores", "diagnosis" and "improve" side by side.
+    """
+    if EVALUATOR_MODE == "single":
+        return {"evaluate": (LLM_MODEL, EVALUATOR_SYSTEM_MESSAGE)}
+    if EVALUATOR_MODE == "staged":
+        return {
+            "score": (LLM_MODEL_SCORE or LLM_MODEL, SCORE_SYSTEM_MESSAGE),
+            "rewrite": (LLM_MODEL_REWRITE, REWRITE_SYSTEM_MESSAGE),
+        }
+    if EVALUATOR_MODE == "parallel":
+        return {
+            "scores": (LLM_MODEL_SCORE or LLM_MODEL, SECTION_SYSTEM_MESSAGES["scores"]),
+            "diagnosis": (LLM_MODEL_REWRITE, SECTION_SYSTEM_MESSAGES["diagnosis"]),
+            "improve": (LLM_MODEL_REWRITE, SECTION_SYSTEM_MESSAGES["improve"]),
+        }
+    raise ValueError(f"Unknown EVALUATOR_MODE {EVALUATOR_MODE!r}; expected one of {', '.join(EVALUATOR_MODES)}")
+
+
+def stage_options(call: str, options: dict | None = None) -> dict:
+    """
+    Generation options of an evaluator stage. The caller's `options` apply to
+    the calls that write text; scoring always uses its own profile.
+    """
+    return generation_options(call, None if call in ("score", "scores") else options)
+
+
+class WarmModelManager:
+    """
+    Keeps an evaluator model loaded and its rubric prefix in Ollama's prompt cache.
+    There is one per evaluator stage (see evaluator_stages).
+
+    `preload` loads the model with OLLAMA_KEEP_ALIVE and runs the stage's fixed
+    prefix once, measuring how many tokens it has and how long each takes to
+    ingest. `record` then estimates, from the `prompt_eval_count` and
+    `prompt_eval_duration` of each evaluator response, the prompt-eval time the
+    cached prefix saved: when fewer tokens than the prefix were evaluated, the
+    prefix came from the cache.
+    """
+
+    def __init__(self, model: str = LLM_MODEL, system_message: str = EVALUATOR_SYSTEM_MESSAGE, call: str = "evaluate"):
+        self.model = model
+        self.system_message = system_message
+        self.call = call
+        self.loaded = False
+        self.prefix_tokens = None
+        self.ms_per_prompt_token = None
+        self.requests = 0
+        self.prefix_hits = 0
+        self.saved_ms_total = 0.0
+        self.last_saved_ms = 0.0
+        self._lock = threading.Lock()
+        self._preload_lock = threading.Lock()
+
+    def preload(self) -> bool:
+        """
+        Load the model and warm the evaluator prefix. Safe to call from several
+        threads: later callers wait for the first preload instead of repeating it.
+        """
+        with self._preload_lock:
+            if self.loaded:
+                return True
+            return self._preload()
+
+    def _preload(self) -> bool:
+        messages = [
+            {"role": "system", "content": self.system_message},
+            {"role": "user", "content": EVALUATOR_USER_PREFIX},
+        ]
+        try:
+            # Same options as evaluations (num_ctx above all), or the first one would reload the model
+            options = {**generation_options(self.call), "num_predict": 1}
+            result = ollama_chat_full(messages, model=self.model, options=options, call="preload")
+        except requests.exceptions.RequestException as e:
+            logger.warning("Could not preload %s: %s", self.model, e)
+            return False
+
+        with self._lock:
+            self.loaded = True
+            if result.prompt_eval_count:
+                self.prefix_tokens = result.prompt_eval_count
+                self.ms_per_prompt_token = result.prompt_eval_ms / result.prompt_eval_count
+        logger.info(
+            "Preloaded %s (load %.0f ms, evaluator prefix %s tokens)",
+            self.model, result.load_ms, self.prefix_tokens,
+        )
+        return True
+
+    def record(self, result: ChatResult) -> float:
+        """
+        Account for one evaluator response; returns the estimated prompt-eval ms saved.
+        """
+        evaluated = result.prompt_eval_count
+        with self._lock:
+            self.requests += 1
+            saved = 0.0
+            if self.prefix_tokens and evaluated < self.prefix_tokens:
+                self.prefix_hits += 1
+                saved = self.prefix_tokens * self.ms_per_prompt_token
+            self.saved_ms_total += saved
+            self.last_saved_ms = saved
+        logger.info(
+            "Evaluator prompt eval: %d tokens in %.0f ms, ~%.0f ms saved by the cached prefix",
+            evaluated, result.prompt_eval_ms, saved,
+        )
+        return saved
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "model": self.model,
+                "call": self.call,
+                "loaded": self.loaded,
+                "keep_alive": OLLAMA_KEEP_ALIVE,
+                "prefix_tokens": self.prefix_tokens,
+                "requests": self.requests,
+                "prefix_cache_hits": self.prefix_hits,
+                "last_saved_ms": round(self.last_saved_ms, 1),
+                "avg_saved_ms": round(self.saved_ms_total / self.requests, 1) if self.requests else 0.0,
+            }
+
+
+@functools.lru_cache(maxsize=None)
+def get_warm_managers() -> dict:
+    """
+    Process-wide warm-model managers, one per evaluator stage, plus one for the
+    "rewrite" call of evaluate_with_scores in the modes without that stage.
+    The first call starts preloading the models in the background when
+    OLLAMA_PRELOAD is on.
+    """
+    managers = {}
+    stages = evaluator_stages()
+    stages.setdefault("rewrite", (LLM_MODEL_REWRITE, REWRITE_SYSTEM_MESSAGE))
+    for call, (model, system_message) in stages.items():
+        manager = managers[call] = WarmModelManager(model, system_message, call)
+        if OLLAMA_PRELOAD:
+            threading.Thread(target=manager.preload, name=f"ollama-preload-{call}", daemon=True).start()
+    return managers
+
+
+def get_warm_manager(call: str | None = None) -> WarmModelManager:
+    """
+    The warm-model manager of an evaluator stage; by default of the last one,
+    which writes the evaluation.
+    """
+    return get_warm_managers()[call or list(evaluator_stages())[-1]]
+
+
+def evaluator_cache_key(
+    user_prompt: str, model: str = LLM_MODEL, options: dict | None = None, scored: dict | None = None
+) -> str:
+    """
+    Content-addressed cache key for an evaluation, under the effective
+    generation options (the "evaluate" profile with `options` applied).
+    The full system message is part of the key, so editing the rubric invalidates old entries.
+    In the staged and parallel modes, the key covers the model, messages and
+    options of every stage. With `scored` (see evaluate_with_scores), it
+    covers the rewrite stage and those scores.
+    """
+    if scored is not None:
+        return ResultCache.make_key(
+            "rewrite-scored", LLM_MODEL_REWRITE, REWRITE_SYSTEM_MESSAGE, stage_options("rewrite", options),
+            evaluator_format("rewrite"), scored, user_prompt,
+        )
+    if EVALUATOR_MODE == "single":
+        return ResultCache.make_key(
+            "evaluate", model, EVALUATOR_SYSTEM_MESSAGE, generation_options("evaluate", options),
+            evaluator_format(), user_prompt,
+        )
+    stages = [
+        (call, stage_model, system_message, stage_options(call, options), evaluator_format(call))
+        for call, (stage_model, system_message) in evaluator_stages().items()
+    ]
+    return ResultCache.make_key(f"evaluate-{EVALUATOR_MODE}", stages, user_prompt)
+
+
+def get_cached_evaluation(user_prompt: str, options: dict | None = None, scored: dict | None = None):
+    """
+    Return the cached evaluation for this prompt (and given scores), or None.
+    """
+    cache = get_eval_cache()
+    if cache is None:
+        return None
+    return cache.get(evaluator_cache_key(user_prompt, options=options, scored=scored))
+
+
+def store_evaluation(user_prompt: str, evaluation: dict, options: dict | None = None, scored: dict | None = None) -> None:
+    """
+    Save an evaluation in the cache, if caching is enabled.
+    """
+    cache = get_eval_cache()
+    if cache is not None:
+        cache.set(evaluator_cache_key(user_prompt, options=options, scored=scored), evaluation)
+
+
+def call_prompt_evaluator(user_prompt: str, options: dict | None = None) -> dict:
+    """
+    Ask Llama 3.3 (via Ollama) to evaluate and improve the prompt.
+    `options` override the "evaluate" generation profile.
+    Returns a dict with the defined structure.
+    """
+    evaluation, _ = call_prompt_evaluator_with_usage(user_prompt, options)
+    return evaluation
+
+
+def call_prompt_evaluator_with_usage(user_prompt: str, options: dict | None = None, scored: dict | None = None) -> tuple:
+    """
+    Same as call_prompt_evaluator, but also returns the token usage and timings:
+    (evaluation, {"prompt_tokens", "completion_tokens", "prompt_eval_saved_ms", "cached", "metrics", "stages"}),
+    where "metrics" are those of the call that wrote the evaluation and
+    "stages" those of every model call, by call type.
+    With `scored` ({"total_score", "scores"}, e.g. a local estimate), the
+    model only writes the diagnosis and the rewrite for those scores.
+    Concurrent calls for the same prompt share one generation; the callers
+    that waited on it get zero usage, like a cache hit.
+    """
+    cached = get_cached_evaluation(user_prompt, options, scored)
+    if cached is not None:
+        usage = {"prompt_tokens": 0, "completion_tokens": 0, "prompt_eval_saved_ms": 0.0, "cached": True, "metrics": None, "stages": {}}
+        return cached, usage
+
+    single_flight = get_single_flight()
+    if single_flight is None:
+        return _evaluate_uncached(user_prompt, options, scored)
+
+    (evaluation, usage), shared = single_flight.do(
+        evaluator_cache_key(user_prompt, options=options, scored=scored),
+        lambda: _evaluate_uncached(user_prompt, options, scored),
+        lookup=lambda: _cached_with_usage(user_prompt, options, scored),
+    )
+    if shared:
+        usage = {"prompt_tokens": 0, "completion_tokens": 0, "prompt_eval_saved_ms": 0.0, "cached": True, "metrics": None, "stages": {}}
+    return evaluation, usage
+
+
+def _cached_with_usage(user_prompt: str, options: dict | None, scored: dict | None = None):
+    cached = get_cached_evaluation(user_prompt, options, scored)
+    return None if cached is None else (cached, None)
+
+
+def evaluate_in_one_call(user_prompt: str, options: dict | None = None, model: str = LLM_MODEL) -> tuple:
+    """
+    Score, diagnose and rewrite the prompt with a single model call, bypassing the cache.
+    Returns (evaluation, [ChatResult], repair_usage).
+    """
+    result = ollama_chat_full(
+        build_evaluator_messages(user_prompt),
+        model=model,
+        options=generation_options("evaluate", options),
+        format=evaluator_format(),
+        call="evaluate",
+    )
+    evaluation, repair_usage = parse_evaluation_with_repair(result.content)
+    return evaluation, [result], repair_usage
+
+
+def evaluate_in_stages(
+    user_prompt: str,
+    options: dict | None = None,
+    score_model: str = LLM_MODEL_SCORE or LLM_MODEL,
+    rewrite_model: str = LLM_MODEL_REWRITE,
+) -> tuple:
+    """
+    Evaluate with two model calls, bypassing the cache: `score_model` rates the
+    prompt, then `rewrite_model` writes the diagnosis and the improved prompt
+    for those scores. Returns (evaluation, [ChatResult per stage], repair_usage).
+    """
+    score_result = ollama_chat_full(
+        build_score_messages(user_prompt),
+        model=score_model,
+        options=stage_options("score"),
+        format=evaluator_format("score"),
+        call="score",
+    )
+    scored, score_repairs = parse_stage_output(score_result.content, "score")
+    evaluation, (rewrite_result,), rewrite_repairs = evaluate_with_scores(user_prompt, scored, options, rewrite_model)
+    repair_usage = {key: score_repairs[key] + rewrite_repairs[key] for key in score_repairs}
+    return evaluation, [score_result, rewrite_result], repair_usage
+
+
+def evaluate_with_scores(
+    user_prompt: str, scored: dict, options: dict | None = None, rewrite_model: str = LLM_MODEL_REWRITE
+) -> tuple:
+    """
+    Diagnose and rewrite a prompt that already has its scores ({"total_score",
+    "scores"}), bypassing the cache: only the rewrite stage runs, and the
+    scores are kept as given. Returns (evaluation, [ChatResult], repair_usage).
+    """
+    rewrite_result = ollama_chat_full(
+        build_rewrite_messages(user_prompt, scored),
+        model=rewrite_model,
+        options=stage_options("rewrite", options),
+        format=evaluator_format("rewrite"),
+        call="rewrite",
+    )
+    rewritten, repair_usage = parse_stage_output(rewrite_result.content, "rewrite")
+    evaluation = asdict(Evaluation.from_dict({**scored, **rewritten}))
+    return evaluation, [rewrite_result], repair_usage
+
+
+def _run_section(call: str, model: str, user_prompt: str, options: dict | None) -> tuple:
+    result = ollama_chat_full(
+        build_section_messages(call, user_prompt),
+        model=model,
+        options=stage_options(call, options),
+        format=evaluator_format(call),
+        call=call,
+    )
+    fields, repair_usage = parse_stage_output(result.content, call)
+    return fields, result, repair_usage
+
+
+def iter_parallel_sections(
+    user_prompt: str,
+    options: dict | None = None,
+    score_model: str = LLM_MODEL_SCORE or LLM_MODEL,
+    rewrite_model: str = LLM_MODEL_REWRITE,
+):
+    """
+    Run the "scores", "diagnosis" and "improve" sub-calls concurrently and
+    yield (call, fields, ChatResult, repair_usage) for each as soon as it is
+    done. If one fails, the sub-calls that haven't started are cancelled.
+    """
+    models = {"scores": score_model, "diagnosis": rewrite_model, "improve": rewrite_model}
+    futures = {
+        submit_in_context(get_section_executor(), _run_section, call, model, user_prompt, options): call
+        for call, model in models.items()
+    }
+    try:
+        for future in as_completed(futures):
+            fields, result, repair_usage = future.result()
+            yield futures[future], fields, result, repair_usage
+    finally:
+        for future in futures:
+            future.cancel()
+
+
+def evaluate_in_parallel(
+    user_prompt: str,
+    options: dict | None = None,
+    score_model: str = LLM_MODEL_SCORE or LLM_MODEL,
+    rewrite_model: str = LLM_MODEL_REWRITE,
+) -> tuple:
+    """
+    Evaluate with concurrent sub-calls for the scores, the diagnosis and the
+    improved prompt, bypassing the cache; the evaluation takes as long as the
+    slowest of them. Returns (evaluation, [ChatResult per section], repair_usage).
+    """
+    merged = {}
+    results = []
+    repair_usage = {"prompt_tokens": 0, "completion_tokens": 0, "repairs": 0}
+    for _, fields, result, section_repairs in iter_parallel_sections(user_prompt, options, score_model, rewrite_model):
+        merged.update(fields)
+        results.append(result)
+        for key in repair_usage:
+            repair_usage[key] += section_repairs[key]
+    return asdict(Evaluation.from_dict(merged)), results, repair_usage
+
+
+EVALUATE_BY_MODE = {
+    "single": evaluate_in_one_call,
+    "staged": evaluate_in_stages,
+    "parallel": evaluate_in_parallel,
+}
+
+
+def _evaluate_uncached(user_prompt: str, options: dict | None, scored: dict | None = None) -> tuple:
+    # One budget for the evaluation (every stage, if split) and any repair call it needs
+    with deadline_scope(call_timeouts("evaluate").total):
+        if scored is not None:
+            evaluation, results, repair_usage = evaluate_with_scores(user_prompt, scored, options)
+        else:
+            evaluation, results, repair_usage = EVALUATE_BY_MODE[EVALUATOR_MODE](user_prompt, options)
+    saved_ms = sum(get_warm_manager(result.call).record(result) for result in results)
+    store_evaluation(user_prompt, evaluation, options, scored)
+
+    usage = {
+        "prompt_tokens": sum(result.prompt_eval_count for result in results) + repair_usage["prompt_tokens"],
+        "completion_tokens": sum(result.eval_count for result in results) + repair_usage["completion_tokens"],
+        "prompt_eval_saved_ms": round(saved_ms, 1),
+        "cached": False,
+        "metrics": results[-1].metrics(),
+        "stages": {result.call: result.metrics() for result in results},
+    }
+    return evaluation, usage
+
+
+def continue_json_object(chunks):
+    """
+    Yield a streamed JSON object without its opening brace, so that it
+    continues an object whose first fields were already sent.
+    """
+    opened = False
+    for chunk in chunks:
+        if not opened:
+            chunk = chunk.lstrip()
+            if not chunk:
+                continue
+            if chunk.startswith("{"):
+                chunk = chunk[1:]
+            opened = True
+        yield chunk
+
+
+def _stream_in_stages(user_prompt: str, options: dict | None, on_done):
+    """
+    Streaming evaluate_in_stages: the scores are sent as soon as the scoring
+    model is done, then the rewrite streams in as the rest of the same JSON object.
+    """
+    score_result = ollama_chat_full(
+        build_score_messages(user_prompt),
+        model=LLM_MODEL_SCORE or LLM_MODEL,
+        options=stage_options("score"),
+        format=evaluator_format("score"),
+        call="score",
+    )
+    on_done(score_result)
+    scored, _ = parse_stage_output(score_result.content, "score")
+    yield from _stream_with_scores(user_prompt, scored, options, on_done)
+
+
+def _stream_with_scores(user_prompt: str, scored: dict, options: dict | None, on_done):
+    """
+    Streaming evaluate_with_scores: the scores first, then the rewrite
+    streams in as the rest of the same JSON object.
+    """
+    yield json.dumps(scored, ensure_ascii=False)[:-1] + ", "
+    yield from continue_json_object(
+        ollama_chat_stream(
+            build_rewrite_messages(user_prompt, scored),
+            model=LLM_MODEL_REWRITE,
+            options=stage_options("rewrite", options),
+            format=evaluator_format("rewrite"),
+            on_done=on_done,
+            call="rewrite",
+        )
+    )
+
+
+def _stream_in_parallel(user_prompt: str, options: dict | None, on_done):
+    """
+    Streaming evaluate_in_parallel: each section is sent as soon as its
+    sub-call returns, as the next fields of one JSON object.
+    """
+    separator = "{"
+    for _, fields, result, _ in iter_parallel_sections(user_prompt, options):
+        on_done(result)
+        yield separator + json.dumps(fields, ensure_ascii=False)[1:-1]
+        separator = ", "
+    yield "}"
+
+
+def call_prompt_evaluator_stream(user_prompt: str, options: dict | None = None, on_done=None, scored: dict | None = None):
+    """
+    Streaming variant of call_prompt_evaluator: yields the raw JSON text chunk by chunk.
+    Parse the accumulated text with parse_evaluation_with_repair once the stream ends.
+    This bypasses the cache; check get_cached_evaluation first.
+    With `scored`, the scores come first and the model only writes the rest
+    (see evaluate_with_scores).
+    Concurrent streams for the same prompt share one generation, each reader
+    replaying it from the start.
+    `on_done` receives the ChatResult of each model call (one per stage in
+    the staged and parallel modes) once the stream completes.
+    """
+
+    def produce(finished):
+        def record(result: ChatResult):
+            get_warm_manager(result.call).record(result)
+            finished(result)
+
+        if scored is not None:
+            return _stream_with_scores(user_prompt, scored, options, record)
+        if EVALUATOR_MODE == "staged":
+            return _stream_in_stages(user_prompt, options, record)
+        if EVALUATOR_MODE == "parallel":
+            return _stream_in_parallel(user_prompt, options, record)
+        return ollama_chat_stream(
+            build_evaluator_messages(user_prompt),
+            options=generation_options("evaluate", options),
+            format=evaluator_format(),
+            on_done=record,
+            call="evaluate",
+        )
+
+    single_flight = get_single_flight()
+    if single_flight is None:
+        yield from produce(on_done or (lambda result: None))
+        return
+
+    stream = single_flight.stream(evaluator_cache_key(user_prompt, options=options, scored=scored), produce)
+    yield from stream
+    if on_done is not None:
+        for result in stream.results:
+            on_done(result)
+
+
+def call_prompt_evaluator_sections(user_prompt: str, options: dict | None = None, on_done=None):
+    """
+    Parallel-mode evaluation that yields ("scores" | "diagnosis" | "improve",
+    fields) as soon as each sub-call returns, then ("evaluation", evaluation)
+    with the merged and validated result, which is also cached.
+    This bypasses the cache lookup; check get_cached_evaluation first.
+    Concurrent calls for the same prompt share the sub-calls.
+    `on_done` receives the ChatResult of each sub-call once all are done.
+    """
+
+    def produce(finished):
+        merged = {}
+        for call, fields, result, _ in iter_parallel_sections(user_prompt, options):
+            get_warm_manager(call).record(result)
+            finished(result)
+            merged.update(fields)
+            yield call, fields
+        evaluation = asdict(Evaluation.from_dict(merged))
+        store_evaluation(user_prompt, evaluation, options)
+        yield "evaluation", evaluation
+
+    single_flight = get_single_flight()
+    if single_flight is None:
+        yield from produce(on_done or (lambda result: None))
+        return
+
+    key = "sections:" + evaluator_cache_key(user_prompt, options=options)
+    stream = single_flight.stream(key, produce)
+    yield from stream
+    if on_done is not None:
+        for result in stream.results:
+            on_done(result)
+
+
+def build_answer_messages(prompt: str) -> list:
+    """
+    Build the chat messages that ask the model for a normal answer to the prompt.
+    """
+    return [
+        {
+            "role": "system",
+            "content": "Answer the following prompt in a clear, useful and concise way.",
+        },
+        {"role": "user", "content": prompt},
+    ]
+
+
+def answer_options(force: bool = False, overrides: dict | None = None) -> dict:
+    """
+    Generation options for comparison answers: the "answer" profile with
+    `overrides` applied. A forced regeneration drops the fixed seed and
+    temperature to get a fresh sample.
+    """
+    options = generation_options("answer", overrides)
+    if force:
+        options.pop("seed", None)
+        options.pop("temperature", None)
+    return options
+
+
+def answer_cache_key(messages: list, options: dict | None) -> str:
+    """
+    Content-addressed cache key for a comparison answer.
+    """
+    return ResultCache.make_key("answer", LLM_MODEL, messages, options or {})
+
+
+def call_llm_answer(prompt: str, force: bool = False, options: dict | None = None) -> str:
+    """
+    Ask Llama 3.3 for a normal answer to the prompt.
+    Used to compare 'original vs optimized' behavior.
+    Answers are shared across sessions through the answer cache; `force` skips it.
+    `options` override the "answer" generation profile.
+    """
+    return call_llm_answer_result(prompt, force, options).content
+
+
+def call_llm_answer_result(prompt: str, force: bool = False, options: dict | None = None) -> ChatResult:
+    """
+    Same as call_llm_answer, but returns the ChatResult with timings.
+    A cached answer comes back with `cached=True` and zero timings.
+    """
+    messages = build_answer_messages(prompt)
+    options = answer_options(force, options)
+    cache = None if force else get_answer_cache()
+
+    if cache is not None:
+        cached = cache.get(answer_cache_key(messages, options))
+        if cached is not None:
+            return ChatResult(content=cached, model=LLM_MODEL, call="answer", cached=True)
+
+    result = ollama_chat_full(messages, options=options, call="answer")
+
+    if cache is not None:
+        cache.set(answer_cache_key(messages, options), result.content)
+    return result
+
+
+def call_llm_answer_stream(prompt: str, force: bool = False, on_done=None, options: dict | None = None):
+    """
+    Streaming variant of call_llm_answer: yields the answer chunk by chunk.
+    A cached answer is yielded in one piece.
+    `on_done` receives the ChatResult once the answer is complete.
+    """
+    messages = build_answer_messages(prompt)
+    options = answer_options(force, options)
+    cache = None if force else get_answer_cache()
+
+    if cache is not None:
+        cached = cache.get(answer_cache_key(messages, options))
+        if cached is not None:
+            yield cached
+            if on_done is not None:
+                on_done(ChatResult(content=cached, model=LLM_MODEL, call="answer", cached=True))
+            return
+
+    answer = ""
+    for chunk in ollama_chat_stream(messages, options=options, on_done=on_done, call="answer"):
+        answer += chunk
+        yield chunk
+
+    if cache is not None:
+        cache.set(answer_cache_key(messages, options), answer)
+
+
+def generate_answers_parallel(prompts: dict, force: bool = False, options: dict | None = None) -> dict:
+    """
+    Generate an answer for each prompt in one backend batch (cached answers
+    are served from the cache). Returns {key: (ChatResult, error)} so a
+    failure on one prompt doesn't hide the answers of the others.
+    Each answer waits for its own scheduler slot, in the session's fair queue.
+    """
+    options = answer_options(force, options)
+    cache = None if force else get_answer_cache()
+
+    results = {}
+    pending = {}
+    for key, prompt in prompts.items():
+        messages = build_answer_messages(prompt)
+        cached = cache.get(answer_cache_key(messages, options)) if cache is not None else None
+        if cached is not None:
+            results[key] = (ChatResult(content=cached, model=LLM_MODEL, call="answer", cached=True), None)
+        else:
+            pending[key] = messages
+
+    outcomes = ollama_chat_batch(list(pending.values()), options=options, call="answer")
+    for (key, messages), outcome in zip(pending.items(), outcomes):
+        if isinstance(outcome, Exception):
+            results[key] = (None, outcome)
+            continue
+        if cache is not None:
+            cache.set(answer_cache_key(messages, options), outcome.content)
+        results[key] = (outcome, None)
+
+    return {key: results[key] for key in prompts}
+
+
+def stream_answers_parallel(prompts: dict, force: bool = False, options: dict | None = None):
+    """
+    Stream the answers for several prompts concurrently, each waiting for
+    its own scheduler slot. Yields (key, kind, value) events in arrival order, where kind is
+    "chunk" (value is new text), "done" (value is the ChatResult) or "error" (value is the exception).
+    """
+    events = queue.Queue()
+
+    def pump(key, prompt):
+        finished = []
+        try:
+            for chunk in call_llm_answer_stream(prompt, force, on_done=finished.append, options=options):
+                events.put((key, "chunk", chunk))
+            events.put((key, "done", finished[0] if finished else None))
+        except Exception as e:
+            events.put((key, "error", e))
+
+    executor = get_pump_executor()
+    for key, prompt in prompts.items():
+        submit_in_context(executor, pump, key, prompt)
+
+    pending = len(prompts)
+    while pending:
+        event = events.get()
+        if event[1] != "chunk":
+            pending -= 1
+        yield event
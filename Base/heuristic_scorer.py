@@ -0,0 +1,247 @@
+# heuristic_scorer.py
+#
+# A fast, deterministic estimate of the evaluator's rubric (persona, task,
+# context, constraints, clarity) from surface features of the prompt: role
+# phrases, instruction verbs, length, background and format keywords.
+#
+# It runs in well under a millisecond, so the app can show a score while the
+# user types. The patterns are English: for prompts in other languages (too
+# few common English words) the estimate is marked as not confident, and the
+# model does the scoring. For confident estimates, the model is only asked for
+# the diagnosis and the rewrite (see scores_for_model); prompts can also skip
+# the model call altogether below PRESCORE_LLM_MIN_SCORE (off by default).
+
+import os
+import re
+
+from evaluator import SCORE_KEYS, SCORE_MAX
+
+# Prompts whose confident estimate is below this don't get a model evaluation
+# unless the user asks for one (0 = always call the model)
+PRESCORE_LLM_MIN_SCORE = int(os.getenv("PRESCORE_LLM_MIN_SCORE", "0"))
+PRESCORE_SCORES = os.getenv("PRESCORE_SCORES", "true").lower() == "true"   # the model rewrites for confident estimates
+PRESCORE_MIN_ENGLISH = float(os.getenv("PRESCORE_MIN_ENGLISH", "0.2"))      # share of common English words to be confident
+PRESCORE_MIN_WORDS = 4     # shorter prompts say too little to tell their language
+
+# Function words nearly every English prompt uses, whatever its topic
+ENGLISH_WORDS = frozenset(
+    "a about an and are as at be by can do for from have how i in is it me my no not of on or our "
+    "please should that the this to us was we what when which who why will with you your".split()
+)
+WORD_PATTERN = re.compile(r"[^\W\d_]+(?:'[^\W\d_]+)?")
+
+ROLE_PATTERN = re.compile(
+    r"\b(you are|you're|act as|acting as|imagine you are|pretend (?:to be|you are)|"
+    r"take (?:on )?the role|your role is|as an? (?:expert|experienced|senior|professional))\b",
+    re.IGNORECASE,
+)
+ROLE_NOUN_PATTERN = re.compile(
+    r"\b(expert|specialist|teacher|tutor|professor|coach|mentor|assistant|engineer|developer|"
+    r"analyst|scientist|writer|editor|copywriter|journalist|consultant|advisor|manager|"
+    r"designer|marketer|lawyer|doctor|translator|researcher|reviewer)\b",
+    re.IGNORECASE,
+)
+AUDIENCE_PATTERN = re.compile(
+    r"\b(audience|readers?|students?|beginners?|customers?|clients?|executives?|children|kids|"
+    r"non-technical|\d+-year-old)\b",
+    re.IGNORECASE,
+)
+TASK_VERBS = (
+    "analyze|analyse|answer|build|calculate|categorize|check|classify|compare|compose|convert|"
+    "create|critique|define|describe|design|develop|draft|edit|evaluate|explain|extract|find|"
+    "generate|give|identify|implement|improve|list|outline|plan|prepare|propose|provide|recommend|"
+    "review|rewrite|suggest|summarize|summarise|tell|translate|write"
+)
+TASK_VERB_PATTERN = re.compile(rf"\b({TASK_VERBS})\b", re.IGNORECASE)
+QUESTION_PATTERN = re.compile(r"^\s*(what|how|why|when|where|which|who|can|could|should|is|are|do|does)\b", re.IGNORECASE)
+DELIVERABLE_PATTERN = re.compile(
+    r"\b(summary|list|plan|email|letter|essay|article|post|report|table|outline|description|"
+    r"script|code|function|query|steps|guide|tutorial|proposal|review|story|poem|slogan|answer|"
+    r"explanation|example|examples|checklist|agenda|presentation)\b",
+    re.IGNORECASE,
+)
+CONTEXT_PATTERN = re.compile(
+    r"\b(because|context|background|the goal|my goal|so that|in order to|i am|i'm|we are|we're|"
+    r"my|our|currently|project|company|team|given|based on|for example|e\.g\.|such as)\b",
+    re.IGNORECASE,
+)
+DELIMITER_PATTERN = re.compile(r'("""|```|---|<\w+>|:\s*\n)')
+FORMAT_PATTERN = re.compile(
+    r"\b(bullet|bullets|bullet points|numbered|list|table|json|markdown|csv|yaml|paragraphs?|"
+    r"headings?|sections?|steps|format|code block)\b",
+    re.IGNORECASE,
+)
+LENGTH_PATTERN = re.compile(
+    r"(\b\d+\s*(?:\w+\s+)?(words|sentences|paragraphs|bullets|points|items|steps|lines|characters|pages)\b|"
+    r"\b(no more than|at most|at least|under \d+|maximum|minimum|brief|concise|short)\b)",
+    re.IGNORECASE,
+)
+STYLE_PATTERN = re.compile(
+    r"\b(tone|style|formal|informal|friendly|professional|simple language|avoid|do not|don't|"
+    r"must|only|without|never|always)\b",
+    re.IGNORECASE,
+)
+VAGUE_PATTERN = re.compile(r"\b(something|stuff|things?|etc|whatever|somehow|maybe|kind of|sort of)\b", re.IGNORECASE)
+SENTENCE_SPLIT = re.compile(r"(?<=[.!?])\s+|\n+")
+LIST_ITEM_PATTERN = re.compile(r"^\s*(?:[-*•]|\d+[.)])\s+", re.MULTILINE)
+
+TIPS = {
+    "persona": "Tell the model who to be, e.g. “You are an experienced data science teacher.”",
+    "task": "Start with a clear instruction verb and name the deliverable (a summary, a list, an email...).",
+    "context": "Add background: who the answer is for, why you need it and what the model should know.",
+    "constraints": "Specify the format and length, e.g. “in 5 bullet points of at most 20 words each”.",
+    "clarity": "Replace vague words (something, stuff, etc.) and split long requests into numbered steps.",
+}
+
+
+def _persona(text: str) -> tuple:
+    role = ROLE_PATTERN.search(text)
+    score = 0
+    notes = []
+    if role:
+        score += 15
+        notes.append(f"Role found (“{role.group(0)}”).")
+        if ROLE_NOUN_PATTERN.search(text):
+            score += 5
+    else:
+        notes.append("No role is given to the model.")
+    if AUDIENCE_PATTERN.search(text):
+        score += 5
+        notes.append("The audience is mentioned.")
+    return score, " ".join(notes)
+
+
+def _task(text: str, words: list) -> tuple:
+    verbs = TASK_VERB_PATTERN.findall(text)
+    score = 0
+    if verbs:
+        score += 12
+        note = f"Instruction found (“{verbs[0].lower()}”)."
+    elif QUESTION_PATTERN.search(text) or "?" in text:
+        score += 8
+        note = "The task is phrased as a question, without an explicit instruction."
+    else:
+        note = "No clear instruction verb."
+    if len(words) >= 5:
+        score += 5
+    if DELIVERABLE_PATTERN.search(text):
+        score += 5
+    else:
+        note += " The expected deliverable is not named."
+    if len(set(v.lower() for v in verbs)) > 1 or LIST_ITEM_PATTERN.search(text):
+        score += 3
+    return score, note
+
+
+def _context(text: str, words: list) -> tuple:
+    count = len(words)
+    score = 0 if count < 8 else 4 if count < 20 else 8 if count < 50 else 12
+    markers = len(CONTEXT_PATTERN.findall(text))
+    score += min(2 * markers, 8)
+    if DELIMITER_PATTERN.search(text):
+        score += 4
+    if score >= 12:
+        note = "The prompt gives the model some background."
+    elif score:
+        note = "Little background: the model has to guess the situation and purpose."
+    else:
+        note = "No background or purpose is given."
+    return score, note
+
+
+def _constraints(text: str) -> tuple:
+    found = []
+    if FORMAT_PATTERN.search(text):
+        found.append("format")
+    if LENGTH_PATTERN.search(text):
+        found.append("length")
+    if STYLE_PATTERN.search(text):
+        found.append("style or rules")
+    note = f"Constraints on {', '.join(found)}." if found else "No format, length or style constraints."
+    return 5 * len(found), note
+
+
+def _clarity(text: str, words: list) -> tuple:
+    sentences = [s for s in SENTENCE_SPLIT.split(text.strip()) if s.strip()]
+    score = 6 if len(words) >= 4 else 2
+    average = len(words) / max(len(sentences), 1)
+    if 6 <= average <= 30:
+        score += 3
+    if len(words) <= 40 and len(sentences) <= 3:
+        score += 3   # short and to the point
+    elif LIST_ITEM_PATTERN.search(text) or text.count("\n") >= 2:
+        score += 3   # long, but structured
+    vague = VAGUE_PATTERN.findall(text)
+    score -= 2 * len(vague)
+    if len(words) < 4:
+        note = "Too short to say what is wanted."
+    elif vague:
+        note = f"Vague wording: {', '.join(sorted(set(v.lower() for v in vague)))}."
+    elif average > 30:
+        note = "Very long sentences; consider splitting the request."
+    else:
+        note = "Readable wording."
+    return score, note
+
+
+def english_share(text: str) -> float:
+    """
+    Share of the words of `text` that are common English function words
+    (0 for text without words).
+    """
+    words = WORD_PATTERN.findall(text.lower())
+    return sum(word in ENGLISH_WORDS for word in words) / len(words) if words else 0.0
+
+
+def prescore_prompt(prompt: str) -> dict:
+    """
+    Estimate the rubric scores of `prompt` locally. Returns a dict shaped like
+    an evaluation (without an improved prompt), with "source": "heuristic"
+    and "confident": whether the prompt is English enough for the patterns
+    to mean something.
+    """
+    text = prompt.strip()
+    words = text.split()
+    results = {
+        "persona": _persona(text),
+        "task": _task(text, words),
+        "context": _context(text, words),
+        "constraints": _constraints(text),
+        "clarity": _clarity(text, words),
+    }
+    scores = {key: min(max(results[key][0], 0), SCORE_MAX[key]) for key in SCORE_KEYS}
+    total = min(max(sum(scores.values()), 1), 100)
+    return {
+        "total_score": total,
+        "scores": scores,
+        "diagnosis": {key: results[key][1] for key in SCORE_KEYS},
+        "improvements": [TIPS[key] for key in SCORE_KEYS if scores[key] < SCORE_MAX[key] / 2],
+        "improved_prompt": "",
+        "short_explanation": (
+            f"Quick local estimate ({total}/100) from the prompt's wording; the model was not called. "
+            "Fix the basics below first, or ask the model for a full diagnosis and a rewrite."
+        ),
+        "source": "heuristic",
+        "confident": len(words) >= PRESCORE_MIN_WORDS and english_share(text) >= PRESCORE_MIN_ENGLISH,
+    }
+
+
+def worth_model_call(prescore: dict) -> bool:
+    """
+    Whether a prompt is good enough for a full model evaluation to be worth
+    its cost, judging by its prescore_prompt estimate. An estimate that is not
+    confident says nothing either way, so the model is called.
+    """
+    return not prescore["confident"] or prescore["total_score"] >= PRESCORE_LLM_MIN_SCORE
+
+
+def scores_for_model(prescore: dict) -> dict | None:
+    """
+    The scores to hand the evaluator (its `scored` argument) so the model
+    only writes the diagnosis and the rewrite, or None when the model should
+    score the prompt itself (PRESCORE_SCORES off, or an estimate that is not
+    confident).
+    """
+    if not PRESCORE_SCORES or not prescore["confident"]:
+        return None
+    return {"total_score": prescore["total_score"], "scores": prescore["scores"]}
@@ -0,0 +1,184 @@
+# jobs.py
+#
+# Background jobs for the Streamlit app. Evaluations and answer comparisons
+# run on a worker pool instead of inside the script run, so a rerun (any
+# widget interaction) never waits on the model: the page keeps a job id in
+# st.session_state and polls the job for progress and its result.
+#
+# Jobs run in a copy of the submitter's context (its session, for the fair
+# scheduler) with current_job set, so the generations they start can be
+# cancelled per job as well as per session.
+
+import contextvars
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+
+logger = logging.getLogger(__name__)
+
+current_job = contextvars.ContextVar("llm_job", default=None)
+
+JOB_STATES = ("queued", "running", "done", "failed", "cancelled")
+
+
+class JobCancelledError(RuntimeError):
+    """
+    The job was cancelled while it was running.
+    """
+
+
+@dataclass
+class Job:
+    """
+    One unit of background work, as the page sees it. The worker publishes
+    `progress` (replaced as a whole, so readers never see half an update)
+    and finally `result` or `error`.
+    """
+
+    id: str
+    kind: str
+    label: str
+    session: str
+    state: str = "queued"
+    progress: dict = field(default_factory=dict)
+    result: object = None
+    error: Exception | None = None
+    created: float = field(default_factory=time.time)
+    started: float | None = None
+    finished: float | None = None
+    cancel_requested: threading.Event = field(default_factory=threading.Event, repr=False)
+
+    @property
+    def done(self) -> bool:
+        return self.state in ("done", "failed", "cancelled")
+
+    @property
+    def elapsed_s(self) -> float:
+        if self.started is None:
+            return 0.0
+        return (self.finished or time.time()) - self.started
+
+    def update(self, **progress) -> None:
+        """
+        Publish progress; raises JobCancelledError once the job was cancelled,
+        so job functions stop at their next update.
+        """
+        self.check_cancelled()
+        self.progress = {**self.progress, **progress}
+
+    def check_cancelled(self) -> None:
+        if self.cancel_requested.is_set():
+            raise JobCancelledError("The job was cancelled.")
+
+
+class JobRunner:
+    """
+    A worker pool running job functions `fn(job, *args, **kwargs)`, with the
+    jobs kept per session for `ttl_s` after they finish.
+
+    `cancel_generations(job_id)` is called when a job is cancelled, to abort
+    the model calls it has in flight.
+    """
+
+    def __init__(self, max_workers: int, ttl_s: float = 3600.0, cancel_generations=None):
+        self.ttl_s = ttl_s
+        self._cancel_generations = cancel_generations
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self._max_workers = max_workers
+        self._jobs = {}
+        self._futures = {}
+        self._lock = threading.Lock()
+
+    def submit(self, session: str, kind: str, label: str, fn, /, *args, **kwargs) -> Job:
+        job = Job(id=uuid.uuid4().hex[:12], kind=kind, label=label, session=session)
+        context = contextvars.copy_context()
+
+        def run():
+            current_job.set(job.id)
+            try:
+                if job.cancel_requested.is_set():
+                    job.state = "cancelled"
+                    return
+                job.state = "running"
+                job.started = time.time()
+                job.result = fn(job, *args, **kwargs)
+                # A call that couldn't be interrupted may finish after all; it was still cancelled
+                job.state = "cancelled" if job.cancel_requested.is_set() else "done"
+            except Exception as e:
+                job.error = e
+                job.state = "cancelled" if job.cancel_requested.is_set() else "failed"
+                if job.state == "failed":
+                    logger.warning("Job %s (%s) failed: %s", job.id, kind, e)
+            finally:
+                job.finished = time.time()
+                with self._lock:
+                    self._futures.pop(job.id, None)
+
+        with self._lock:
+            self._prune()
+            self._jobs[job.id] = job
+            self._futures[job.id] = self._executor.submit(context.run, run)
+        return job
+
+    def get(self, job_id: str | None) -> Job | None:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def jobs(self, session: str) -> list:
+        """
+        The session's jobs, oldest first.
+        """
+        with self._lock:
+            return [job for job in self._jobs.values() if job.session == session]
+
+    def cancel(self, job_id: str) -> bool:
+        """
+        Cancel a queued or running job; returns whether there was one to cancel.
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            future = self._futures.get(job_id)
+        if job is None or job.done:
+            return False
+        job.cancel_requested.set()
+        if future is not None and future.cancel():
+            # Never started
+            job.state = "cancelled"
+            job.finished = time.time()
+            with self._lock:
+                self._futures.pop(job_id, None)
+        elif self._cancel_generations is not None:
+            self._cancel_generations(job_id)
+        return True
+
+    def cancel_session(self, session: str) -> int:
+        """
+        Cancel all of a session's unfinished jobs; returns how many.
+        """
+        return sum(self.cancel(job.id) for job in self.jobs(session) if not job.done)
+
+    def forget(self, job_id: str) -> None:
+        """
+        Drop a finished job.
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None and job.done:
+                del self._jobs[job_id]
+
+    def _prune(self) -> None:
+        now = time.time()
+        for job_id, job in list(self._jobs.items()):
+            if job.done and job.finished is not None and now - job.finished > self.ttl_s:
+                del self._jobs[job_id]
+
+    def stats(self) -> dict:
+        with self._lock:
+            states = [job.state for job in self._jobs.values()]
+        return {
+            "workers": self._max_workers,
+            **{state: states.count(state) for state in JOB_STATES},
+        }
@@ -0,0 +1,73 @@
+# metrics.py
+#
+# Prometheus metrics for Ollama calls. The Streamlit process exports them on
+# METRICS_PORT; the headless API serves them on its own /metrics route.
+
+import functools
+import logging
+import os
+
+from prometheus_client import Counter, Histogram, start_http_server
+
+logger = logging.getLogger(__name__)
+
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9101"))   # 0 disables the exporter
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 20, 30, 60, 120, 180, 300)
+RATE_BUCKETS = (1, 2, 5, 10, 15, 20, 30, 50, 75, 100, 150, 250)
+
+LABELS = ("call", "model")
+
+REQUEST_SECONDS = Histogram(
+    "ollama_request_seconds", "Wall-clock time of Ollama chat calls", LABELS, buckets=LATENCY_BUCKETS
+)
+LOAD_SECONDS = Histogram(
+    "ollama_load_seconds", "Time Ollama spent loading the model", LABELS, buckets=LATENCY_BUCKETS
+)
+PROMPT_EVAL_SECONDS = Histogram(
+    "ollama_prompt_eval_seconds", "Time Ollama spent ingesting the prompt", LABELS, buckets=LATENCY_BUCKETS
+)
+EVAL_SECONDS = Histogram(
+    "ollama_eval_seconds", "Time Ollama spent generating tokens", LABELS, buckets=LATENCY_BUCKETS
+)
+TIME_TO_FIRST_TOKEN_SECONDS = Histogram(
+    "ollama_time_to_first_token_seconds", "Time until the first generated token", LABELS, buckets=LATENCY_BUCKETS
+)
+GENERATION_TOKENS_PER_SECOND = Histogram(
+    "ollama_generation_tokens_per_second", "Generation speed", LABELS, buckets=RATE_BUCKETS
+)
+PROMPT_TOKENS = Counter("ollama_prompt_tokens_total", "Prompt tokens evaluated by Ollama", LABELS)
+COMPLETION_TOKENS = Counter("ollama_completion_tokens_total", "Tokens generated by Ollama", LABELS)
+
+
+def observe_chat(result) -> None:
+    """
+    Record the timings and token counts of one ChatResult.
+    """
+    labels = (result.call, result.model)
+    REQUEST_SECONDS.labels(*labels).observe(result.wall_ms / 1000)
+    LOAD_SECONDS.labels(*labels).observe(result.load_ms / 1000)
+    PROMPT_EVAL_SECONDS.labels(*labels).observe(result.prompt_eval_ms / 1000)
+    EVAL_SECONDS.labels(*labels).observe(result.eval_ms / 1000)
+    TIME_TO_FIRST_TOKEN_SECONDS.labels(*labels).observe(result.ttft_ms / 1000)
+    if result.eval_ms:
+        GENERATION_TOKENS_PER_SECOND.labels(*labels).observe(result.tokens_per_s)
+    PROMPT_TOKENS.labels(*labels).inc(result.prompt_eval_count)
+    COMPLETION_TOKENS.labels(*labels).inc(result.eval_count)
+
+
+@functools.lru_cache(maxsize=None)
+def start_metrics_server() -> bool:
+    """
+    Start the Prometheus exporter once per process. Returns False when
+    disabled or when the port is already taken (e.g. by another worker).
+    """
+    if not METRICS_PORT:
+        return False
+    try:
+        start_http_server(METRICS_PORT)
+    except OSError as e:
+        logger.warning("Could not start the metrics exporter on port %d: %s", METRICS_PORT, e)
+        return False
+    logger.info("Prometheus metrics exported on port %d", METRICS_PORT)
+    return True
@@ -0,0 +1,178 @@
+# ollama_router.py
+#
+# Routes LLM calls across several hosts (OLLAMA_BASE_URLS, or OPENAI_BASE_URLS
+# for OpenAI-compatible servers).
+#
+# - Least outstanding requests, weighted by each host's recent latency.
+# - Sticky per model: hosts that already have the model loaded are preferred
+#   until they are all saturated, so weights aren't loaded on every box.
+# - Hosts that keep failing are ejected for a cooldown; a background health
+#   check brings them back and refreshes which models each host has loaded.
+
+import hashlib
+import logging
+import threading
+import time
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+
+class Backend:
+    """
+    One Ollama host and its routing state.
+    """
+
+    def __init__(self, url: str):
+        self.url = url
+        self.outstanding = 0
+        self.latency_ms = None          # exponentially weighted moving average
+        self.consecutive_failures = 0
+        self.ejected_until = 0.0
+        self.models = set()             # models known to be loaded on this host
+        self.requests = 0
+        self.failures = 0
+
+    def is_ejected(self, now: float) -> bool:
+        return now < self.ejected_until
+
+    def has_model(self, model: str) -> bool:
+        # Ollama reports "llama3.3:latest" for a model requested as "llama3.3"
+        return model in self.models or (":" not in model and f"{model}:latest" in self.models)
+
+    def expected_wait(self) -> float:
+        return (self.outstanding + 1) * (self.latency_ms or 1.0)
+
+    def stats(self, now: float) -> dict:
+        return {
+            "outstanding": self.outstanding,
+            "latency_ms": round(self.latency_ms, 1) if self.latency_ms is not None else None,
+            "ejected": self.is_ejected(now),
+            "consecutive_failures": self.consecutive_failures,
+            "requests": self.requests,
+            "failures": self.failures,
+            "models": sorted(self.models),
+        }
+
+
+class OllamaRouter:
+    """
+    Picks a backend for each call. Callers must pair every `acquire` with a `release`.
+    """
+
+    def __init__(
+        self,
+        urls: list,
+        session: requests.Session | None = None,
+        saturation: int = 2,
+        eject_after: int = 3,
+        eject_seconds: float = 30.0,
+        health_interval: float = 10.0,
+        latency_alpha: float = 0.2,
+        health_path: str = "/api/ps",
+    ):
+        if not urls:
+            raise ValueError("At least one Ollama URL is required")
+        self.backends = [Backend(url.rstrip("/")) for url in urls]
+        self.session = session or requests.Session()
+        self.saturation = saturation            # outstanding requests at which a sticky host spills over
+        self.eject_after = eject_after
+        self.eject_seconds = eject_seconds
+        self.health_interval = health_interval
+        self.latency_alpha = latency_alpha
+        self.health_path = health_path          # /api/ps for Ollama, /v1/models for OpenAI-compatible servers
+        self._lock = threading.Lock()
+        self._health_thread = None
+
+    @staticmethod
+    def _affinity(model: str, backend: Backend) -> int:
+        # Rendezvous hash: every process ranks hosts the same way for a model
+        digest = hashlib.sha256(f"{model}|{backend.url}".encode("utf-8")).digest()
+        return int.from_bytes(digest[:8], "big")
+
+    def acquire(self, model: str) -> Backend:
+        now = time.time()
+        with self._lock:
+            candidates = [b for b in self.backends if not b.is_ejected(now)] or self.backends
+
+            # Stay on hosts that already have the model loaded unless they are all busy
+            warm = [b for b in candidates if b.has_model(model) and b.outstanding < self.saturation]
+            pool = warm or candidates
+
+            backend = min(pool, key=lambda b: (b.expected_wait(), -self._affinity(model, b)))
+            backend.outstanding += 1
+            backend.requests += 1
+            return backend
+
+    def release(self, backend: Backend, model: str, ok: bool, elapsed_ms: float | None = None) -> None:
+        with self._lock:
+            backend.outstanding -= 1
+            if ok:
+                backend.consecutive_failures = 0
+                backend.models.add(model)
+                if elapsed_ms is not None:
+                    if backend.latency_ms is None:
+                        backend.latency_ms = elapsed_ms
+                    else:
+                        backend.latency_ms += self.latency_alpha * (elapsed_ms - backend.latency_ms)
+                return
+
+            backend.failures += 1
+            backend.consecutive_failures += 1
+            if backend.consecutive_failures >= self.eject_after and len(self.backends) > 1:
+                backend.ejected_until = time.time() + self.eject_seconds
+                logger.warning(
+                    "Ejecting Ollama host %s for %.0fs after %d consecutive failures",
+                    backend.url, self.eject_seconds, backend.consecutive_failures,
+                )
+
+    # ---------------------------
+    # Health checks
+    # ---------------------------
+
+    def check_health(self) -> None:
+        """
+        Probe every host once: reinstate ejected hosts that answer again and
+        refresh the set of models each host has loaded.
+        """
+        for backend in self.backends:
+            try:
+                resp = self.session.get(backend.url + self.health_path, timeout=5)
+                resp.raise_for_status()
+                body = resp.json()
+                loaded = {m.get("name") or m.get("model") for m in body.get("models", [])}
+                loaded |= {m.get("id") for m in body.get("data", [])}
+            except (requests.exceptions.RequestException, ValueError) as e:
+                with self._lock:
+                    was_ejected = backend.is_ejected(time.time())
+                    backend.consecutive_failures = max(backend.consecutive_failures, self.eject_after)
+                    if len(self.backends) > 1:
+                        backend.ejected_until = time.time() + self.eject_seconds
+                if not was_ejected:
+                    logger.warning("Health check failed for %s: %s", backend.url, e)
+                continue
+
+            with self._lock:
+                if backend.is_ejected(time.time()) or backend.consecutive_failures:
+                    logger.info("Ollama host %s is healthy again", backend.url)
+                backend.ejected_until = 0.0
+                backend.consecutive_failures = 0
+                backend.models = {name for name in loaded if name}
+
+    def start_health_checks(self) -> None:
+        if self._health_thread is not None:
+            return
+
+        def loop():
+            while True:
+                self.check_health()
+                time.sleep(self.health_interval)
+
+        self._health_thread = threading.Thread(target=loop, name="ollama-health", daemon=True)
+        self._health_thread.start()
+
+    def stats(self) -> dict:
+        now = time.time()
+        with self._lock:
+            return {b.url: b.stats(now) for b in self.backends}
@@ -0,0 +1,170 @@
+# optimizer.py
+#
+# Automatic prompt optimization: evaluate a prompt, evaluate the improved
+# prompt the evaluator proposed, and so on, keeping the best-scoring version.
+# The loop stops when the score stops rising, reaches a target, or a token or
+# time budget runs out.
+#
+# Every round is a regular evaluation, so it lands in the evaluation cache:
+# re-running an optimization (or evaluating one of its prompts by hand) is
+# served from the cache. A round's evaluation already contains the next
+# candidate, so each round costs exactly one evaluation.
+
+import contextlib
+import os
+import time
+from dataclasses import dataclass
+
+import requests
+
+from evaluator import call_prompt_evaluator_with_usage
+from scheduler import RequestShedError
+from timeouts import DeadlineExceededError, current_deadline, deadline_scope, remaining
+
+OPTIMIZE_TARGET = int(os.getenv("OPTIMIZE_TARGET", "90"))                 # stop once a prompt scores this much
+OPTIMIZE_MAX_ROUNDS = int(os.getenv("OPTIMIZE_MAX_ROUNDS", "5"))          # rewrites evaluated after the original
+OPTIMIZE_PATIENCE = int(os.getenv("OPTIMIZE_PATIENCE", "1"))              # rounds without a gain before stopping
+OPTIMIZE_MIN_GAIN = int(os.getenv("OPTIMIZE_MIN_GAIN", "1"))              # points that count as a gain
+OPTIMIZE_TOKEN_BUDGET = int(os.getenv("OPTIMIZE_TOKEN_BUDGET", "30000"))  # prompt + completion tokens (0 = no limit)
+OPTIMIZE_TIME_BUDGET = float(os.getenv("OPTIMIZE_TIME_BUDGET", "600"))    # seconds (0 = no limit)
+
+STOP_REASONS = {
+    "target": "reached the target score",
+    "plateau": "the score stopped rising",
+    "max_rounds": "reached the maximum number of rounds",
+    "tokens": "ran out of its token budget",
+    "time": "ran out of its time budget",
+    "no_rewrite": "the evaluator proposed no new prompt",
+}
+
+
+@dataclass(frozen=True)
+class OptimizeSettings:
+    target: int = OPTIMIZE_TARGET
+    max_rounds: int = OPTIMIZE_MAX_ROUNDS
+    patience: int = OPTIMIZE_PATIENCE
+    min_gain: int = OPTIMIZE_MIN_GAIN
+    token_budget: int = OPTIMIZE_TOKEN_BUDGET
+    time_budget_s: float = OPTIMIZE_TIME_BUDGET
+
+
+def out_of_budget(error: Exception, budget: float | None) -> bool:
+    """
+    Whether a failed round failed because the loop's time budget (the
+    deadline `budget`) ran out: the call timed out once it had, its
+    deadline was the budget, or it was shed because its wait alone would
+    have outlasted the budget.
+    """
+    if budget is None:
+        return False
+    if isinstance(error, RequestShedError):
+        return error.eta_s >= remaining(budget)
+    if isinstance(error, DeadlineExceededError) and error.deadline is not None:
+        return error.deadline >= budget
+    return remaining(budget) <= 0
+
+
+def optimize_prompt(
+    prompt: str,
+    options: dict | None = None,
+    settings: OptimizeSettings = OptimizeSettings(),
+    start_evaluation: dict | None = None,
+    on_round=None,
+) -> dict:
+    """
+    Run the optimization loop from `prompt`. `start_evaluation`, if given, is
+    the evaluation of `prompt` itself and saves round 0; `on_round(rounds)` is
+    called after every round.
+
+    Returns {"rounds", "best", "stop_reason", "tokens", "elapsed_s"}, where each
+    round is {"round", "prompt", "evaluation", "total_score", "tokens",
+    "wall_ms", "cached"} and "best" is the index of the best-scoring round.
+    """
+    started = time.perf_counter()
+    rounds = []
+    tokens = 0
+    best = 0
+    stale = 0
+    seen = set()
+    candidate = prompt
+    stop_reason = "max_rounds"
+
+    budget = deadline_scope(settings.time_budget_s) if settings.time_budget_s else contextlib.nullcontext()
+    with budget:
+        budget_deadline = current_deadline.get() if settings.time_budget_s else None
+        for number in range(settings.max_rounds + 1):
+            round_started = time.perf_counter()
+            if number == 0 and start_evaluation is not None:
+                evaluation, used, cached = start_evaluation, 0, True
+            else:
+                try:
+                    evaluation, usage = call_prompt_evaluator_with_usage(candidate, options)
+                except (requests.exceptions.Timeout, RequestShedError) as e:
+                    if not out_of_budget(e, budget_deadline):
+                        raise   # the call's own timeout, not the loop's budget
+                    stop_reason = "time"
+                    break
+                used = usage["prompt_tokens"] + usage["completion_tokens"]
+                cached = usage["cached"]
+            tokens += used
+            seen.add(candidate.strip())
+            rounds.append(
+                {
+                    "round": number,
+                    "prompt": candidate,
+                    "evaluation": evaluation,
+                    "total_score": evaluation["total_score"],
+                    "tokens": used,
+                    "wall_ms": (time.perf_counter() - round_started) * 1000,
+                    "cached": cached,
+                }
+            )
+            if on_round is not None:
+                on_round(list(rounds))
+
+            score = evaluation["total_score"]
+            if number > 0:
+                if score >= rounds[best]["total_score"] + settings.min_gain:
+                    stale = 0
+                else:
+                    stale += 1
+                if score > rounds[best]["total_score"]:
+                    best = number
+            if score >= settings.target:
+                stop_reason = "target"
+                break
+            # Checked as soon as the round's tokens are in, so no round starts over budget
+            if settings.token_budget and tokens >= settings.token_budget:
+                stop_reason = "tokens"
+                break
+            if number > 0 and stale >= settings.patience:
+                stop_reason = "plateau"
+                break
+            if number == settings.max_rounds:
+                break
+
+            candidate = evaluation.get("improved_prompt", "")
+            if not candidate.strip() or candidate.strip() in seen:
+                stop_reason = "no_rewrite"
+                break
+
+    return {
+        "rounds": rounds,
+        "best": best,
+        "stop_reason": stop_reason,
+        "tokens": tokens,
+        "elapsed_s": time.perf_counter() - started,
+    }
+
+
+def optimization_job(job, prompt: str, options: dict | None, settings: OptimizeSettings, start_evaluation=None) -> dict:
+    """
+    Background job running optimize_prompt, publishing the rounds as they finish.
+    """
+    return optimize_prompt(
+        prompt,
+        options,
+        settings,
+        start_evaluation=start_evaluation,
+        on_round=lambda rounds: job.update(rounds=rounds),
+    )
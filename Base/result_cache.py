@@ -0,0 +1,157 @@
+# result_cache.py
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+class ResultCache:
+    """
+    Persistent key/value cache for model results, backed by SQLite.
+
+    Entries expire after `ttl_seconds` and, once more than `max_entries`
+    are stored (or their values take more than `max_bytes`), the least
+    recently used ones are evicted. Values must be JSON-serializable.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        max_entries: int = 5000,
+        ttl_seconds: int = 7 * 24 * 3600,
+        max_bytes: int | None = None,
+    ):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS cache (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS cache_last_access ON cache (last_access)")
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(*parts) -> str:
+        """
+        Build a content-addressed key from any JSON-serializable parts.
+        """
+        blob = json.dumps(parts, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+    def get(self, key: str):
+        """
+        Return the cached value for `key`, or None on a miss or an expired entry.
+        """
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, created_at FROM cache WHERE key = ?", (key,)
+            ).fetchone()
+
+            if row is None:
+                self.misses += 1
+                return None
+
+            value, created_at = row
+            if now - created_at > self.ttl_seconds:
+                self._conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+                self._conn.commit()
+                self.evictions += 1
+                self.misses += 1
+                return None
+
+            self._conn.execute("UPDATE cache SET last_access = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+
+        return json.loads(value)
+
+    def set(self, key: str, value) -> None:
+        """
+        Store `value` under `key`, then evict expired and least recently used entries.
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cache (key, value, created_at, last_access) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False), now, now),
+            )
+            self._evict(now)
+            self._conn.commit()
+
+    def _evict(self, now: float) -> None:
+        expired = self._conn.execute(
+            "DELETE FROM cache WHERE created_at < ?", (now - self.ttl_seconds,)
+        ).rowcount
+
+        overflow = self._conn.execute(
+            """
+            DELETE FROM cache WHERE key IN (
+                SELECT key FROM cache ORDER BY last_access ASC
+                LIMIT MAX(0, (SELECT COUNT(*) FROM cache) - ?)
+            )
+            """,
+            (self.max_entries,),
+        ).rowcount
+
+        self.evictions += expired + overflow
+
+        if self.max_bytes is None:
+            return
+
+        total = self._conn.execute("SELECT COALESCE(SUM(LENGTH(CAST(value AS BLOB))), 0) FROM cache").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+
+        doomed = []
+        for key, size in self._conn.execute("SELECT key, LENGTH(CAST(value AS BLOB)) FROM cache ORDER BY last_access ASC"):
+            if total <= self.max_bytes:
+                break
+            doomed.append((key,))
+            total -= size
+        self._conn.executemany("DELETE FROM cache WHERE key = ?", doomed)
+        self.evictions += len(doomed)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM cache")
+            self._conn.commit()
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries, size = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(LENGTH(CAST(value AS BLOB))), 0) FROM cache"
+            ).fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "entries": entries,
+            "max_entries": self.max_entries,
+            "bytes": size,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "evictions": self.evictions,
+        }
@@ -0,0 +1,187 @@
+# scheduler.py
+#
+# Process-wide admission control for model calls: a fixed pool of slots
+# (how many generations the backend serves at once) and, in front of it, one
+# FIFO queue per session served round-robin, so a session that fires many
+# calls can't starve the others.
+#
+# Waiting requests that can't start before their deadline are shed right away
+# (RequestShedError) instead of timing out much later inside the backend.
+# Until a call has finished there is no estimate to go by: requests then wait
+# until their deadline and are only shed if it runs out.
+
+import contextlib
+import contextvars
+import threading
+import time
+from collections import OrderedDict, deque
+
+# The session a model call is made for. Set it once per request (the Streamlit
+# script run, the API handler); copy the context into worker threads.
+current_session = contextvars.ContextVar("llm_session", default="default")
+
+
+class RequestShedError(RuntimeError):
+    """
+    The request would not get a slot before its deadline, so it was dropped.
+    """
+
+    def __init__(self, eta_s: float, max_wait_s: float):
+        super().__init__(
+            f"The model is busy: the expected wait ({eta_s:.0f} s) exceeds the limit ({max_wait_s:.0f} s). "
+            "Please try again in a moment."
+        )
+        self.eta_s = eta_s
+
+
+class Ticket:
+    def __init__(self, session: str):
+        self.session = session
+        self.granted = False
+        self.enqueued_at = time.monotonic()
+        self.started_at = None
+
+
+class FairScheduler:
+    """
+    `slots` concurrent calls; waiting calls are granted one session at a time,
+    round-robin. Estimated waits come from an EWMA of how long calls hold a
+    slot, seeded with `initial_service_s` or else the first call's time.
+    """
+
+    def __init__(self, slots: int, initial_service_s: float | None = None, alpha: float = 0.2):
+        self.slots = max(1, slots)
+        self.service_s = initial_service_s
+        self.alpha = alpha
+        self.running = 0
+        self.granted = 0
+        self.shed = 0
+        self._queues = OrderedDict()   # session -> deque of waiting tickets, in round-robin order
+        self._running_by_session = {}
+        self._cond = threading.Condition()
+
+    # ---------------------------
+    # Queue bookkeeping (callers hold self._cond)
+    # ---------------------------
+
+    def _order(self) -> list:
+        """
+        Waiting tickets in the order they will be granted.
+        """
+        queues = [list(q) for q in self._queues.values()]
+        order = []
+        depth = 0
+        while any(depth < len(q) for q in queues):
+            order.extend(q[depth] for q in queues if depth < len(q))
+            depth += 1
+        return order
+
+    def _eta(self, position: int) -> float | None:
+        # `position` slot releases must happen first; slots free up at slots/service_s per second
+        if self.service_s is None:
+            return None
+        return position * self.service_s / self.slots
+
+    @staticmethod
+    def _rounded(seconds: float | None) -> float | None:
+        return None if seconds is None else round(seconds, 1)
+
+    def _grant(self) -> None:
+        while self.running < self.slots and self._queues:
+            session, waiting = next(iter(self._queues.items()))
+            ticket = waiting.popleft()
+            # Rotate: the session goes to the back of the line, or leaves it when empty
+            del self._queues[session]
+            if waiting:
+                self._queues[session] = waiting
+            ticket.granted = True
+            ticket.started_at = time.monotonic()
+            self.running += 1
+            self.granted += 1
+            self._running_by_session[session] = self._running_by_session.get(session, 0) + 1
+        self._cond.notify_all()
+
+    def _remove(self, ticket: Ticket) -> None:
+        waiting = self._queues.get(ticket.session)
+        if waiting is not None and ticket in waiting:
+            waiting.remove(ticket)
+            if not waiting:
+                del self._queues[ticket.session]
+
+    # ---------------------------
+    # Public API
+    # ---------------------------
+
+    def acquire(self, session: str, max_wait_s: float) -> Ticket:
+        """
+        Block until `session` gets a slot. Raises RequestShedError as soon as
+        the estimated wait exceeds `max_wait_s` (once there is an estimate),
+        or when it runs out.
+        """
+        ticket = Ticket(session)
+        deadline = ticket.enqueued_at + max_wait_s
+        with self._cond:
+            self._queues.setdefault(session, deque()).append(ticket)
+            self._grant()
+            while not ticket.granted:
+                now = time.monotonic()
+                eta = self._eta(self._order().index(ticket) + 1)
+                if now + (eta or 0.0) > deadline or now >= deadline:
+                    self._remove(ticket)
+                    self.shed += 1
+                    raise RequestShedError(max_wait_s if eta is None else eta, max_wait_s)
+                self._cond.wait(timeout=min(1.0, deadline - now))
+        return ticket
+
+    def release(self, ticket: Ticket) -> None:
+        with self._cond:
+            held_s = time.monotonic() - ticket.started_at
+            if self.service_s is None:
+                self.service_s = held_s
+            else:
+                self.service_s += self.alpha * (held_s - self.service_s)
+            self.running -= 1
+            left = self._running_by_session[ticket.session] - 1
+            if left:
+                self._running_by_session[ticket.session] = left
+            else:
+                del self._running_by_session[ticket.session]
+            self._grant()
+
+    @contextlib.contextmanager
+    def slot(self, session: str, max_wait_s: float):
+        ticket = self.acquire(session, max_wait_s)
+        try:
+            yield ticket
+        finally:
+            self.release(ticket)
+
+    def session_status(self, session: str) -> dict:
+        """
+        Where `session` stands: calls running and waiting, the queue position
+        of its next call (1 = next to start) and the estimated wait for it
+        (None before any call has finished).
+        """
+        with self._cond:
+            waiting = self._queues.get(session)
+            position = None
+            if waiting:
+                position = self._order().index(waiting[0]) + 1
+            return {
+                "running": self._running_by_session.get(session, 0),
+                "queued": len(waiting) if waiting else 0,
+                "position": position,
+                "eta_s": self._rounded(self._eta(position)) if position else 0.0,
+            }
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "slots": self.slots,
+                "running": self.running,
+                "queued": sum(len(q) for q in self._queues.values()),
+                "sessions_waiting": len(self._queues),
+                "avg_call_s": self._rounded(self.service_s),
+                "granted": self.granted,
+                "shed": self.shed,
+            }
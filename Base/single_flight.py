@@ -0,0 +1,268 @@
+# single_flight.py
+#
+# Coalesces identical in-flight work: concurrent callers with the same key
+# wait for one execution and share its result instead of each generating it.
+#
+# Within a process, followers simply wait on the leader. Across processes
+# (e.g. the API server next to Streamlit), an optional directory of lock files
+# serializes leaders per key; each leader first re-checks the shared cache, so
+# whoever was second finds the first one's result there.
+#
+# Shared work is cancelled only once all of its callers are: cancelling the
+# caller that happened to start it leaves it running for the others.
+
+import contextlib
+import contextvars
+import logging
+import os
+import threading
+
+try:
+    import fcntl
+except ImportError:   # not available on Windows: coalesce within the process only
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+
+class _Call:
+    def __init__(self, waiters=None):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+        self.waiters = waiters
+
+
+class SharedStream:
+    """
+    The chunks of one streamed generation, which any number of readers can
+    iterate from the start while it is still being produced.
+    """
+
+    def __init__(self, waiters=None):
+        self.waiters = waiters
+        self.chunks = []
+        self.results = []        # whatever the producer reported before it finished
+        self.error = None
+        self.finished = False
+        self._cond = threading.Condition()
+
+    def put(self, chunk) -> None:
+        with self._cond:
+            self.chunks.append(chunk)
+            self._cond.notify_all()
+
+    def finish(self, results: list | None = None, error: BaseException | None = None) -> None:
+        with self._cond:
+            self.results = results or []
+            self.error = error
+            self.finished = True
+            self._cond.notify_all()
+
+    def __iter__(self):
+        index = 0
+        while True:
+            with self._cond:
+                while index >= len(self.chunks) and not self.finished:
+                    self._cond.wait()
+                new = self.chunks[index:]
+                done = self.finished
+            for chunk in new:
+                yield chunk
+            index += len(new)
+            if done and index >= len(self.chunks):
+                if self.error is not None:
+                    raise self.error
+                return
+
+
+class _Reader:
+    """
+    One reader of a SharedStream; stops waiting on it when done reading.
+    """
+
+    def __init__(self, stream: SharedStream, waiter):
+        self.stream = stream
+        self._waiter = waiter
+
+    @property
+    def results(self) -> list:
+        return self.stream.results
+
+    def __iter__(self):
+        try:
+            yield from self.stream
+        finally:
+            if self.stream.waiters is not None:
+                self.stream.waiters.leave(self._waiter)
+
+
+class SingleFlight:
+    """
+    Per-key deduplication of concurrent work. `lock_dir` enables the
+    cross-process lock files (POSIX only).
+
+    `waiters`, if given, makes a group of the callers sharing each piece of
+    work (async_client.Waiters): every caller joins it, the work runs in its
+    scope(), and once the group is abandoned (all its callers cancelled) new
+    callers start the work afresh instead of sharing the cancelled one.
+
+    `pump_executor` runs the producers of shared streams; without one, each
+    gets a thread of its own. It must not cap the work (a pool as small as
+    the model's concurrency would queue producers FIFO before they ever
+    reach the scheduler): the producers do their own waiting.
+    """
+
+    def __init__(self, lock_dir: str | None = None, waiters=None, pump_executor=None):
+        self.new_waiters = waiters
+        self.pump_executor = pump_executor
+        self.lock_dir = lock_dir if fcntl is not None else None
+        if lock_dir and fcntl is None:
+            logger.warning("File locks are not supported on this platform; coalescing within the process only")
+        if self.lock_dir:
+            os.makedirs(self.lock_dir, exist_ok=True)
+        self.leaders = 0
+        self.coalesced = 0           # callers served by another caller in this process
+        self.found_in_cache = 0      # leaders that found the result already cached, e.g. by another process
+        self._calls = {}
+        self._streams = {}
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def _file_lock(self, key: str):
+        if not self.lock_dir:
+            yield
+            return
+        path = os.path.join(self.lock_dir, key + ".lock")
+        with open(path, "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                # Unlink while still holding the lock so lock files don't pile up.
+                # Anyone who opened the old file re-checks the cache once they get it.
+                with contextlib.suppress(OSError):
+                    os.unlink(path)
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def do(self, key: str, fn, lookup=None) -> tuple:
+        """
+        Run `fn()` once for all concurrent callers with `key`; every caller
+        gets its return value (or its exception). With lock files, `lookup()`
+        is tried first under the lock and should return the shared cached
+        value or None; `fn` is expected to fill that cache.
+        Returns (value, shared), where `shared` is True when the value came
+        from someone else's work.
+        """
+        with self._lock:
+            call, waiter = self._join(self._calls, key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call(self._waiters())
+                waiter = call.waiters.join() if call.waiters is not None else None
+                self.leaders += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            try:
+                call.done.wait()
+            finally:
+                if call.waiters is not None:
+                    call.waiters.leave(waiter)
+            if call.error is not None:
+                raise call.error
+            return call.value, True
+
+        shared = False
+        try:
+            with self._file_lock(key), self._scope(call.waiters):
+                value = lookup() if self.lock_dir and lookup is not None else None
+                if value is not None:
+                    shared = True
+                    with self._lock:
+                        self.found_in_cache += 1
+                else:
+                    value = fn()
+            call.value = value
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                if self._calls.get(key) is call:
+                    del self._calls[key]
+            if call.waiters is not None:
+                call.waiters.leave(waiter)
+            call.done.set()
+        return value, shared
+
+    def stream(self, key: str, produce):
+        """
+        Return a reader of the SharedStream for `key` (iterate it, then find
+        the results in its `results`), starting the stream if nobody is
+        producing it.
+        `produce(finish)` must return an iterator of chunks and may call
+        `finish(result)` to report results, which readers find in
+        `SharedStream.results` at the end; it runs on the pump executor, so it
+        keeps going (and can fill caches) even if every reader stops early.
+        """
+        with self._lock:
+            stream, waiter = self._join(self._streams, key)
+            if stream is not None:
+                self.coalesced += 1
+                return _Reader(stream, waiter)
+            stream = self._streams[key] = SharedStream(self._waiters())
+            waiter = stream.waiters.join() if stream.waiters is not None else None
+            self.leaders += 1
+
+        def pump():
+            results = []
+            try:
+                with self._scope(stream.waiters):
+                    for chunk in produce(results.append):
+                        stream.put(chunk)
+            except BaseException as e:
+                stream.finish(error=e)
+            else:
+                stream.finish(results)
+            finally:
+                with self._lock:
+                    if self._streams.get(key) is stream:
+                        del self._streams[key]
+
+        if self.pump_executor is not None:
+            self.pump_executor.submit(contextvars.copy_context().run, pump)
+        else:
+            context = contextvars.copy_context()
+            threading.Thread(target=context.run, args=(pump,), name="single-flight-pump", daemon=True).start()
+        return _Reader(stream, waiter)
+
+    def _waiters(self):
+        return self.new_waiters() if self.new_waiters is not None else None
+
+    @staticmethod
+    def _join(table: dict, key: str) -> tuple:
+        """
+        (entry, waiter) for joining the work in flight for `key`, or
+        (None, None) if there is none that can still be joined. Callers hold self._lock.
+        """
+        entry = table.get(key)
+        if entry is None or entry.waiters is None:
+            return entry, None
+        waiter = entry.waiters.join()
+        return (entry, waiter) if waiter is not None else (None, None)
+
+    @staticmethod
+    def _scope(waiters):
+        return waiters.scope() if waiters is not None else contextlib.nullcontext()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "in_flight": len(self._calls) + len(self._streams),
+                "leaders": self.leaders,
+                "coalesced": self.coalesced,
+                "found_in_cache": self.found_in_cache,
+                "lock_dir": self.lock_dir,
+            }
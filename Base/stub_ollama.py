@@ -0,0 +1,255 @@
+# stub_ollama.py
+#
+# A tiny stand-in for the Ollama HTTP API, for local testing and benchmarks
+# without a GPU. Answers /api/chat (streaming and not) with deterministic text,
+# reports Ollama-style timings, and serves /api/ps, /api/tags and /api/version.
+# It also answers OpenAI's /v1/chat/completions and /v1/models, to try
+# LLM_BACKEND=openai.
+#
+# Run several on different ports to try multi-host routing:
+#   python stub_ollama.py --ports 11435 11436 11437 --token-delay 0.02
+#   OLLAMA_BASE_URLS=http://localhost:11435,http://localhost:11436,http://localhost:11437 \
+#       streamlit run app_ollama.py
+#
+# Only the standard library is used, so it runs anywhere.
+
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+SCORE_MAX = {"persona": 25, "task": 25, "context": 20, "constraints": 15, "clarity": 15}
+
+
+def stub_evaluation(prompt: str) -> dict:
+    """
+    Deterministic evaluator-shaped result for a prompt.
+    """
+    seed = int(hashlib.sha256(prompt.encode("utf-8")).hexdigest(), 16)
+    scores = {}
+    for i, (key, top) in enumerate(SCORE_MAX.items()):
+        scores[key] = (seed >> (8 * i)) % (top + 1)
+    return {
+        "total_score": max(1, sum(scores.values())),
+        "scores": scores,
+        "diagnosis": {key: f"Stub diagnosis for {key}." for key in SCORE_MAX},
+        "improvements": ["Define a role for the model.", "State the expected output format."],
+        "improved_prompt": f"You are an expert assistant. {prompt.strip()} Answer in three short paragraphs.",
+        "short_explanation": "Stub evaluation generated without a model.",
+    }
+
+
+def stub_reply(payload: dict) -> str:
+    """
+    The text a stub model would generate for a chat payload. A JSON schema
+    in "format" limits the evaluation to the fields it asks for.
+    """
+    messages = payload.get("messages", [])
+    system = next((m["content"] for m in messages if m.get("role") == "system"), "")
+    user = next((m["content"] for m in reversed(messages) if m.get("role") == "user"), "")
+
+    if payload.get("format") or "JSON" in system:
+        prompt = user.split("\n\n", 1)[-1] if user.startswith("Prompt to evaluate:") else user
+        evaluation = stub_evaluation(prompt.split("\n\nScores: ")[0])
+        schema = payload.get("format")
+        if isinstance(schema, dict) and "properties" in schema:
+            evaluation = {key: value for key, value in evaluation.items() if key in schema["properties"]}
+        return json.dumps(evaluation, ensure_ascii=False)
+    return f"Stub answer to: {user.strip()}"
+
+
+def tokenize(text: str) -> list:
+    """
+    Split text into pseudo-tokens (words with their trailing space).
+    """
+    words = text.split(" ")
+    return [word + " " for word in words[:-1]] + [words[-1]]
+
+
+class StubState:
+    def __init__(self, name: str, token_delay: float, load_delay: float, fail_rate: float):
+        self.name = name
+        self.token_delay = token_delay
+        self.load_delay = load_delay
+        self.fail_rate = fail_rate
+        self.loaded = set()
+        self.lock = threading.Lock()
+
+
+def make_handler(state: StubState):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, fmt, *args):
+            pass
+
+        def _json(self, body: dict, status: int = 200):
+            data = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path == "/api/ps":
+                with state.lock:
+                    models = [{"name": name, "model": name} for name in sorted(state.loaded)]
+                self._json({"models": models})
+            elif self.path == "/api/tags":
+                self._json({"models": [{"name": "llama3.3:latest"}]})
+            elif self.path == "/v1/models":
+                self._json({"object": "list", "data": [{"id": "llama3.3", "object": "model"}]})
+            elif self.path == "/api/version":
+                self._json({"version": f"stub ({state.name})"})
+            else:
+                self._json({"error": "not found"}, status=404)
+
+        def do_POST(self):
+            if self.path not in ("/api/chat", "/v1/chat/completions"):
+                self._json({"error": "not found"}, status=404)
+                return
+            openai = self.path.startswith("/v1/")
+
+            length = int(self.headers.get("Content-Length", 0))
+            payload = json.loads(self.rfile.read(length) or b"{}")
+            if random.random() < state.fail_rate:
+                self._json({"error": "stub failure"}, status=500)
+                return
+
+            started = time.perf_counter()
+            model = payload.get("model", "stub")
+            name = model if ":" in model else f"{model}:latest"
+            with state.lock:
+                cold = name not in state.loaded
+                state.loaded.add(name)
+            load_ns = int(state.load_delay * 1e9) if cold else 0
+            if cold:
+                time.sleep(state.load_delay)
+
+            prompt_tokens = sum(len(m.get("content", "")) for m in payload.get("messages", [])) // 4
+            tokens = tokenize(stub_reply(payload))
+            if openai and payload.get("response_format"):
+                payload["format"] = "json"
+            limit = payload.get("max_tokens") if openai else (payload.get("options") or {}).get("num_predict")
+            if limit and limit > 0:
+                tokens = tokens[:limit]
+
+            def final(content: str) -> dict:
+                total_ns = int((time.perf_counter() - started) * 1e9)
+                eval_ns = int(len(tokens) * state.token_delay * 1e9)
+                return {
+                    "model": model,
+                    "message": {"role": "assistant", "content": content},
+                    "done": True,
+                    "total_duration": total_ns,
+                    "load_duration": load_ns,
+                    "prompt_eval_count": prompt_tokens,
+                    "prompt_eval_duration": max(total_ns - load_ns - eval_ns, 0),
+                    "eval_count": len(tokens),
+                    "eval_duration": eval_ns,
+                }
+
+            if openai:
+                self._openai(payload, model, tokens, prompt_tokens)
+                return
+
+            if not payload.get("stream", True):
+                time.sleep(len(tokens) * state.token_delay)
+                self._json(final("".join(tokens)))
+                return
+
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            try:
+                for token in tokens:
+                    time.sleep(state.token_delay)
+                    self._chunk({"model": model, "message": {"role": "assistant", "content": token}, "done": False})
+                self._chunk(final(""))
+                self.wfile.write(b"0\r\n\r\n")
+            except (BrokenPipeError, ConnectionResetError):
+                pass   # the client cancelled the stream
+
+        def _chunk(self, body: dict):
+            data = (json.dumps(body) + "\n").encode("utf-8")
+            self._write_chunk(data)
+
+        def _write_chunk(self, data: bytes):
+            self.wfile.write(f"{len(data):X}\r\n".encode("ascii") + data + b"\r\n")
+            self.wfile.flush()
+
+        def _openai(self, payload: dict, model: str, tokens: list, prompt_tokens: int):
+            usage = {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": len(tokens),
+                "total_tokens": prompt_tokens + len(tokens),
+            }
+            if not payload.get("stream"):
+                time.sleep(len(tokens) * state.token_delay)
+                message = {"role": "assistant", "content": "".join(tokens)}
+                self._json(
+                    {
+                        "object": "chat.completion",
+                        "model": model,
+                        "choices": [{"index": 0, "message": message, "finish_reason": "stop"}],
+                        "usage": usage,
+                    }
+                )
+                return
+
+            def event(body) -> bytes:
+                return f"data: {body if isinstance(body, str) else json.dumps(body)}\n\n".encode("utf-8")
+
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            try:
+                for token in tokens:
+                    time.sleep(state.token_delay)
+                    delta = {"index": 0, "delta": {"content": token}, "finish_reason": None}
+                    self._write_chunk(event({"object": "chat.completion.chunk", "model": model, "choices": [delta]}))
+                if (payload.get("stream_options") or {}).get("include_usage"):
+                    self._write_chunk(event({"object": "chat.completion.chunk", "model": model, "choices": [], "usage": usage}))
+                self._write_chunk(event("[DONE]"))
+                self.wfile.write(b"0\r\n\r\n")
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+
+    return Handler
+
+
+def serve(port: int, token_delay: float, load_delay: float, fail_rate: float) -> ThreadingHTTPServer:
+    state = StubState(f"port {port}", token_delay, load_delay, fail_rate)
+    server = ThreadingHTTPServer(("0.0.0.0", port), make_handler(state))
+    server.state = state   # so in-process users (the tests) can change the delays
+    threading.Thread(target=server.serve_forever, name=f"stub-{port}", daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run one or more stub Ollama servers.")
+    parser.add_argument("--ports", type=int, nargs="+", default=[11435], help="ports to listen on")
+    parser.add_argument("--token-delay", type=float, default=0.02, help="seconds per generated token")
+    parser.add_argument("--load-delay", type=float, default=0.5, help="seconds to 'load' a model the first time")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="fraction of chat calls answered with 500")
+    args = parser.parse_args()
+
+    for port in args.ports:
+        serve(port, args.token_delay, args.load_delay, args.fail_rate)
+        print(f"Stub Ollama listening on http://localhost:{port}")
+
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
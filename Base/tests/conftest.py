@@ -0,0 +1,60 @@
+# conftest.py
+#
+# Test setup: the modules under test live one level up and read their
+# configuration from the environment at import time, so point them at an
+# in-process stub Ollama (stub_ollama.py) and turn off everything that would
+# touch the disk or a real server before any test imports them.
+
+import os
+import sys
+import tempfile
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+
+import pytest  # noqa: E402
+
+from stub_ollama import serve  # noqa: E402
+
+STUB = serve(0, token_delay=0.0, load_delay=0.0, fail_rate=0.0)
+STUB_URL = f"http://127.0.0.1:{STUB.server_address[1]}"
+
+os.environ.update(
+    {
+        "LLM_BACKEND": "ollama",
+        "OLLAMA_BASE_URL": STUB_URL,
+        "OLLAMA_BASE_URLS": STUB_URL,
+        "OLLAMA_PRELOAD": "false",
+        "OLLAMA_BACKOFF_BASE": "0.01",
+        "EVAL_CACHE_ENABLED": "false",
+        "ANSWER_CACHE_ENABLED": "false",
+        "EVAL_LOCK_DIR": tempfile.mkdtemp(prefix="eval-locks-"),
+        "METRICS_PORT": "0",
+    }
+)
+
+
+@pytest.fixture
+def stub():
+    """
+    The stub Ollama server's state; delay changes are undone after the test.
+    """
+    state = STUB.state
+    saved = (state.token_delay, state.load_delay, state.fail_rate)
+    yield state
+    state.token_delay, state.load_delay, state.fail_rate = saved
+
+
+@pytest.fixture(params=["sync", "async"])
+def backend(request, monkeypatch):
+    """
+    A fresh Ollama backend, sync (requests) and async (aiohttp), installed
+    as the process-wide one.
+    """
+    import evaluator
+
+    backend = evaluator.OllamaBackend() if request.param == "sync" else evaluator.AsyncOllamaBackend()
+    monkeypatch.setattr(evaluator, "get_backend", lambda: backend)
+    yield backend
+    if request.param == "async":
+        backend.close()
@@ -0,0 +1,151 @@
+import asyncio
+import threading
+
+import pytest
+from aiohttp.test_utils import TestClient, TestServer
+
+import api_server
+from scheduler import RequestShedError
+
+PROMPT = "Summarize the attached quarterly sales report for the executive team in five bullet points."
+
+
+def run_client(scenario, concurrency: int = 2, max_queue: int = 4):
+    """
+    Run `scenario(client, gate)` against a fresh API app, with its admission
+    gate sized `concurrency` + `max_queue`.
+    """
+
+    async def main():
+        app = api_server.create_app()
+        app["gate"] = api_server.AdmissionGate(concurrency, max_queue)
+        async with TestClient(TestServer(app)) as client:
+            return await scenario(client, app["gate"])
+
+    return asyncio.run(main())
+
+
+async def post(client, path: str, body, headers=None) -> tuple:
+    resp = await client.post(path, json=body, headers=headers)
+    payload = await resp.json() if resp.content_type == "application/json" else await resp.text()
+    return resp.status, payload, resp.headers
+
+
+def test_evaluate_returns_the_evaluation(backend):
+    status, evaluation, _ = run_client(lambda client, gate: post(client, "/evaluate", {"prompt": PROMPT}))
+
+    assert status == 200
+    assert 1 <= evaluation["total_score"] <= 100
+    assert evaluation["improved_prompt"]
+
+
+def test_compare_evaluates_first_without_an_improved_prompt(backend):
+    status, body, _ = run_client(lambda client, gate: post(client, "/compare", {"prompt": PROMPT}))
+
+    assert status == 200
+    assert body["errors"] == {}
+    assert body["improved_prompt"] != PROMPT
+    assert body["original_answer"].startswith("Stub answer to:")
+    assert body["improved_answer"].startswith("Stub answer to:")
+
+
+def test_prescore_needs_no_model():
+    status, body, _ = run_client(lambda client, gate: post(client, "/prescore", {"prompt": PROMPT}))
+
+    assert status == 200
+    assert body["source"] == "heuristic"
+    assert body["worth_model_call"] is True
+
+
+@pytest.mark.parametrize("body", [["not", "an", "object"], {"prompt": "   "}, {"text": PROMPT}])
+def test_a_request_without_a_prompt_is_a_400(body):
+    status, _, _ = run_client(lambda client, gate: post(client, "/evaluate", body))
+    assert status == 400
+
+
+def test_requests_beyond_the_queue_are_rejected_with_429(monkeypatch):
+    release = threading.Event()
+    started = threading.Event()
+
+    def evaluate(prompt):
+        started.set()
+        release.wait(10)
+        return {"total_score": 50}
+
+    monkeypatch.setattr(api_server, "call_prompt_evaluator", evaluate)
+
+    async def scenario(client, gate):
+        # One running, one waiting: the gate is full
+        admitted = [asyncio.create_task(post(client, "/evaluate", {"prompt": PROMPT})) for _ in range(2)]
+        while not started.is_set() or gate.pending < 2:
+            await asyncio.sleep(0.01)
+        status, body, headers = await post(client, "/evaluate", {"prompt": PROMPT})
+        release.set()
+        return status, body, headers, [(await task)[0] for task in admitted], gate.stats()
+
+    status, body, headers, admitted, stats = run_client(scenario, concurrency=1, max_queue=1)
+
+    assert status == 429
+    assert headers["Retry-After"] == str(api_server.API_RETRY_AFTER)
+    assert body["running"] == 1 and body["queued"] == 1
+    assert admitted == [200, 200]
+    assert stats == {"running": 0, "queued": 0, "concurrency": 1, "max_queue": 1, "rejected": 1}
+
+
+def test_compare_reserves_room_for_all_three_calls():
+    async def scenario(client, gate):
+        return await post(client, "/compare", {"prompt": PROMPT})
+
+    status, _, _ = run_client(scenario, concurrency=1, max_queue=1)
+    assert status == 429
+
+
+def test_a_shed_model_call_is_a_503_with_the_estimated_wait(monkeypatch):
+    def evaluate(prompt):
+        raise RequestShedError(eta_s=42, max_wait_s=30)
+
+    monkeypatch.setattr(api_server, "call_prompt_evaluator", evaluate)
+    status, _, headers = run_client(lambda client, gate: post(client, "/evaluate", {"prompt": PROMPT}))
+
+    assert status == 503
+    assert headers["Retry-After"] == "42"
+
+
+def test_a_failed_evaluation_before_compare_releases_its_reservation(monkeypatch):
+    def evaluate(prompt):
+        raise RuntimeError("model crashed")
+
+    monkeypatch.setattr(api_server, "call_prompt_evaluator", evaluate)
+
+    async def scenario(client, gate):
+        status, _, _ = await post(client, "/compare", {"prompt": PROMPT})
+        return status, gate.stats()
+
+    status, stats = run_client(scenario)
+    assert status == 502
+    assert stats["queued"] == 0 and stats["running"] == 0
+
+
+def test_calls_are_queued_under_the_clients_session_id(monkeypatch):
+    from scheduler import current_session
+
+    sessions = []
+    monkeypatch.setattr(api_server, "call_llm_answer", lambda prompt, force: sessions.append(current_session.get()) or "hi")
+
+    async def scenario(client, gate):
+        await post(client, "/answer", {"prompt": PROMPT}, headers={"X-Session-Id": "client-7"})
+
+    run_client(scenario)
+    assert sessions == ["client-7"]
+
+
+def test_health_reports_the_gate_and_the_model_queue():
+    async def scenario(client, gate):
+        resp = await client.get("/health")
+        return resp.status, await resp.json()
+
+    status, body = run_client(scenario)
+    assert status == 200
+    assert body["status"] == "ok"
+    assert body["concurrency"] == 2
+    assert "slots" in body["model_queue"]
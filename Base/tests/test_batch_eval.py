@@ -0,0 +1,96 @@
+import argparse
+import json
+import os
+
+import pytest
+
+import batch_eval
+from scheduler import RequestShedError
+
+EVALUATION = {"total_score": 70, "scores": {}, "improved_prompt": "Better prompt."}
+USAGE = {"prompt_tokens": 10, "completion_tokens": 20, "prompt_eval_saved_ms": 0.0, "cached": False}
+
+
+@pytest.fixture
+def no_sleep(monkeypatch):
+    delays = []
+    monkeypatch.setattr(batch_eval.time, "sleep", delays.append)
+    return delays
+
+
+def test_a_shed_prompt_is_retried_after_the_estimated_wait(monkeypatch, no_sleep):
+    calls = []
+
+    def evaluate(prompt):
+        calls.append(prompt)
+        if len(calls) < 3:
+            raise RequestShedError(eta_s=45, max_wait_s=30)
+        return EVALUATION, USAGE
+
+    monkeypatch.setattr(batch_eval, "call_prompt_evaluator_with_usage", evaluate)
+    result = batch_eval.evaluate_one("1", "Write a haiku.")
+
+    assert result["total_score"] == 70
+    assert len(calls) == 3
+    assert no_sleep == [batch_eval.SHED_RETRY_MAX_DELAY] * 2
+
+
+def test_a_prompt_shed_on_every_attempt_fails(monkeypatch, no_sleep):
+    def evaluate(prompt):
+        raise RequestShedError(eta_s=5, max_wait_s=30)
+
+    monkeypatch.setattr(batch_eval, "call_prompt_evaluator_with_usage", evaluate)
+    with pytest.raises(RequestShedError):
+        batch_eval.evaluate_one("1", "Write a haiku.")
+    assert no_sleep == [5] * (batch_eval.SHED_RETRIES - 1)
+
+
+def test_a_falsy_id_is_kept_and_only_a_missing_one_becomes_the_row_number(tmp_path):
+    path = tmp_path / "prompts.jsonl"
+    rows = [{"id": 0, "prompt": "a"}, {"id": "", "prompt": "b"}, {"id": None, "prompt": "c"}, {"prompt": "d"}]
+    path.write_text("\n".join(json.dumps(row) for row in rows) + "\n", encoding="utf-8")
+
+    assert list(batch_eval.read_prompts(str(path), "id", "prompt")) == [("0", "a"), ("2", "b"), ("3", "c"), ("4", "d")]
+
+
+def test_csv_ids_are_read_the_same_way(tmp_path):
+    path = tmp_path / "prompts.csv"
+    path.write_text("id,prompt\n0,a\n,b\n", encoding="utf-8")
+
+    assert list(batch_eval.read_prompts(str(path), "id", "prompt")) == [("0", "a"), ("2", "b")]
+
+
+def batch_args(tmp_path, rows):
+    path = tmp_path / "prompts.jsonl"
+    path.write_text("\n".join(json.dumps(row) for row in rows) + "\n", encoding="utf-8")
+    return argparse.Namespace(
+        input=str(path),
+        output=str(tmp_path / "results.jsonl"),
+        id_field="id",
+        prompt_field="prompt",
+        concurrency=4,
+        checkpoint=None,
+    )
+
+
+@pytest.fixture
+def fake_evaluator(monkeypatch):
+    monkeypatch.setattr(batch_eval, "get_warm_managers", dict)
+    monkeypatch.setattr(batch_eval, "call_prompt_evaluator_with_usage", lambda prompt: (EVALUATION, USAGE))
+
+
+def test_every_row_gets_a_result(tmp_path, fake_evaluator):
+    # The first row has the ID 0, which used to become its row number, 1, the ID of the second row
+    args = batch_args(tmp_path, [{"id": i, "prompt": f"prompt {i}"} for i in range(60)])
+
+    assert batch_eval.run(args) == 0
+    results = [json.loads(line) for line in open(args.output, encoding="utf-8")]
+    assert sorted(int(row["id"]) for row in results) == list(range(60))
+
+
+def test_duplicate_ids_are_rejected_before_anything_runs(tmp_path, fake_evaluator, capsys):
+    args = batch_args(tmp_path, [{"id": "a", "prompt": "x"}, {"prompt": "y"}, {"id": "2", "prompt": "z"}])
+
+    assert batch_eval.run(args) == 2
+    assert "Duplicate IDs" in capsys.readouterr().err
+    assert not os.path.exists(args.output)
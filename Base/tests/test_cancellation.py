@@ -0,0 +1,258 @@
+import contextvars
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import pytest
+
+import evaluator
+from async_client import GenerationCancelledError, GenerationRegistry, Waiters
+from jobs import current_job
+from scheduler import current_session
+from single_flight import SingleFlight
+
+PROMPT = (
+    "You are a senior data analyst. Summarize the attached quarterly sales report for the executive team "
+    "in five bullet points, covering revenue, margin and regional trends, in under 150 words."
+)
+
+
+def run_as(executor, session, fn, *args, job=None):
+    """
+    Submit fn(*args) to `executor` as a caller of `session` (and `job`).
+    """
+    context = contextvars.copy_context()
+
+    def run():
+        current_session.set(session)
+        current_job.set(job)
+        return fn(*args)
+
+    return executor.submit(context.run, run)
+
+
+def wait_for(condition, timeout_s=10.0):
+    deadline = time.monotonic() + timeout_s
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+# ---------------------------
+# Registry and waiters
+# ---------------------------
+
+
+def track_as(registry, session, job=None, waiters=None):
+    future = Future()
+    context = contextvars.copy_context()
+
+    def track():
+        current_session.set(session)
+        current_job.set(job)
+        if waiters is not None:
+            with waiters.scope():
+                registry.track(future)
+        else:
+            registry.track(future)
+
+    context.run(track)
+    return future
+
+
+def test_cancelling_a_session_cancels_its_own_generations():
+    registry = GenerationRegistry()
+    mine = track_as(registry, "A")
+    theirs = track_as(registry, "B")
+
+    assert registry.cancel_session("A") == 1
+    assert mine.cancelled()
+    assert not theirs.cancelled()
+
+
+def test_cancelling_a_job_cancels_only_that_jobs_generations():
+    registry = GenerationRegistry()
+    first = track_as(registry, "A", job="job-1")
+    second = track_as(registry, "A", job="job-2")
+
+    assert registry.cancel_session("job-1") == 1
+    assert first.cancelled()
+    assert not second.cancelled()
+
+
+def test_a_shared_generation_is_cancelled_once_every_waiter_is():
+    registry = GenerationRegistry()
+    waiters = Waiters()
+    for session in ("A", "B"):
+        contextvars.copy_context().run(lambda s=session: (current_session.set(s), waiters.join()))
+    future = track_as(registry, "A", waiters=waiters)
+
+    assert registry.cancel_session("A") == 0
+    assert not future.cancelled()
+    assert registry.stats()["sessions"] == 1
+
+    assert registry.cancel_session("B") == 1
+    assert future.cancelled()
+    assert waiters.abandoned
+    assert waiters.join() is None
+
+
+def test_nested_shared_work_is_waited_on_by_the_outer_callers():
+    registry = GenerationRegistry()
+    outer = Waiters(("A", None), ("B", None))
+    inner = Waiters()
+    with outer.scope():
+        inner.join()
+    future = track_as(registry, "A", waiters=inner)
+
+    registry.cancel_session("A")
+    assert not future.cancelled()
+    registry.cancel_session("B")
+    assert future.cancelled()
+
+
+# ---------------------------
+# Single-flight
+# ---------------------------
+
+
+def test_a_new_caller_does_not_join_abandoned_work():
+    flight = SingleFlight(waiters=Waiters)
+    release = threading.Event()
+    runs = []
+
+    def work(name):
+        runs.append(name)
+        release.wait(5)
+        return name
+
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        first = run_as(pool, "A", flight.do, "key", lambda: work("first"))
+        wait_for(lambda: runs)
+        flight._calls["key"].waiters.drop("A")   # what cancelling session A does
+        second = run_as(pool, "B", flight.do, "key", lambda: work("second"))
+        wait_for(lambda: len(runs) == 2)
+        release.set()
+
+        assert first.result() == ("first", False)
+        assert second.result() == ("second", False)
+
+
+def test_a_follower_keeps_the_shared_work_it_waits_on():
+    flight = SingleFlight(waiters=Waiters)
+    release = threading.Event()
+
+    def work():
+        release.wait(5)
+        return "value"
+
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        leader = run_as(pool, "A", flight.do, "key", work)
+        wait_for(lambda: "key" in flight._calls)
+        follower = run_as(pool, "B", flight.do, "key", work)
+        wait_for(lambda: flight.stats()["coalesced"] == 1)
+        waiters = flight._calls["key"].waiters
+        waiters.drop("A")
+        assert not waiters.abandoned
+        release.set()
+
+        assert leader.result() == ("value", False)
+        assert follower.result() == ("value", True)
+
+
+def test_shared_streams_are_produced_side_by_side():
+    # Each producer waits for the other to start: a pump pool capped below
+    # the number of streams would deadlock here
+    flight = SingleFlight(waiters=Waiters)
+    started = {key: threading.Event() for key in ("a", "b")}
+
+    def produce(key, other):
+        def chunks(finish):
+            started[key].set()
+            if not started[other].wait(5):
+                raise TimeoutError(f"{other} never started")
+            yield key
+
+        return chunks
+
+    readers = [flight.stream("a", produce("a", "b")), flight.stream("b", produce("b", "a"))]
+    assert [list(reader) for reader in readers] == [["a"], ["b"]]
+
+
+# ---------------------------
+# End to end, on the async client
+# ---------------------------
+
+
+@pytest.fixture
+def coalescing(monkeypatch):
+    monkeypatch.setattr(evaluator, "_single_flight", SingleFlight(waiters=Waiters))
+    monkeypatch.setattr(evaluator, "EVAL_SINGLE_FLIGHT", True)
+    return evaluator._single_flight
+
+
+def test_cancelling_one_session_does_not_fail_anothers_coalesced_evaluation(stub, coalescing, monkeypatch):
+    backend = evaluator.AsyncOllamaBackend()
+    monkeypatch.setattr(evaluator, "get_backend", lambda: backend)
+    stub.token_delay = 0.01
+    generations = evaluator.get_generations()
+
+    try:
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            a = run_as(pool, "session-a", evaluator.call_prompt_evaluator_with_usage, PROMPT)
+            wait_for(lambda: generations.stats()["in_flight"] == 1)
+            b = run_as(pool, "session-b", evaluator.call_prompt_evaluator_with_usage, PROMPT)
+            wait_for(lambda: coalescing.stats()["coalesced"] == 1)
+
+            assert evaluator.cancel_session_generations("session-a") == 0
+            evaluation, usage = b.result(timeout=60)
+            assert evaluation["total_score"] >= 0
+            assert usage["cached"]   # served by the shared generation
+            a.result(timeout=60)
+    finally:
+        backend.close()
+
+
+def test_cancelling_every_session_cancels_the_coalesced_evaluation(stub, coalescing, monkeypatch):
+    backend = evaluator.AsyncOllamaBackend()
+    monkeypatch.setattr(evaluator, "get_backend", lambda: backend)
+    stub.token_delay = 0.05
+    generations = evaluator.get_generations()
+
+    try:
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            a = run_as(pool, "session-c", evaluator.call_prompt_evaluator_with_usage, PROMPT)
+            wait_for(lambda: generations.stats()["in_flight"] == 1)
+            b = run_as(pool, "session-d", evaluator.call_prompt_evaluator_with_usage, PROMPT)
+            wait_for(lambda: coalescing.stats()["coalesced"] == 1)
+
+            assert evaluator.cancel_session_generations("session-c") == 0
+            assert evaluator.cancel_session_generations("session-d") == 1
+            for caller in (a, b):
+                with pytest.raises(GenerationCancelledError):
+                    caller.result(timeout=10)
+    finally:
+        backend.close()
+
+
+def test_cancelling_one_reader_does_not_fail_anothers_coalesced_stream(stub, coalescing, monkeypatch):
+    backend = evaluator.AsyncOllamaBackend()
+    monkeypatch.setattr(evaluator, "get_backend", lambda: backend)
+    stub.token_delay = 0.01
+    generations = evaluator.get_generations()
+
+    def read():
+        return "".join(evaluator.call_prompt_evaluator_stream(PROMPT))
+
+    try:
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            a = run_as(pool, "session-e", read)
+            wait_for(lambda: generations.stats()["in_flight"] == 1)
+            b = run_as(pool, "session-f", read)
+            wait_for(lambda: coalescing.stats()["coalesced"] == 1)
+
+            assert evaluator.cancel_session_generations("session-e") == 0
+            assert b.result(timeout=60) == a.result(timeout=60)
+            assert b.result().strip().startswith("{")
+    finally:
+        backend.close()
@@ -0,0 +1,77 @@
+import pytest
+
+import evaluator
+import heuristic_scorer
+from heuristic_scorer import prescore_prompt, scores_for_model, worth_model_call
+
+ENGLISH = "You are a senior data science teacher. Explain machine learning to beginners in 5 bullet points."
+NON_ENGLISH = [
+    "Explica qué es el aprendizaje automático para principiantes, en cinco viñetas.",
+    "Erkläre maschinelles Lernen für Anfänger in fünf Stichpunkten.",
+    "请用五个要点向初学者解释什么是机器学习。",
+]
+
+
+def test_an_english_prompt_gets_a_confident_estimate():
+    prescore = prescore_prompt(ENGLISH)
+    assert prescore["confident"]
+    assert scores_for_model(prescore) == {"total_score": prescore["total_score"], "scores": prescore["scores"]}
+
+
+@pytest.mark.parametrize("prompt", NON_ENGLISH, ids=["spanish", "german", "chinese"])
+def test_other_languages_are_scored_by_the_model(prompt, monkeypatch):
+    monkeypatch.setattr(heuristic_scorer, "PRESCORE_LLM_MIN_SCORE", 100)
+    prescore = prescore_prompt(prompt)
+    assert not prescore["confident"]
+    assert worth_model_call(prescore)
+    assert scores_for_model(prescore) is None
+
+
+def test_by_default_no_prompt_skips_the_model():
+    # The app's own default prompt estimates at 26
+    assert heuristic_scorer.PRESCORE_LLM_MIN_SCORE == 0
+    assert worth_model_call(prescore_prompt("Explain what machine learning is."))
+
+
+def test_a_low_confident_estimate_skips_the_model_when_gating_is_on(monkeypatch):
+    monkeypatch.setattr(heuristic_scorer, "PRESCORE_LLM_MIN_SCORE", 30)
+    assert not worth_model_call(prescore_prompt("Explain what machine learning is."))
+
+
+@pytest.fixture
+def model_calls(monkeypatch):
+    calls = []
+    chat, stream = evaluator.ollama_chat_full, evaluator.ollama_chat_stream
+
+    def chat_spy(*args, **kwargs):
+        calls.append(kwargs.get("call"))
+        return chat(*args, **kwargs)
+
+    def stream_spy(*args, **kwargs):
+        calls.append(kwargs.get("call"))
+        return stream(*args, **kwargs)
+
+    monkeypatch.setattr(evaluator, "ollama_chat_full", chat_spy)
+    monkeypatch.setattr(evaluator, "ollama_chat_stream", stream_spy)
+    return calls
+
+
+def test_given_scores_the_model_only_rewrites(backend, model_calls):
+    scored = scores_for_model(prescore_prompt(ENGLISH))
+    evaluation, usage = evaluator.call_prompt_evaluator_with_usage(ENGLISH, scored=scored)
+
+    assert model_calls == ["rewrite"]
+    assert list(usage["stages"]) == ["rewrite"]
+    assert evaluation["total_score"] == scored["total_score"]
+    assert evaluation["scores"] == scored["scores"]
+    assert evaluation["improved_prompt"]
+
+
+def test_given_scores_the_stream_starts_with_them_and_only_streams_the_rewrite(backend, model_calls):
+    scored = scores_for_model(prescore_prompt(ENGLISH))
+    text = "".join(evaluator.call_prompt_evaluator_stream(ENGLISH, scored=scored))
+    evaluation, _ = evaluator.parse_evaluation_with_repair(text)
+
+    assert model_calls == ["rewrite"]
+    assert evaluation["scores"] == scored["scores"]
+    assert evaluation["improved_prompt"]
@@ -0,0 +1,16 @@
+import evaluator
+
+MESSAGES = [{"role": "user", "content": "Say hello."}]
+
+
+def test_the_pool_panel_reports_the_active_backends_connections(stub, backend):
+    host = evaluator.OLLAMA_BASE_URLS[0]
+    before = evaluator.http_pool_stats().get(host, {})
+    for _ in range(3):
+        backend.chat(MESSAGES, evaluator.LLM_MODEL, evaluator.call_timeouts("answer"))
+
+    stats = evaluator.http_pool_stats()[host]
+    assert stats["requests_sent"] - before.get("requests_sent", 0) == 3
+    # Keep-alive: one connection serves the calls one after another
+    assert stats["connections_opened"] - before.get("connections_opened", 0) <= 1
+    assert stats["max_connections"] == evaluator.OLLAMA_POOL_MAXSIZE
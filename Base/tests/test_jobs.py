@@ -0,0 +1,153 @@
+import contextvars
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import evaluator
+import jobs
+from jobs import JobCancelledError, JobRunner
+from scheduler import current_session
+
+
+def wait_until(condition, timeout: float = 5.0) -> None:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("condition not met in time")
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def runner():
+    return JobRunner(max_workers=2, ttl_s=60)
+
+
+def test_a_job_publishes_progress_and_its_result_in_its_submitters_session(runner):
+    step = threading.Event()
+
+    def work(job, count):
+        for i in range(count):
+            job.update(done=i + 1)
+            step.wait(5)
+        return current_session.get()
+
+    def submit():
+        current_session.set("session-1")
+        return runner.submit("session-1", "evaluate", "label", work, 3)
+
+    job = contextvars.copy_context().run(submit)
+    wait_until(lambda: job.progress.get("done") == 1)
+    assert job.state == "running"
+    step.set()
+    wait_until(lambda: job.done)
+
+    assert job.state == "done"
+    assert job.progress == {"done": 3}
+    assert job.result == "session-1"
+    assert runner.jobs("session-1") == [job]
+    assert runner.jobs("session-2") == []
+
+
+def test_a_raising_job_fails_with_its_error(runner):
+    def work(job):
+        raise ValueError("broken")
+
+    job = runner.submit("s", "evaluate", "label", work)
+    wait_until(lambda: job.done)
+
+    assert job.state == "failed"
+    assert str(job.error) == "broken"
+    assert runner.stats()["failed"] == 1
+
+
+def test_a_running_job_is_cancelled_at_its_next_update():
+    cancelled = []
+    runner = JobRunner(max_workers=1, cancel_generations=cancelled.append)
+    started = threading.Event()
+    stopped = []
+
+    def work(job):
+        started.set()
+        try:
+            while True:
+                job.update(tick=time.time())
+                time.sleep(0.01)
+        except JobCancelledError:
+            stopped.append(True)
+            raise
+
+    job = runner.submit("s", "evaluate", "label", work)
+    started.wait(5)
+    assert runner.cancel(job.id)
+    wait_until(lambda: job.done)
+
+    assert job.state == "cancelled"
+    assert stopped == [True]
+    assert cancelled == [job.id]   # its generations are aborted too
+    assert not runner.cancel(job.id)
+
+
+def test_a_queued_job_is_cancelled_without_running():
+    runner = JobRunner(max_workers=1)
+    release = threading.Event()
+    ran = []
+    busy = runner.submit("s", "evaluate", "busy", lambda job: release.wait(5))
+    queued = runner.submit("s", "evaluate", "queued", lambda job: ran.append(True))
+
+    assert runner.cancel(queued.id)
+    release.set()
+    wait_until(lambda: busy.done)
+
+    assert queued.state == "cancelled"
+    assert ran == []
+
+
+def test_cancel_session_cancels_only_that_sessions_unfinished_jobs(runner):
+    release = threading.Event()
+    mine = [runner.submit("mine", "evaluate", str(i), lambda job: release.wait(5)) for i in range(2)]
+    other = runner.submit("other", "evaluate", "other", lambda job: release.wait(5))
+
+    assert runner.cancel_session("mine") == 2
+    release.set()
+    wait_until(lambda: all(job.done for job in [*mine, other]))
+
+    assert [job.state for job in mine] == ["cancelled", "cancelled"]
+    assert other.state == "done"
+
+
+def test_finished_jobs_are_forgotten_or_pruned_after_their_ttl(monkeypatch):
+    runner = JobRunner(max_workers=1, ttl_s=10)
+    first = runner.submit("s", "evaluate", "first", lambda job: 1)
+    second = runner.submit("s", "evaluate", "second", lambda job: 2)
+    wait_until(lambda: first.done and second.done)
+
+    runner.forget(first.id)
+    assert runner.get(first.id) is None
+    later = time.time() + 11
+    monkeypatch.setattr(jobs, "time", SimpleNamespace(time=lambda: later))
+    runner.submit("s", "evaluate", "third", lambda job: 3)
+    assert runner.get(second.id) is None
+
+
+def test_cancelling_a_job_stops_its_generation(stub, backend):
+    stub.token_delay = 0.05
+    runner = JobRunner(max_workers=1, cancel_generations=evaluator.cancel_session_generations)
+    prompt = " ".join(["word"] * 200)   # the stub echoes it: ~10 s of tokens
+
+    def answer(job):
+        text = ""
+        for chunk in evaluator.call_llm_answer_stream(prompt, force=True):
+            text += chunk
+            job.update(text=text)
+        return text
+
+    job = runner.submit("s", "compare", "answer", answer)
+    wait_until(lambda: job.progress.get("text"))
+    started = time.monotonic()
+    runner.cancel(job.id)
+    wait_until(lambda: job.done)
+
+    assert job.state == "cancelled"
+    assert time.monotonic() - started < 1
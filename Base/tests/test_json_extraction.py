@@ -0,0 +1,84 @@
+import json
+import time
+
+import pytest
+
+from evaluator import JsonObjectScanner, extract_json_from_text
+
+
+def test_a_plain_object_is_returned_as_is():
+    assert extract_json_from_text('{"a": 1, "b": [1, 2]}') == {"a": 1, "b": [1, 2]}
+
+
+def test_prose_and_fences_around_the_object_are_ignored():
+    text = 'Sure! Here is the evaluation:\n```json\n{"total_score": 72, "scores": {"clarity": 15}}\n```\nHope it helps.'
+    assert extract_json_from_text(text) == {"total_score": 72, "scores": {"clarity": 15}}
+
+
+def test_stray_braces_in_prose_before_the_object_are_skipped():
+    text = 'Use {placeholders} like {this}. {"improved_prompt": "Write {n} lines"}'
+    assert extract_json_from_text(text) == {"improved_prompt": "Write {n} lines"}
+
+
+def test_an_unclosed_brace_in_prose_before_the_object_is_skipped():
+    assert extract_json_from_text('a { b\n{"a": 1}') == {"a": 1}
+
+
+def test_braces_and_quotes_inside_strings_do_not_count():
+    text = '{"a": "}{\\"[", "b": {"c": "]"}}'
+    assert extract_json_from_text(text) == {"a": '}{"[', "b": {"c": "]"}}
+
+
+def test_nested_objects_and_arrays():
+    data = {"a": {"b": {"c": [1, {"d": [[], {}]}]}}, "e": [{"f": None}]}
+    assert extract_json_from_text("Result: " + json.dumps(data) + " done") == data
+
+
+def test_truncated_output_keeps_its_complete_fields():
+    text = '{"total_score": 64, "scores": {"clarity": 14, "context": 12}, "improved_prompt": "You are an expert'
+    assert extract_json_from_text(text) == {
+        "total_score": 64,
+        "scores": {"clarity": 14, "context": 12},
+        "improved_prompt": "You are an expert",
+    }
+
+
+def test_output_cut_inside_a_key_falls_back_to_the_last_complete_member():
+    assert extract_json_from_text('{"a": 1, "b": [1, 2], "c') == {"a": 1, "b": [1, 2]}
+
+
+def test_trailing_commas_are_dropped():
+    assert extract_json_from_text('{"a": [1, 2,], "b": 3,}') == {"a": [1, 2], "b": 3}
+
+
+def test_without_repair_truncated_output_is_an_error():
+    with pytest.raises(json.JSONDecodeError):
+        extract_json_from_text('{"a": 1, "b": 2', repair=False)
+
+
+def test_output_without_an_object_is_an_error():
+    with pytest.raises(json.JSONDecodeError):
+        extract_json_from_text("I cannot evaluate this prompt.")
+
+
+@pytest.mark.parametrize(
+    "text",
+    ["{" * 3000, '{"a": [' * 1500, "x {" * 3000, "{ a " * 3000],
+    ids=["braces", "deep-nesting", "braces-in-prose", "unclosed-prose"],
+)
+def test_pathological_output_neither_recurses_nor_hangs(text):
+    started = time.perf_counter()
+    try:
+        result = extract_json_from_text(text)
+    except json.JSONDecodeError:
+        result = None
+    assert result is None or isinstance(result, dict)
+    assert time.perf_counter() - started < 2
+
+
+def test_streamed_chunks_give_the_object_as_soon_as_it_is_complete():
+    scanner = JsonObjectScanner()
+    assert scanner.feed('Here: {"a": {"b": ') is None
+    assert scanner.feed('[1, "}"]}') is None
+    assert scanner.feed('} and some trailing prose') == {"a": {"b": [1, "}"]}}
+    assert scanner.finish() == {"a": {"b": [1, "}"]}}
@@ -0,0 +1,68 @@
+import time
+
+import pytest
+
+from optimizer import OptimizeSettings, optimize_prompt
+from scheduler import RequestShedError
+from timeouts import DeadlineExceededError
+
+PROMPT = (
+    "You are a senior data analyst. Summarize the attached quarterly sales report for the executive team "
+    "in five bullet points, covering revenue, margin and regional trends, in under 150 words."
+)
+
+START = {
+    "total_score": 40,
+    "scores": {},
+    "improved_prompt": PROMPT + " Use a neutral, factual tone.",
+}
+
+
+def test_time_budget_running_out_during_a_model_call_stops_the_loop(stub, backend):
+    # Far slower than the budget: the deadline, not the stage's own timeouts, ends the call
+    stub.token_delay = 0.5
+    started = time.monotonic()
+
+    result = optimize_prompt(PROMPT, settings=OptimizeSettings(time_budget_s=1.5, target=100), start_evaluation=START)
+
+    assert result["stop_reason"] == "time"
+    assert [r["round"] for r in result["rounds"]] == [0]
+    assert time.monotonic() - started < 5
+
+
+def test_a_shed_call_the_budget_could_not_wait_for_stops_the_loop(monkeypatch):
+    def shed(*args, **kwargs):
+        raise RequestShedError(eta_s=3600, max_wait_s=60)
+
+    monkeypatch.setattr("optimizer.call_prompt_evaluator_with_usage", shed)
+    result = optimize_prompt(PROMPT, settings=OptimizeSettings(time_budget_s=60), start_evaluation=START)
+
+    assert result["stop_reason"] == "time"
+    assert len(result["rounds"]) == 1
+
+
+def test_a_calls_own_timeout_is_not_the_budget(monkeypatch):
+    def timeout(*args, **kwargs):
+        # A nested stage's deadline, well before the loop's
+        raise DeadlineExceededError(deadline=time.monotonic())
+
+    monkeypatch.setattr("optimizer.call_prompt_evaluator_with_usage", timeout)
+    with pytest.raises(DeadlineExceededError):
+        optimize_prompt(PROMPT, settings=OptimizeSettings(time_budget_s=600), start_evaluation=START)
+
+
+def test_a_round_that_spends_the_token_budget_ends_the_loop(monkeypatch):
+    calls = []
+
+    def evaluate(prompt, options=None):
+        calls.append(prompt)
+        evaluation = {"total_score": 40 + len(calls), "scores": {}, "improved_prompt": f"{PROMPT} v{len(calls)}"}
+        return evaluation, {"prompt_tokens": 800, "completion_tokens": 400, "cached": False}
+
+    monkeypatch.setattr("optimizer.call_prompt_evaluator_with_usage", evaluate)
+    result = optimize_prompt(PROMPT, settings=OptimizeSettings(token_budget=1000, target=100), start_evaluation=START)
+
+    # The first rewrite spent 1200 of 1000 tokens: no second one is evaluated
+    assert result["stop_reason"] == "tokens"
+    assert len(calls) == 1
+    assert result["tokens"] == 1200
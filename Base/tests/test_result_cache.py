@@ -0,0 +1,169 @@
+import contextvars
+
+import pytest
+
+import evaluator
+import result_cache
+from result_cache import ResultCache
+from scheduler import current_session
+
+PROMPT = "Summarize the attached quarterly sales report for the executive team in five bullet points."
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """
+    The cache's clock, advanced by hand: clock.now += seconds.
+    """
+
+    class Clock:
+        now = 1_000_000.0
+
+        def time(self):
+            return self.now
+
+    fake = Clock()
+    monkeypatch.setattr(result_cache.time, "time", fake.time)
+    return fake
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return ResultCache(str(tmp_path / "cache.sqlite3"), max_entries=3, ttl_seconds=60)
+
+
+def test_keys_depend_on_every_part_and_not_on_dict_order():
+    assert ResultCache.make_key("a", {"x": 1, "y": 2}) == ResultCache.make_key("a", {"y": 2, "x": 1})
+    assert ResultCache.make_key("a", {"x": 1}) != ResultCache.make_key("b", {"x": 1})
+
+
+def test_a_stored_value_is_read_back_and_counted(cache):
+    assert cache.get("k") is None
+    cache.set("k", {"total_score": 70, "scores": {"clarity": 12}})
+
+    assert cache.get("k") == {"total_score": 70, "scores": {"clarity": 12}}
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+
+def test_the_least_recently_used_entry_is_evicted_first(cache, clock):
+    for key in ("a", "b", "c"):
+        cache.set(key, key)
+        clock.now += 1
+    cache.get("a")   # "b" is now the least recently used
+    clock.now += 1
+    cache.set("d", "d")
+
+    assert [cache.get(key) for key in ("a", "b", "c", "d")] == ["a", None, "c", "d"]
+    assert cache.stats()["evictions"] == 1
+
+
+def test_entries_expire_after_their_ttl_even_when_read(cache, clock):
+    cache.set("k", "value")
+    clock.now += 59
+    assert cache.get("k") == "value"
+    clock.now += 2
+
+    assert cache.get("k") is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_values_beyond_max_bytes_evict_the_oldest(tmp_path, clock):
+    cache = ResultCache(str(tmp_path / "answers.sqlite3"), ttl_seconds=60, max_bytes=250)
+    for key in ("a", "b", "c"):
+        cache.set(key, key * 100)   # ~100 bytes each, with the JSON quotes
+        clock.now += 1
+
+    assert cache.get("a") is None
+    assert cache.get("b") == "b" * 100
+    assert cache.stats()["bytes"] <= 250
+
+
+def test_the_cache_survives_a_restart(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    ResultCache(path).set("k", [1, 2])
+
+    assert ResultCache(path).get("k") == [1, 2]
+
+
+@pytest.fixture
+def chat_calls(backend, monkeypatch):
+    """
+    The calls that reached the backend's chat, by call type.
+    """
+    calls = []
+    chat = backend.chat
+
+    def counting_chat(*args, **kwargs):
+        calls.append(kwargs.get("call"))
+        return chat(*args, **kwargs)
+
+    monkeypatch.setattr(backend, "chat", counting_chat)
+    return calls
+
+
+def test_a_cached_evaluation_costs_no_model_call(tmp_path, monkeypatch, chat_calls):
+    cache = ResultCache(str(tmp_path / "evaluations.sqlite3"))
+    monkeypatch.setattr(evaluator, "get_eval_cache", lambda: cache)
+
+    first, usage = evaluator.call_prompt_evaluator_with_usage(PROMPT)
+    calls = len(chat_calls)
+    second, cached_usage = evaluator.call_prompt_evaluator_with_usage(PROMPT)
+
+    assert second == first
+    assert len(chat_calls) == calls
+    assert not usage["cached"]
+    assert cached_usage["cached"]
+    assert cached_usage["completion_tokens"] == 0
+
+
+def test_other_generation_options_are_another_entry(tmp_path, monkeypatch, chat_calls):
+    cache = ResultCache(str(tmp_path / "evaluations.sqlite3"))
+    monkeypatch.setattr(evaluator, "get_eval_cache", lambda: cache)
+
+    evaluator.call_prompt_evaluator_with_usage(PROMPT)
+    evaluator.call_prompt_evaluator_with_usage(PROMPT, {"temperature": 0.7})
+
+    assert cache.stats()["entries"] == 2
+
+
+@pytest.fixture
+def answer_cache(tmp_path, monkeypatch):
+    cache = ResultCache(str(tmp_path / "answers.sqlite3"), ttl_seconds=60, max_bytes=1024 * 1024)
+    monkeypatch.setattr(evaluator, "get_answer_cache", lambda: cache)
+    return cache
+
+
+def answer_as(session: str, prompt: str):
+    def run():
+        current_session.set(session)
+        return evaluator.call_llm_answer_result(prompt)
+
+    return contextvars.copy_context().run(run)
+
+
+def test_an_answer_is_shared_across_sessions(answer_cache, chat_calls):
+    first = answer_as("A", "Say hello.")
+    second = answer_as("B", "Say hello.")
+
+    assert chat_calls == ["answer"]
+    assert second.cached
+    assert second.content == first.content
+
+
+def test_a_forced_answer_skips_the_cache(answer_cache, chat_calls):
+    evaluator.call_llm_answer("Say hello.")
+    evaluator.call_llm_answer("Say hello.", force=True)
+
+    assert chat_calls == ["answer", "answer"]
+    assert answer_cache.stats()["entries"] == 1
+
+
+def test_a_streamed_answer_fills_the_cache_for_both_comparison_paths(answer_cache, chat_calls):
+    streamed = "".join(evaluator.call_llm_answer_stream("Say hello."))
+    results = evaluator.generate_answers_parallel({"original": "Say hello.", "improved": "Say hello politely."})
+
+    assert results["original"][0].cached
+    assert results["original"][0].content == streamed
+    assert not results["improved"][0].cached
+    assert chat_calls == ["answer"]   # the streamed call goes through stream, the uncached one through chat
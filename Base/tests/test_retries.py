@@ -0,0 +1,119 @@
+import pytest
+import requests
+
+import evaluator
+import stub_ollama
+from evaluator import ChatResult
+
+MESSAGES = [{"role": "user", "content": "Say hello."}]
+
+
+@pytest.fixture
+def failures(stub, monkeypatch):
+    """
+    Make the stub fail its next `failures.left` requests with a 500;
+    `failures.requests` counts the requests it received.
+    """
+
+    class Failures:
+        left = 0
+        requests = 0
+
+        def draw(self):
+            self.requests += 1
+            if self.left:
+                self.left -= 1
+                return 0.0   # below fail_rate: fail
+            return 1.0
+
+    fake = Failures()
+    stub.fail_rate = 0.5
+    monkeypatch.setattr(stub_ollama.random, "random", fake.draw)
+    # A fresh router, so the failures don't eject the stub host for later tests
+    router = evaluator.get_router.__wrapped__()
+    monkeypatch.setattr(evaluator, "get_router", lambda: router)
+    return fake
+
+
+def chat(backend):
+    return backend.chat(MESSAGES, evaluator.LLM_MODEL, evaluator.call_timeouts("answer"))
+
+
+def test_transient_server_errors_are_retried(backend, failures):
+    failures.left = evaluator.OLLAMA_MAX_ATTEMPTS - 1
+
+    assert chat(backend).content.startswith("Stub answer to:")
+    assert failures.requests == evaluator.OLLAMA_MAX_ATTEMPTS
+
+
+def test_a_server_error_on_every_attempt_is_raised(backend, failures):
+    failures.left = evaluator.OLLAMA_MAX_ATTEMPTS + 1
+
+    with pytest.raises(requests.exceptions.HTTPError) as raised:
+        chat(backend)
+    assert raised.value.response.status_code == 500
+    assert failures.requests == evaluator.OLLAMA_MAX_ATTEMPTS
+
+
+def test_a_failed_stream_is_retried_before_its_first_chunk(backend, failures):
+    failures.left = 1
+    chunks = list(backend.stream(MESSAGES, evaluator.LLM_MODEL, evaluator.call_timeouts("answer")))
+
+    assert "".join(chunks).startswith("Stub answer to:")
+    assert failures.requests == 2
+
+
+def response(status: int) -> requests.Response:
+    resp = requests.Response()
+    resp.status_code = status
+    return resp
+
+
+@pytest.mark.parametrize(
+    "error, retryable",
+    [
+        (requests.exceptions.ConnectionError(), True),
+        (requests.exceptions.HTTPError(response=response(503)), True),
+        (requests.exceptions.HTTPError(response=response(429)), True),
+        (requests.exceptions.HTTPError(response=response(400)), False),
+        (requests.exceptions.ReadTimeout(), False),
+    ],
+    ids=["connection", "503", "429", "400", "read-timeout"],
+)
+def test_only_errors_before_the_model_generated_are_retried(error, retryable):
+    assert evaluator.is_retryable(error) is retryable
+
+
+def test_unparseable_output_is_repaired_by_the_model(backend):
+    evaluation, usage = evaluator.parse_evaluation_with_repair("I'm sorry, here is my evaluation: it is good.")
+
+    assert usage["repairs"] == 1
+    assert usage["completion_tokens"] > 0
+    assert 1 <= evaluation["total_score"] <= 100
+
+
+def test_output_that_parses_needs_no_repair(backend):
+    text = stub_ollama.stub_reply({"format": "json", "messages": MESSAGES})
+    _, usage = evaluator.parse_evaluation_with_repair(text)
+    assert usage["repairs"] == 0
+
+
+def test_repairs_stop_after_the_limit(monkeypatch):
+    repairs = []
+
+    def repair(text, error, stage="evaluate"):
+        repairs.append(text)
+        return ChatResult(content="still not JSON", model="stub", call="repair", prompt_eval_count=10, eval_count=3)
+
+    monkeypatch.setattr(evaluator, "repair_evaluation_json", repair)
+    monkeypatch.setattr(evaluator, "EVALUATOR_MAX_REPAIRS", 2)
+    with pytest.raises(ValueError):
+        evaluator.parse_evaluation_with_repair("not JSON")
+    assert repairs == ["not JSON", "still not JSON"]
+
+
+def test_a_stage_missing_its_fields_is_repaired(backend):
+    fields, usage = evaluator.parse_stage_output('{"total_score": 50}', "score")
+
+    assert usage["repairs"] == 1
+    assert set(fields) == set(evaluator.STAGE_FIELDS["score"])
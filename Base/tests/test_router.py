@@ -0,0 +1,34 @@
+import evaluator
+from ollama_router import OllamaRouter
+
+HOSTS = ["http://host-a:11434", "http://host-b:11434", "http://host-c:11434"]
+
+
+def spread(router, model, calls):
+    """
+    Outstanding calls per host after `calls` concurrent acquires.
+    """
+    for _ in range(calls):
+        router.acquire(model)
+    return [backend.outstanding for backend in router.backends]
+
+
+def test_the_router_spills_over_once_a_host_runs_its_parallel_generations(monkeypatch):
+    monkeypatch.setattr(evaluator, "LLM_BACKEND", "ollama")
+    monkeypatch.setattr(evaluator, "OLLAMA_BASE_URLS", HOSTS)
+    monkeypatch.setattr(evaluator, "OLLAMA_NUM_PARALLEL", 2)
+    monkeypatch.setattr(evaluator, "LLM_CONCURRENCY", 6)
+    router = evaluator.get_router.__wrapped__()
+    assert router.saturation == 2
+
+    # The model is loaded on two of the three hosts: they fill up first, then the third takes the rest
+    for backend in router.backends[:2]:
+        backend.models.add("llama3.3:latest")
+    assert sorted(spread(router, "llama3.3", 6)) == [2, 2, 2]
+
+
+def test_the_router_keeps_a_model_on_warm_hosts_until_they_are_saturated():
+    router = OllamaRouter(HOSTS, saturation=2)
+    router.backends[0].models.add("llama3.3:latest")
+
+    assert spread(router, "llama3.3", 2)[0] == 2
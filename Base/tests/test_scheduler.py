@@ -0,0 +1,219 @@
+import threading
+import time
+
+import pytest
+
+import evaluator
+from scheduler import FairScheduler, RequestShedError, current_session
+
+
+def hold(scheduler, session, seconds):
+    """
+    Take a slot for `seconds`, so the scheduler measures a call that long.
+    """
+    with scheduler.slot(session, max_wait_s=60):
+        time.sleep(seconds)
+
+
+def acquire_in_background(scheduler, session, max_wait_s):
+    outcome = {}
+
+    def acquire():
+        try:
+            outcome["ticket"] = scheduler.acquire(session, max_wait_s)
+        except RequestShedError as e:
+            outcome["error"] = e
+
+    thread = threading.Thread(target=acquire, daemon=True)
+    thread.start()
+    return thread, outcome
+
+
+def test_nothing_is_shed_before_a_call_has_been_measured():
+    scheduler = FairScheduler(slots=1)
+    busy = scheduler.acquire("A", max_wait_s=1)
+    assert scheduler.stats()["avg_call_s"] is None
+
+    thread, outcome = acquire_in_background(scheduler, "B", max_wait_s=5)
+    time.sleep(0.2)
+    assert scheduler.session_status("B") == {"running": 0, "queued": 1, "position": 1, "eta_s": None}
+    scheduler.release(busy)
+    thread.join(5)
+
+    assert "ticket" in outcome
+    assert scheduler.stats()["shed"] == 0
+
+
+def test_without_an_estimate_a_request_is_shed_when_its_wait_runs_out():
+    scheduler = FairScheduler(slots=1)
+    busy = scheduler.acquire("A", max_wait_s=1)
+    started = time.monotonic()
+
+    with pytest.raises(RequestShedError):
+        scheduler.acquire("B", max_wait_s=0.3)
+    assert time.monotonic() - started >= 0.3
+    scheduler.release(busy)
+
+
+def test_a_request_is_shed_right_away_once_its_estimated_wait_is_too_long():
+    scheduler = FairScheduler(slots=1)
+    hold(scheduler, "A", 0.3)
+    busy = scheduler.acquire("A", max_wait_s=1)
+    started = time.monotonic()
+
+    with pytest.raises(RequestShedError) as shed:
+        scheduler.acquire("B", max_wait_s=0.1)
+    assert time.monotonic() - started < 0.1
+    assert shed.value.eta_s == pytest.approx(0.3, abs=0.1)
+    scheduler.release(busy)
+
+
+def test_the_first_measured_call_sets_the_estimate_and_later_ones_move_it():
+    scheduler = FairScheduler(slots=2, alpha=0.5)
+    hold(scheduler, "A", 0.2)
+    assert scheduler.stats()["avg_call_s"] == pytest.approx(0.2, abs=0.05)
+    hold(scheduler, "A", 0.6)
+    assert scheduler.stats()["avg_call_s"] == pytest.approx(0.4, abs=0.05)
+
+
+def test_the_eta_grows_with_the_queue_position_and_shrinks_with_slots():
+    scheduler = FairScheduler(slots=2, initial_service_s=10.0)
+    running = [scheduler.acquire("A", max_wait_s=60) for _ in range(2)]
+    waiting = [acquire_in_background(scheduler, "B", max_wait_s=60) for _ in range(3)]
+    time.sleep(0.2)
+
+    # Position 1 needs one of two slots to free up: half a call
+    status = scheduler.session_status("B")
+    assert status["position"] == 1
+    assert status["queued"] == 3
+    assert status["eta_s"] == 5.0
+
+    for ticket in running:
+        scheduler.release(ticket)
+    for thread, outcome in waiting:
+        thread.join(5)
+        scheduler.release(outcome["ticket"])
+
+
+def test_sessions_are_served_round_robin():
+    scheduler = FairScheduler(slots=1, initial_service_s=1.0)
+    busy = scheduler.acquire("A", max_wait_s=60)
+    waiting = []
+    for session in ("A", "A", "B"):
+        waiting.append((session, *acquire_in_background(scheduler, session, max_wait_s=60)))
+        time.sleep(0.05)
+
+    # B's call is served before A's second one, although it was queued later
+    assert scheduler.session_status("B")["position"] == 2
+    scheduler.release(busy)
+    order = []
+    while waiting:
+        time.sleep(0.05)
+        for entry in [w for w in waiting if "ticket" in w[2]]:
+            order.append(entry[0])
+            scheduler.release(entry[2]["ticket"])
+            waiting.remove(entry)
+    assert order == ["A", "B", "A"]
+
+
+def install_scheduler(monkeypatch, slots: int) -> FairScheduler:
+    """
+    A scheduler installed as the process-wide one; its `order` list records
+    the session of each call it lets through, in order.
+    """
+    scheduler = FairScheduler(slots=slots)
+    scheduler.order = []
+    acquire = scheduler.acquire
+
+    def recording_acquire(session, max_wait_s):
+        ticket = acquire(session, max_wait_s)
+        scheduler.order.append(session)
+        return ticket
+
+    monkeypatch.setattr(scheduler, "acquire", recording_acquire)
+    monkeypatch.setattr(evaluator, "_scheduler", scheduler)
+    return scheduler
+
+
+@pytest.fixture
+def one_slot(monkeypatch):
+    return install_scheduler(monkeypatch, slots=1)
+
+
+def in_session(session: str, fn, *args) -> threading.Thread:
+    """
+    Run fn(*args) on a thread of its own, as `session`.
+    """
+
+    def run():
+        current_session.set(session)
+        fn(*args)
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread
+
+
+def test_streamed_evaluations_from_two_sessions_interleave(stub, backend, one_slot):
+    stub.token_delay = 0.002
+
+    def evaluate(prompt):
+        for _ in evaluator.call_prompt_evaluator_stream(prompt):
+            pass
+
+    first = [in_session("A", evaluate, f"Write a haiku about the number {i}.") for i in range(4)]
+    time.sleep(0.1)
+    second = in_session("B", evaluate, "Write a limerick about a cat.")
+    time.sleep(0.1)
+
+    # B's stream waits for a slot in the scheduler, not in a worker pool in front of it
+    assert one_slot.session_status("B")["queued"] == 1
+    for thread in [*first, second]:
+        thread.join(30)
+    assert one_slot.order.index("B") <= 2
+    assert sorted(one_slot.order) == ["A"] * 4 + ["B"]
+
+
+def test_comparison_answers_queue_in_the_scheduler_beside_other_sessions_streams(stub, backend, monkeypatch):
+    scheduler = install_scheduler(monkeypatch, slots=2)
+    stub.token_delay = 0.05
+
+    def stream_answers(count):
+        for _, kind, value in evaluator.stream_answers_parallel({i: f"Say hello #{i}." for i in range(count)}):
+            assert kind != "error", value
+
+    answers = {}
+
+    def compare():
+        answers.update(evaluator.generate_answers_parallel({"original": "Say hi.", "improved": "Say hi politely."}))
+
+    first = in_session("A", stream_answers, 4)
+    time.sleep(0.1)
+    second = in_session("B", compare)
+    time.sleep(0.1)
+
+    # Both answers wait in B's scheduler queue, and B's turn comes before A's last calls
+    assert scheduler.session_status("B")["queued"] == 2
+    first.join(30)
+    second.join(30)
+    assert scheduler.order.index("B") <= 3
+    assert all(error is None for _, error in answers.values())
+
+
+def test_streamed_comparison_answers_from_two_sessions_interleave(stub, backend, one_slot):
+    stub.token_delay = 0.05
+
+    def stream_answers(session, count):
+        prompts = {i: f"Say hello #{i} from {session}." for i in range(count)}
+        for _, kind, value in evaluator.stream_answers_parallel(prompts):
+            assert kind != "error", value
+
+    first = in_session("A", stream_answers, "A", 4)
+    time.sleep(0.1)
+    second = in_session("B", stream_answers, "B", 1)
+    time.sleep(0.1)
+
+    assert one_slot.session_status("B")["queued"] == 1
+    first.join(30)
+    second.join(30)
+    assert one_slot.order == ["A", "A", "B", "A", "A"]
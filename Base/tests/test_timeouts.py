@@ -0,0 +1,24 @@
+import time
+
+import pytest
+
+import evaluator
+from timeouts import DeadlineExceededError
+
+PROMPT = "Summarize the attached quarterly sales report for the executive team in five bullet points."
+
+
+@pytest.mark.parametrize("stream", [False, True], ids=["chat", "stream"])
+def test_a_timeout_the_deadline_cut_short_is_a_deadline_error(stub, backend, stream):
+    stub.token_delay = 0.5
+    deadline = time.monotonic() + 1.0
+    messages = [{"role": "user", "content": PROMPT}]
+    timeouts = evaluator.call_timeouts("evaluate")
+
+    with pytest.raises(DeadlineExceededError) as raised:
+        if stream:
+            for _ in backend.stream(messages, evaluator.LLM_MODEL, timeouts, deadline=deadline):
+                pass
+        else:
+            backend.chat(messages, evaluator.LLM_MODEL, timeouts, deadline=deadline)
+    assert raised.value.deadline == deadline
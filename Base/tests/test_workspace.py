@@ -0,0 +1,100 @@
+import threading
+import time
+
+import pytest
+
+import workspace
+from jobs import Job, JobCancelledError
+
+EVALUATION = {"total_score": 70, "scores": {}, "improved_prompt": "Better prompt."}
+
+
+def new_job() -> Job:
+    return Job(id="job", kind="workspace", label="workspace", session="s")
+
+
+def test_failed_prompts_count_as_finished(monkeypatch):
+    def evaluate(prompt, options=None):
+        if prompt == "bad":
+            raise RuntimeError("model crashed")
+        return EVALUATION, {"cached": False}
+
+    monkeypatch.setattr(workspace, "call_prompt_evaluator_with_usage", evaluate)
+    job = new_job()
+    results = workspace.workspace_job(job, ["good", "bad", "good too"])
+
+    # The progress bar reaches N of N even though a prompt failed
+    assert job.progress["finished"] == 3
+    assert job.progress["failed"] == 1
+    assert [r["error"] for r in results] == [None, "model crashed", None]
+
+
+def test_every_variant_is_evaluated_in_order(backend):
+    prompts = [f"Write a haiku about the number {i}." for i in range(5)]
+    job = new_job()
+    results = workspace.workspace_job(job, prompts)
+
+    assert [r["prompt"] for r in results] == prompts
+    assert all(1 <= r["evaluation"]["total_score"] <= 100 for r in results)
+    assert job.progress == {"results": results, "finished": 5, "failed": 0}
+    rows = workspace.table_rows(results)
+    assert [row["#"] for row in rows] == [1, 2, 3, 4, 5]
+    assert rows[0]["Total"] == results[0]["evaluation"]["total_score"]
+
+
+def test_at_most_workspace_concurrency_evaluations_run_at_once(monkeypatch):
+    lock = threading.Lock()
+    running = []
+    peak = []
+
+    def evaluate(prompt, options=None):
+        with lock:
+            running.append(prompt)
+            peak.append(len(running))
+        time.sleep(0.05)
+        with lock:
+            running.remove(prompt)
+        return EVALUATION, {"cached": False}
+
+    monkeypatch.setattr(workspace, "WORKSPACE_CONCURRENCY", 2)
+    monkeypatch.setattr(workspace, "call_prompt_evaluator_with_usage", evaluate)
+    workspace.workspace_job(new_job(), [str(i) for i in range(6)])
+
+    assert max(peak) == 2
+
+
+def test_a_cancelled_workspace_starts_no_more_evaluations(monkeypatch):
+    job = new_job()
+    evaluated = []
+
+    def evaluate(prompt, options=None):
+        evaluated.append(prompt)
+        job.cancel_requested.set()   # cancelled while the first evaluation runs
+        return EVALUATION, {"cached": False}
+
+    monkeypatch.setattr(workspace, "WORKSPACE_CONCURRENCY", 1)
+    monkeypatch.setattr(workspace, "call_prompt_evaluator_with_usage", evaluate)
+    with pytest.raises(JobCancelledError):
+        workspace.workspace_job(job, [str(i) for i in range(5)])
+    assert evaluated == ["0"]
+
+
+@pytest.mark.parametrize(
+    "text, variants",
+    [
+        ("First prompt.\n---\nSecond\nprompt.\n-----\n\nThird.", ["First prompt.", "Second\nprompt.", "Third."]),
+        ("One per line.\n\nAnother one.", ["One per line.", "Another one."]),
+    ],
+    ids=["separators", "lines"],
+)
+def test_pasted_variants_are_split(text, variants):
+    assert workspace.split_variants(text) == variants
+
+
+def test_uploaded_csv_and_jsonl_read_the_prompt_column():
+    csv = "id,text\n1,First prompt\n2,\n3,Third prompt\n".encode("utf-8-sig")
+    jsonl = b'{"prompt": "First"}\n\n{"prompt": " Second "}\n'
+
+    assert workspace.read_uploaded_variants("variants.csv", csv, "text") == ["First prompt", "Third prompt"]
+    assert workspace.read_uploaded_variants("variants.jsonl", jsonl) == ["First", "Second"]
+    assert workspace.read_uploaded_variants("variants.txt", b"A\n---\nB") == ["A", "B"]
@@ -0,0 +1,141 @@
+# timeouts.py
+#
+# Per-stage timeouts and deadlines for model calls.
+#
+# Each call type (evaluate, answer, ...) gets a connect timeout, a first-byte
+# timeout (queueing on the server, model load and prompt ingestion), an
+# inter-chunk timeout (a stream that stops making progress) and an overall
+# budget. The budget becomes a deadline that nested work (scheduler waits,
+# retries, a repair call) inherits through a context variable, so no retry
+# ever runs past what the user was promised.
+
+import contextlib
+import contextvars
+import time
+from dataclasses import dataclass, fields, replace
+
+import requests
+import urllib3
+
+# Absolute time.monotonic() deadline of the current stage, if any
+current_deadline = contextvars.ContextVar("llm_deadline", default=None)
+
+
+class DeadlineExceededError(requests.exceptions.Timeout):
+    """
+    The stage ran out of its overall time budget. `deadline` is the one that
+    expired, so callers can tell their own budget from a nested stage's.
+    """
+
+    def __init__(self, message: str = "The request ran out of its time budget.", deadline: float | None = None):
+        super().__init__(message)
+        self.deadline = deadline
+
+
+@dataclass(frozen=True)
+class Timeouts:
+    connect: float = 5.0
+    first_byte: float = 120.0
+    inter_chunk: float = 30.0
+    total: float = 180.0
+
+
+def parse_timeouts(spec: str, default: Timeouts) -> Timeouts:
+    """
+    Override fields of `default` from a spec like "first_byte=60,total=120".
+    """
+    names = {f.name for f in fields(Timeouts)}
+    values = {}
+    for part in filter(None, (p.strip() for p in spec.split(","))):
+        name, _, value = part.partition("=")
+        name = name.strip()
+        if name not in names:
+            raise ValueError(f"Unknown timeout {name!r} in {spec!r}; expected {', '.join(sorted(names))}")
+        values[name] = float(value)
+    return replace(default, **values)
+
+
+def stage_deadline(total_s: float) -> float:
+    """
+    The deadline for a stage starting now: its own budget, capped by any
+    deadline it runs under.
+    """
+    deadline = time.monotonic() + total_s
+    outer = current_deadline.get()
+    return deadline if outer is None else min(deadline, outer)
+
+
+@contextlib.contextmanager
+def deadline_scope(total_s: float):
+    """
+    Run the block under stage_deadline(total_s). Don't use it around a `yield`:
+    generators should take an explicit deadline instead.
+    """
+    token = current_deadline.set(stage_deadline(total_s))
+    try:
+        yield
+    finally:
+        current_deadline.reset(token)
+
+
+def remaining(deadline: float | None) -> float:
+    """
+    Seconds left until `deadline` (infinite without one).
+    """
+    return float("inf") if deadline is None else deadline - time.monotonic()
+
+
+def check_deadline(deadline: float | None) -> float:
+    """
+    Return the seconds left, or raise DeadlineExceededError if none are.
+    """
+    left = remaining(deadline)
+    if left <= 0:
+        raise DeadlineExceededError(deadline=deadline)
+    return left
+
+
+def deadline_passed(deadline: float | None) -> bool:
+    """
+    Whether `deadline` has run out. A timeout that fires once it has is the
+    deadline's: the timeout was capped to the time left.
+    """
+    return remaining(deadline) <= 0
+
+
+def set_read_timeout(resp: requests.Response, seconds: float) -> None:
+    """
+    Change the read timeout of an open streaming response, e.g. from the
+    first-byte timeout to the inter-chunk timeout once tokens flow.
+    """
+    connection = getattr(resp.raw, "connection", None)
+    sock = getattr(connection, "sock", None)
+    if sock is not None:
+        sock.settimeout(seconds)
+
+
+def iter_lines_within(resp: requests.Response, timeouts: Timeouts, deadline: float | None):
+    """
+    Lines of a streaming response. The first must arrive within
+    `timeouts.first_byte`, each later one within `timeouts.inter_chunk` of the
+    previous, and all of them before `deadline`.
+    """
+    lines = resp.iter_lines()
+    limit = timeouts.first_byte
+    while True:
+        left = check_deadline(deadline)
+        wait = min(limit, left)
+        set_read_timeout(resp, wait)
+        try:
+            line = next(lines)
+        except StopIteration:
+            return
+        except requests.exceptions.ConnectionError as e:
+            # requests reports a read timeout mid-stream as a ConnectionError
+            if not (e.args and isinstance(e.args[0], urllib3.exceptions.ReadTimeoutError)):
+                raise
+            if wait < limit:
+                raise DeadlineExceededError(deadline=deadline) from e
+            raise requests.exceptions.ReadTimeout(f"No data from the model for {wait:.3g} s.") from e
+        limit = timeouts.inter_chunk
+        yield line
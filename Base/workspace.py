@@ -0,0 +1,110 @@
+# workspace.py
+#
+# The app's workspace mode: evaluate many prompt variants at once. Variants
+# are pasted (separated by "---" lines) or uploaded (.txt, .csv, .jsonl),
+# evaluated concurrently as one background job, and compared in a table of
+# total and per-dimension scores.
+#
+# The job runs its evaluations on a pool of its own, WORKSPACE_CONCURRENCY at
+# a time; the model calls still go through the fair scheduler as the user's
+# session, so a large workspace doesn't crowd out other users.
+
+import io
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from batch_eval import iter_prompt_rows
+from evaluator import LLM_CONCURRENCY, SCORE_KEYS, call_prompt_evaluator_with_usage, submit_in_context
+
+WORKSPACE_CONCURRENCY = int(os.getenv("WORKSPACE_CONCURRENCY", str(max(1, LLM_CONCURRENCY))))   # evaluations in flight per workspace
+WORKSPACE_MAX_PROMPTS = int(os.getenv("WORKSPACE_MAX_PROMPTS", "200"))
+
+VARIANT_SEPARATOR = re.compile(r"^\s*-{3,}\s*$", re.MULTILINE)
+
+
+def split_variants(text: str) -> list:
+    """
+    Prompt variants pasted as one text: separated by lines of "---", or one
+    per line when there is no such separator.
+    """
+    parts = VARIANT_SEPARATOR.split(text) if VARIANT_SEPARATOR.search(text) else text.splitlines()
+    return [part.strip() for part in parts if part.strip()]
+
+
+def read_uploaded_variants(name: str, data: bytes, prompt_field: str = "prompt") -> list:
+    """
+    Prompt variants from an uploaded file: CSV and JSONL like batch_eval.py
+    (the `prompt_field` column), anything else like pasted text.
+    """
+    text = data.decode("utf-8-sig")
+    if name.endswith((".csv", ".jsonl")):
+        rows = iter_prompt_rows(io.StringIO(text, newline=""), name.endswith(".csv"), "id", prompt_field)
+        return [prompt.strip() for _, prompt in rows if prompt and prompt.strip()]
+    return split_variants(text)
+
+
+def pending_results(prompts: list) -> list:
+    """
+    Results for prompts that have not been evaluated yet.
+    """
+    return [{"prompt": prompt, "evaluation": None, "error": None, "wall_ms": None, "cached": False} for prompt in prompts]
+
+
+def workspace_job(job, prompts: list, options: dict | None = None) -> list:
+    """
+    Background job: evaluate every prompt, WORKSPACE_CONCURRENCY at a time,
+    publishing the results as they arrive, with how many prompts are finished
+    (evaluated or failed) and how many of those failed. Returns one result per
+    prompt, in order: {"prompt", "evaluation", "error", "wall_ms", "cached"}.
+    """
+    results = pending_results(prompts)
+
+    def evaluate(i):
+        job.check_cancelled()
+        started = time.perf_counter()
+        evaluation, usage = call_prompt_evaluator_with_usage(prompts[i], options)
+        return evaluation, usage, (time.perf_counter() - started) * 1000
+
+    pool = ThreadPoolExecutor(max_workers=min(WORKSPACE_CONCURRENCY, len(prompts)), thread_name_prefix="workspace")
+    try:
+        futures = {submit_in_context(pool, evaluate, i): i for i in range(len(prompts))}
+        for future in as_completed(futures):
+            i = futures[future]
+            try:
+                evaluation, usage, wall_ms = future.result()
+                results[i] = {
+                    **results[i],
+                    "evaluation": evaluation,
+                    "wall_ms": wall_ms,
+                    "cached": usage["cached"],
+                }
+            except Exception as e:
+                results[i] = {**results[i], "error": str(e) or type(e).__name__}
+            failed = sum(r["error"] is not None for r in results)
+            evaluated = sum(r["evaluation"] is not None for r in results)
+            job.update(results=list(results), finished=evaluated + failed, failed=failed)
+    finally:
+        # Once cancelled, the evaluations that haven't started never will
+        pool.shutdown(wait=True, cancel_futures=True)
+    return results
+
+
+def table_rows(results: list) -> list:
+    """
+    One table row per result: its number, prompt, scores and status.
+    """
+    rows = []
+    for number, result in enumerate(results, start=1):
+        evaluation = result["evaluation"]
+        row = {"#": number, "Prompt": result["prompt"]}
+        row["Total"] = evaluation["total_score"] if evaluation else None
+        for key in SCORE_KEYS:
+            row[key.capitalize()] = evaluation["scores"][key] if evaluation else None
+        if evaluation:
+            row["Status"] = "cached" if result["cached"] else f"{result['wall_ms'] / 1000:.1f} s"
+        else:
+            row["Status"] = f"❌ {result['error']}" if result["error"] else "⏳"
+        rows.append(row)
+    return rows